@@ -0,0 +1,120 @@
+import logging
+import os
+import pickle
+import threading
+import time
+import typing
+
+from strategies import STRATEGY_TYPES
+from trade_journal import journal
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+# Periodic checkpoints of the running strategies (settings, parameters, candles, indicator state, open position),
+# so that a warm restart rebuilds them and only fetches the klines missed since the last checkpoint, instead of the
+# full history of every strategy.
+
+CHECKPOINT_FILE = "strategy_checkpoints.pkl"
+CHECKPOINT_INTERVAL = 60  # seconds
+CHECKPOINT_CANDLES = 1000  # same depth as the history fetched at activation
+
+_TYPE_NAMES = {strategy_class: name for name, strategy_class in STRATEGY_TYPES.items()}
+
+
+class CheckpointStore:
+    def __init__(self, path: str = CHECKPOINT_FILE):
+        self.path = path
+
+    def save(self, states: typing.List[typing.Dict]):
+        # written next to the previous checkpoint and swapped in, so a crash while writing leaves the old one intact
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"time": int(time.time() * 1000), "strategies": states}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> typing.List[typing.Dict]:
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "rb") as f:
+                return pickle.load(f)['strategies']
+        except Exception as e:
+            logger.error("Could not read the strategy checkpoints in %s: %s", self.path, e)
+            return []
+
+
+def collect_states(exchanges: typing.Dict) -> typing.List[typing.Dict]:
+    states = []
+    for client in exchanges.values():
+        for b_index, strategy in client.strategies.snapshot().items():
+            if type(strategy) not in _TYPE_NAMES:
+                continue  # stand-ins of strategies running in worker processes keep no state here
+            state = strategy.checkpoint_state(CHECKPOINT_CANDLES)
+            state['strategy_type'] = _TYPE_NAMES[type(strategy)]
+            state['b_index'] = b_index
+            states.append(state)
+    return states
+
+
+class Checkpointer:
+    def __init__(self, exchanges: typing.Dict, store: CheckpointStore, interval: float = CHECKPOINT_INTERVAL):
+        self._exchanges = exchanges
+        self._store = store
+        self.interval = interval
+        self.running = True
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.checkpoint()
+
+    def checkpoint(self):
+        try:
+            start = time.perf_counter()
+            states = collect_states(self._exchanges)
+            self._store.save(states)
+            logger.debug("Checkpointed %s strategies in %.1f ms", len(states), (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            logger.error("Error while checkpointing the strategies: %s", e)
+
+
+def restore_strategy(client, state: typing.Dict) -> typing.Optional["Strategy"]:
+    # rebuilds a strategy from its checkpoint and fetches the candles it missed
+    contract = client.contracts.get(state['symbol'])
+    if contract is None or state['strategy_type'] not in STRATEGY_TYPES:
+        logger.error("Cannot restore %s %s strategy from its checkpoint", state['strategy_type'], state['symbol'])
+        return None
+
+    strategy = STRATEGY_TYPES[state['strategy_type']](client, contract, state['exchange'], state['timeframe'],
+                                                      state['usdt_input'], state['risk_to_reward'],
+                                                      state['parameters'])
+    strategy.restore_state(state, restore_trades=not journal.enabled)
+    if 'strategy_key' not in state:
+        strategy.assign_key(client.strategies.values())
+    if journal.enabled:
+        # the journal also has the trades closed or opened after the last checkpoint
+        strategy.restore_trades(journal.open_trades(strategy.strategy_key))
+
+    if strategy.candle_source == "resampled":
+        # the symbol's series has the history and the candles since the checkpoint
+        strategy.load_candles()
+        return strategy
+
+    if len(strategy.candles) == 0:
+        strategy.candles = client.get_historical_candles(contract, strategy.tf)
+        return strategy
+
+    fetched = client.get_candles_since(contract, strategy.tf, strategy.candles[-1].timestamp)
+    if len(fetched) >= CHECKPOINT_CANDLES:
+        # stopped for longer than the candles we keep, the checkpointed ones are useless
+        strategy.candles = client.get_historical_candles(contract, strategy.tf)
+    else:
+        strategy.top_up_candles(fetched)
+
+    return strategy
@@ -0,0 +1,144 @@
+import threading
+import typing
+from types import MappingProxyType
+
+from models import SpotBalance, MarginBalance
+
+AnyBalance = typing.Union[SpotBalance, MarginBalance]
+
+# Balances of one account, seeded from the REST account endpoint and then kept up to date with the events of the user
+# data stream (connectors/balance_websocket.py):
+#
+#   - outboundAccountPosition: absolute free / locked of the assets that changed, as of the event's update time (u)
+#   - balanceUpdate: delta of one asset (deposit, withdrawal, transfer between accounts), as of its clear time (T)
+#
+# Events can arrive out of order, and REST snapshots overlap with the stream, so every asset keeps the time of the
+# state it holds: an absolute state older than that is ignored, and so is a delta the state already includes.
+
+
+class BalanceBook:
+    """
+    Copy-on-write balances, like the strategy registry: writers (the balance websocket threads, REST refreshes, the
+    collateral pool) build new balance objects and a new dictionary under a lock and publish them with a single
+    reference assignment. Readers (get_trade_size on the strategy threads) get a complete version without locking,
+    and the balance objects of a version are never modified afterwards.
+    """
+
+    def __init__(self, balance_class: typing.Type[AnyBalance]):
+        self._balance_class = balance_class
+        self._write_lock = threading.Lock()
+        # (version, balances), replaced as a whole so a reader always gets a matching pair
+        self._state: typing.Tuple[int, typing.Mapping[str, AnyBalance]] = (0, MappingProxyType(dict()))
+
+        self._stamps: typing.Dict[str, int] = dict()  # ms exchange time of the state held per asset
+        # local changes already applied (collateral transfers), whose balanceUpdate must not be applied again
+        self._expected: typing.Dict[str, typing.List[float]] = dict()
+
+    def _publish(self, balances: typing.Dict[str, AnyBalance]):
+        # must be called with the write lock held
+        self._state = (self._state[0] + 1, MappingProxyType(balances))
+
+    def _new(self, asset: str, free: float, locked: float) -> AnyBalance:
+        return self._balance_class({"asset": asset, "free": free, "locked": locked})
+
+    ##### WRITERS #####
+
+    def apply_position(self, rows: typing.Iterable[typing.Tuple[str, float, float]], update_time: int) -> int:
+        # absolute (asset, free, locked) rows of a REST snapshot or an outboundAccountPosition event, returns the
+        # number of assets that were newer than the state held
+        with self._write_lock:
+            balances = dict(self._state[1])
+            applied = 0
+            for asset, free, locked in rows:
+                if update_time < self._stamps.get(asset, 0):
+                    continue
+                balances[asset] = self._new(asset, free, locked)
+                self._stamps[asset] = update_time
+                self._expected.pop(asset, None)  # the exchange's state includes the local changes made before it
+                applied += 1
+            if applied > 0:
+                self._publish(balances)
+            return applied
+
+    def apply_delta(self, asset: str, delta: float, clear_time: int) -> bool:
+        # balanceUpdate event
+        with self._write_lock:
+            if clear_time <= self._stamps.get(asset, 0):
+                return False  # already in the state held
+
+            expected = self._expected.get(asset)
+            if expected is not None:
+                for i, amount in enumerate(expected):
+                    if abs(amount - delta) < 1e-8:
+                        del expected[i]
+                        self._stamps[asset] = clear_time
+                        return False
+
+            balances = dict(self._state[1])
+            previous = balances.get(asset)
+            if previous is None:
+                balances[asset] = self._new(asset, delta, 0.0)
+            else:
+                balances[asset] = self._new(asset, previous.free + delta, previous.locked)
+            self._stamps[asset] = clear_time
+            self._publish(balances)
+            return True
+
+    def adjust(self, asset: str, delta: float, requested_at: int) -> bool:
+        # local change known before the exchange confirms it (a transfer that succeeded), so the next reads already
+        # include it; the matching balanceUpdate is then skipped. requested_at is the exchange time taken before the
+        # request: a state stamped later may already include the change (its event came before the response)
+        with self._write_lock:
+            if self._stamps.get(asset, 0) > requested_at:
+                return False
+
+            balances = dict(self._state[1])
+            previous = balances.get(asset)
+            if previous is None:
+                balances[asset] = self._new(asset, delta, 0.0)
+            else:
+                balances[asset] = self._new(asset, previous.free + delta, previous.locked)
+            self._expected.setdefault(asset, []).append(delta)
+            self._publish(balances)
+            return True
+
+    ##### READERS #####
+
+    def snapshot(self) -> typing.Mapping[str, AnyBalance]:
+        # immutable view of the current version, safe to read from any thread
+        return self._state[1]
+
+    def versioned(self) -> typing.Tuple[int, typing.Mapping[str, AnyBalance]]:
+        return self._state
+
+    @property
+    def version(self) -> int:
+        return self._state[0]
+
+    def free(self, asset: str) -> float:
+        balance = self._state[1].get(asset)
+        return balance.free if balance is not None else 0.0
+
+    def items(self):
+        return self._state[1].items()
+
+    def values(self):
+        return self._state[1].values()
+
+    def keys(self):
+        return self._state[1].keys()
+
+    def get(self, asset: str, default=None) -> typing.Optional[AnyBalance]:
+        return self._state[1].get(asset, default)
+
+    def __getitem__(self, asset: str) -> AnyBalance:
+        return self._state[1][asset]
+
+    def __contains__(self, asset) -> bool:
+        return asset in self._state[1]
+
+    def __iter__(self):
+        return iter(self._state[1])
+
+    def __len__(self) -> int:
+        return len(self._state[1])
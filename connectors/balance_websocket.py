@@ -1,5 +1,9 @@
+import hashlib
+import hmac
 import threading
 import time
+from urllib.parse import urlencode
+
 import websocket
 from connectors.binance_spot import BinanceSpotClient
 from connectors.binance_margin import BinanceMarginClient
@@ -8,13 +12,25 @@ from pprint import pprint
 import typing
 import requests
 import logging
+from metrics import metrics
+from order_manager import orders
+from connectors.time_sync import server_time, TIMESTAMP_ERROR
 from models import *
 
 logger = logging.getLogger()
 
+USER_STREAM_ENDPOINTS = {
+    "spot": "/api/v3/userDataStream",
+    "margin": "/sapi/v1/userDataStream",
+}
+KEEPALIVE_INTERVAL = 30 * 60  # listen keys expire after 60 minutes without a keepalive
+ROLLOVER_OPEN_TIMEOUT = 10  # seconds to wait for the new stream before giving up on a key switch
+
 
 class BalanceWebsocket:
-    def __init__(self, public_key, secret_key, spot: BinanceSpotClient, margin: BinanceMarginClient, testnet: bool):
+    def __init__(self, public_key, secret_key, spot: typing.Optional[BinanceSpotClient] = None,
+                 margin: typing.Optional[BinanceMarginClient] = None, testnet: bool = False):
+        # spot and margin can be attached later, so the listen keys and sockets don't wait for the clients at startup
         if testnet:
             self._base_url = "https://testnet.binance.vision/api"
             self._wss_url = "wss://stream.binancefuture.com/ws"
@@ -29,90 +45,218 @@ class BalanceWebsocket:
         self._secret_key = secret_key
         self._headers = {'X-MBX-APIKEY': self._public_key}
 
-        self._spot_listen_key = None
-        self._margin_listen_key = None
-        self._renew_listen_keys()
+        self._listen_keys = {"spot": self._create_listen_key("spot"), "margin": self._create_listen_key("margin")}
 
         ##### WEBSOCKETS #####
         self.spot_ws: websocket.WebSocketApp
         self.margin_ws: websocket.WebSocketApp
         self.spot_reconnect = True
         self.margin_reconnect = True
+        self.spot_ws_open = threading.Event()
+        self.margin_ws_open = threading.Event()
 
-        _spot_thread = threading.Thread(target=self._start_spot_ws)
+        # streams opened by a key switch, not yet receiving in place of the current one
+        self._pending_ws: typing.Dict[str, typing.Optional[websocket.WebSocketApp]] = {"spot": None, "margin": None}
+        self._pending_open = {"spot": threading.Event(), "margin": threading.Event()}
+        self._connected_before = {"spot": False, "margin": False}
+        self.last_balance_update: typing.Dict[str, typing.Optional[float]] = {"spot": None, "margin": None}
+        self._rollover_lock = threading.Lock()
+
+        self.spot_ws = self._new_ws("spot", self._listen_keys["spot"])
+        _spot_thread = threading.Thread(target=self._run_ws, args=("spot", self.spot_ws))
         _spot_thread.start()
 
-        _margin_thread = threading.Thread(target=self._start_margin_ws)
+        self.margin_ws = self._new_ws("margin", self._listen_keys["margin"])
+        _margin_thread = threading.Thread(target=self._run_ws, args=("margin", self.margin_ws))
         _margin_thread.start()
 
+        self._schedule_keepalive()
+
+    def attach(self, spot: BinanceSpotClient, margin: BinanceMarginClient):
+        self._spot = spot
+        self._margin = margin
+
+    def _generate_signature(self, data: typing.Dict) -> str:
+        return hmac.new(self._secret_key.encode(), urlencode(data).encode(), hashlib.sha256).hexdigest()
+
     def _make_request(self, method: str, endpoint: str, data):
-        response = None
-        if method == 'POST':
-            try:
-                response = requests.post(self._base_url + endpoint, params=data, headers=self._headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
+        if method not in ['GET', 'POST', 'PUT', 'DELETE']:
+            raise ValueError()
+
+        try:
+            response = requests.request(method, self._base_url + endpoint, params=data, headers=self._headers)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
 
-        if method == 'DELETE':
-            try:
-                response = requests.delete(self._base_url + endpoint, params=data, headers=self._headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
         if response.status_code == 200:
             return response.json()
         else:
             logger.error("Error while making %s request to %s:%s (error code %s)", method, endpoint, response.json(),
                          response.status_code)
+            if response.json().get('code') == TIMESTAMP_ERROR:
+                server_time.resync()
             return None
 
-    def _renew_listen_keys(self):
-        if self._spot_listen_key is None:
-            self._spot_listen_key = self._make_request('POST', "/api/v3/userDataStream", dict())['listenKey']
-            self._margin_listen_key = self._make_request('POST', "/sapi/v1/userDataStream", dict())['listenKey']
+    ##### LISTEN KEYS #####
 
-            # delete existing keys
-            self._make_request("DELETE", "/api/v3/userDataStream", {'listenKey': self._spot_listen_key})  # spot
-            self._make_request("DELETE", "/sapi/v1/userDataStream", {'listenKey': self._margin_listen_key})  # margin
+    def _create_listen_key(self, account: str) -> typing.Optional[str]:
+        response = self._make_request("POST", USER_STREAM_ENDPOINTS[account], dict())
+        if response is None:
+            return None
+        return response['listenKey']
 
-            # get new keys
-            spot_key = self._make_request('POST', "/api/v3/userDataStream", dict())['listenKey']
-            margin_key = self._make_request('POST', "/sapi/v1/userDataStream", dict())['listenKey']
-            self._spot_listen_key = spot_key
-            self._margin_listen_key = margin_key
+    def _schedule_keepalive(self):
+        t = threading.Timer(KEEPALIVE_INTERVAL, self._keepalive_listen_keys)
+        t.daemon = True
+        t.start()
 
-        else:
-            # delete existing keys
-            self._make_request("DELETE", "/api/v3/userDataStream", {'listenKey': self._spot_listen_key})  # spot
-            self._make_request("DELETE", "/sapi/v1/userDataStream", {'listenKey': self._margin_listen_key})  # margin
+    def _keepalive_listen_keys(self):
+        # a PUT extends the key's validity, so the running streams never have to change
+        for account in ["spot", "margin"]:
+            listen_key = self._listen_keys[account]
+            if listen_key is not None:
+                if self._make_request("PUT", USER_STREAM_ENDPOINTS[account], {'listenKey': listen_key}) is not None:
+                    continue
 
-            # get new keys
-            spot_key = self._make_request('POST', "/api/v3/userDataStream", dict())['listenKey']
-            margin_key = self._make_request('POST', "/sapi/v1/userDataStream", dict())['listenKey']
-            self._spot_listen_key = spot_key
-            self._margin_listen_key = margin_key
+            logger.warning("%s listen key keepalive failed, switching to a new key", account.capitalize())
+            self._rollover(account)
 
-        t = threading.Timer(45 * 60, self._renew_listen_keys)
-        t.start()
+        if self.spot_reconnect or self.margin_reconnect:
+            self._schedule_keepalive()
+
+    def _rollover(self, account: str):
+        # make-before-break: the new stream must be open before the old one is closed, so no event is missed
+        with self._rollover_lock:
+            old_key = self._listen_keys[account]
+            new_key = self._create_listen_key(account)
+            if new_key is None:
+                return
+            if new_key == old_key:
+                return  # the key was still valid, Binance returned it and extended it
+
+            self._pending_open[account].clear()
+            new_ws = self._new_ws(account, new_key)
+            self._pending_ws[account] = new_ws
+            threading.Thread(target=self._run_ws, args=(account, new_ws)).start()
+
+            if not self._pending_open[account].wait(ROLLOVER_OPEN_TIMEOUT):
+                logger.error("%s Balance Websocket did not open on the new listen key, keeping the old one",
+                             account.capitalize())
+                self._pending_ws[account] = None
+                new_ws.close()
+                return
+
+            old_ws = getattr(self, f"{account}_ws")
+            setattr(self, f"{account}_ws", new_ws)
+            self._listen_keys[account] = new_key
+            self._pending_ws[account] = None
+            getattr(self, f"{account}_ws_open").set()
+
+            old_ws.close()
+            if old_key is not None:
+                self._make_request("DELETE", USER_STREAM_ENDPOINTS[account], {'listenKey': old_key})
+            logger.info("%s Balance Websocket switched to a new listen key", account.capitalize())
+
+        # the old key may have expired before the switch, so events can have been missed meanwhile
+        self._refresh_balances(account)
 
-    def _start_spot_ws(self):
-        self.spot_ws = websocket.WebSocketApp(self._wss_url + "/" + self._spot_listen_key,
-                                              on_open=self._on_spot_open,
-                                              on_error=self._on_spot_error,
-                                              on_message=self._on_spot_message)
+    ##### BALANCES #####
+
+    def seed_balances(self):
+        # REST snapshots of both accounts in parallel, taken once both streams listen so nothing after them is missed
+        threads = [threading.Thread(target=self._refresh_balances, args=(account,), name=f"{account}-balances")
+                   for account in ("spot", "margin")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def _refresh_balances(self, account: str):
+        # REST snapshot of the account, used at startup and whenever the stream may have missed events
+        data = dict()
+        server_time.stamp(data)
+        data['signature'] = self._generate_signature(data)
+
+        if account == "spot":
+            if self._spot is None:
+                return
+            response = self._make_request("GET", "/api/v3/account", data)
+            if response is None:
+                return
+            rows = [(i['asset'], float(i['free']), float(i['locked'])) for i in response['balances']]
+            # time of the last change of the account, events after it are newer than this snapshot
+            self._spot.Balances.apply_position(rows, response.get('updateTime', data['timestamp']))
+
+        elif account == "margin":
+            if self._margin is None:
+                return
+            response = self._make_request("GET", "/sapi/v1/margin/account", data)
+            if response is None:
+                return
+            rows = [(i['asset'], float(i['free']), float(i['locked'])) for i in response['userAssets']]
+            # the margin account has no update time, the request time is the closest lower bound
+            self._margin.Balances.apply_position(rows, data['timestamp'])
+
+        self.last_balance_update[account] = time.time()
+        logger.info("%s balances refreshed from REST", account.capitalize())
+
+    def _on_balance_event(self, account: str, data: typing.Dict):
+        balances = self._spot.Balances if account == "spot" else self._margin.Balances
+
+        if data['e'] == 'outboundAccountPosition':
+            self.last_balance_update[account] = time.time()
+            balances.apply_position([(i['a'], float(i['f']), float(i['l'])) for i in data['B']], data['u'])
+
+        elif data['e'] == "balanceUpdate":
+            # deposits, withdrawals and transfers between the accounts
+            self.last_balance_update[account] = time.time()
+            balances.apply_delta(data['a'], float(data['d']), data['T'])
+
+    ##### WEBSOCKETS #####
+
+    def _new_ws(self, account: str, listen_key: str) -> websocket.WebSocketApp:
+        if account == "spot":
+            return websocket.WebSocketApp(self._wss_url + "/" + str(listen_key),
+                                          on_open=self._on_spot_open,
+                                          on_error=self._on_spot_error,
+                                          on_message=self._on_spot_message)
+        else:
+            return websocket.WebSocketApp(self._wss_url + "/" + str(listen_key),
+                                          on_open=self._on_margin_open,
+                                          on_error=self._on_margin_error,
+                                          on_message=self._on_margin_message)
+
+    def _run_ws(self, account: str, ws: websocket.WebSocketApp):
+        # runs until the stream is replaced by a key switch or reconnecting is turned off
         while True:
+            is_current = ws is getattr(self, f"{account}_ws", None) or ws is self._pending_ws[account]
+            if not getattr(self, f"{account}_reconnect") or not is_current:
+                break
             try:
-                if self.spot_reconnect:
-                    self.spot_ws.run_forever()
-                else:
-                    break
+                ws.run_forever()
             except Exception as e:
-                logger.error("Spot Balance Websocket error in run_forever() method: %s", e)
+                logger.error("%s Balance Websocket error in run_forever() method: %s", account.capitalize(), e)
+            if ws is getattr(self, f"{account}_ws", None):
+                getattr(self, f"{account}_ws_open").clear()
             time.sleep(2)
 
+    def _on_open(self, account: str, ws: websocket.WebSocketApp):
+        logger.info("%s Balance Websocket connection opened", account.capitalize())
+
+        if ws is self._pending_ws[account]:
+            self._pending_open[account].set()
+            return
+
+        getattr(self, f"{account}_ws_open").set()
+        if self._connected_before[account]:
+            metrics.inc("cryptorade_reconnects_total", connection=f"{account} balance")
+            # reconnected: whatever happened while the socket was down never reached us
+            threading.Thread(target=self._refresh_balances, args=(account,)).start()
+        self._connected_before[account] = True
+
     def _on_spot_open(self, ws):
-        logger.info("Spot Balance Websocket connection opened")
+        self._on_open("spot", ws)
 
     def _on_spot_close(self, ws):
         logger.warning("Spot Balance Websocket connection closed")
@@ -124,41 +268,22 @@ class BalanceWebsocket:
         data = dict()
         data = json.loads(msg)
 
-        # there are two types of payloads, balanceUpdate and outboundAccountPosition
+        if self._spot is None:
+            return  # not attached yet, the startup snapshot will provide these balances
+
         if 'e' in data:
-            if data['e'] == 'outboundAccountPosition':
-                for i in data['B']:
-                    asset = i['a']
-                    free = float(i['f'])
-                    locked = float(i['l'])
-                    if asset in self._spot.Balances:
-                        self._spot.Balances[asset].free = free
-                        self._spot.Balances[asset].locked = locked
-                    else:
-                        self._spot.Balances[asset] = SpotBalance({"asset": asset, "free": free, "locked": locked})
-
-            elif data['e'] == "balanceUpdate":
-                # not really needed
-                return
+            if data['e'] in ('outboundAccountPosition', 'balanceUpdate'):
+                self._on_balance_event("spot", data)
 
-    # MARGIN WEBSOCKET
-    def _start_margin_ws(self):
-        self.margin_ws = websocket.WebSocketApp(self._wss_url + "/" + self._margin_listen_key,
-                                                on_open=self._on_margin_open,
-                                                on_error=self._on_margin_error,
-                                                on_message=self._on_margin_message)
-        while True:
-            try:
-                if self.margin_reconnect:
-                    self.margin_ws.run_forever()
-                else:
-                    break
-            except Exception as e:
-                logger.error("Margin Balance Websocket error in run_forever() method: %s", e)
-            time.sleep(2)
+            elif data['e'] == "executionReport":
+                # fills and cancellations of the exchange-side exit orders
+                orders.on_execution_report("Spot", data)
+
+            elif data['e'] == "listenKeyExpired":
+                threading.Thread(target=self._rollover, args=("spot",)).start()
 
     def _on_margin_open(self, ws):
-        logger.info("Margin Balance Websocket connection opened")
+        self._on_open("margin", ws)
 
     def _on_margin_close(self, ws):
         logger.warning("Margin Balance Websocket connection closed")
@@ -170,19 +295,16 @@ class BalanceWebsocket:
         data = dict()
         data = json.loads(msg)
 
-        # there are two types of payloads, balanceUpdate and outboundAccountPosition
+        if self._margin is None:
+            return  # not attached yet, the startup snapshot will provide these balances
+
         if 'e' in data:
-            if data['e'] == 'outboundAccountPosition':
-                for i in data['B']:
-                    asset = i['a']
-                    free = float(i['f'])
-                    locked = float(i['l'])
-                    if asset in self._margin.Balances:
-                        self._margin.Balances[asset].free = free
-                        self._margin.Balances[asset].locked = locked
-                    else:
-                        self._margin.Balances[asset] = MarginBalance({"asset": asset, "free": free, "locked": locked})
-
-            elif data['e'] == "balanceUpdate":
-                # not really needed
-                return
+            if data['e'] in ('outboundAccountPosition', 'balanceUpdate'):
+                self._on_balance_event("margin", data)
+
+            elif data['e'] == "executionReport":
+                # fills and cancellations of the exchange-side exit orders
+                orders.on_execution_report("Margin", data)
+
+            elif data['e'] == "listenKeyExpired":
+                threading.Thread(target=self._rollover, args=("margin",)).start()
@@ -4,7 +4,6 @@ import hmac
 import logging
 import time
 from datetime import datetime
-import pandas as pd
 from urllib.parse import urlencode
 import websocket
 import \
@@ -15,8 +14,20 @@ from pprint import pprint
 import typing
 from models import *
 from strategies import TechnicalStrategy, BreakoutStrategy, MacdEmaStrategy, EmaRsiStochStrategy
+from connectors.balance_book import BalanceBook
+from connectors.strategy_registry import StrategyRegistry
+from connectors.time_sync import server_time, TIMESTAMP_ERROR
+from connectors.candle_series import ResampledCandles
+from connectors.kline_parser import KlineArrays, parse_klines, save_csv, to_candles
+from connectors.trade_batcher import TradeBatcher, TRADE_BATCH_INTERVAL
+from latency import latency
+from metrics import metrics
+from position_book import positions
 
-from connectors.binance_spot import BinanceSpotClient
+from connectors.binance_spot import BinanceSpotClient, oco_order_params
+
+if typing.TYPE_CHECKING:
+    from connectors.collateral_pool import CollateralPool
 
 logger = logging.getLogger()
 
@@ -36,13 +47,18 @@ class BinanceMarginClient:
 
         self._headers = {'X-MBX-APIKEY': self._public_key}
 
-        self.Balances: typing.Dict[str, MarginBalance] = dict()
-        self._make_snapshot()  # gets a snapshot of user balances
+        # seeded by the balance websocket once its stream listens, then kept up to date from the stream
+        self.Balances = BalanceBook(MarginBalance)
+
+        # pre-funded USDT in the margin account (connectors/collateral_pool.py), set when the pool is started
+        self.collateral_pool: typing.Optional["CollateralPool"] = None
 
         self.contracts: typing.Dict[str, Contract] = self.get_contracts()  # gets exchange information about symbols and their trading
         self.prices = dict()
 
-        self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy, MacdEmaStrategy, EmaRsiStochStrategy]] = dict()
+        # copy-on-write, so websocket threads can iterate it while the UI activates/deactivates strategies
+        self.strategies = StrategyRegistry()
+        self.strategies.add_listener(self._update_subscriptions)
 
         self.logs = []
 
@@ -50,6 +66,19 @@ class BinanceMarginClient:
         self._ws_id = 1
         self.ws: websocket.WebSocketApp
         self.reconnect = True
+        self._connected_before = False
+        self.ws_subscribed = threading.Event()  # set once the exchange acknowledged every subscription
+        self._pending_subscriptions = set()
+        self._subscriptions_lock = threading.Lock()
+        self._opening = False  # the subscriptions of a new connection are still being sent
+        self._streams = set()  # per-strategy streams currently subscribed (aggTrade or kline)
+        self._streams_lock = threading.Lock()
+
+        # one base candle series per symbol, rolled up into the timeframes of the "resampled" strategies
+        self.resampled = ResampledCandles(self)
+
+        # aggTrades are coalesced per symbol before reaching the strategies
+        self.trade_batcher = TradeBatcher(self._dispatch_trades, TRADE_BATCH_INTERVAL, self._log_evaluation_report)
 
         t = threading.Thread(target=self._start_ws)
         t.start()
@@ -67,11 +96,13 @@ class BinanceMarginClient:
         return hmac.new(self._secret_key.encode(), urlencode(data).encode(), hashlib.sha256).hexdigest()
 
     def _make_request(self, method: str, endpoint: str, data: typing.Dict):
+        start = time.monotonic()
         if method == 'GET':
             try:
                 response = requests.get(self._base_url + endpoint, params=data, headers=self._headers)
             except Exception as e:
                 logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+                metrics.inc("cryptorade_rest_errors_total", exchange="Margin", method=method, endpoint=endpoint)
                 return None
 
         elif method == 'POST':
@@ -79,6 +110,7 @@ class BinanceMarginClient:
                 response = requests.post(self._base_url + endpoint, params=data, headers=self._headers)
             except Exception as e:
                 logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+                metrics.inc("cryptorade_rest_errors_total", exchange="Margin", method=method, endpoint=endpoint)
                 return None
 
         elif method == 'DELETE':
@@ -86,45 +118,28 @@ class BinanceMarginClient:
                 response = requests.delete(self._base_url + endpoint, params=data, headers=self._headers)
             except Exception as e:
                 logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+                metrics.inc("cryptorade_rest_errors_total", exchange="Margin", method=method, endpoint=endpoint)
                 return None
 
         else:
             raise ValueError()
 
+        metrics.observe("cryptorade_rest_request_seconds", time.monotonic() - start, exchange="Margin", method=method,
+                        endpoint=endpoint)
+
         if response.status_code == 200:
             return response.json()
         else:
+            metrics.inc("cryptorade_rest_errors_total", exchange="Margin", method=method, endpoint=endpoint)
             logger.error("Error while making %s request to %s:%s (error code %s)", method, endpoint, response.json(),
                          response.status_code)
+            if response.json().get('code') == TIMESTAMP_ERROR:
+                server_time.resync()
             return None
 
-    def get_time(self):
-        data = dict()
-        response = self._make_request("GET", "/api/v3/time", data)
-        print(response)
-        print(int(time.time()) * 1000)
-
-    def _make_snapshot(self):
-        # makes a snapshot of user balances by making transfers to help balance_websocket work
-
-        # spot to margin
-        data = dict()
-        data['asset'] = "USDT"
-        data['amount'] = 0.5
-        data['type'] = 1
-        data['timestamp'] = int(time.time() * 1000)
-        data['signature'] = self._generate_signature(data)
-        x = self._make_request("POST", "/sapi/v1/margin/transfer", data=data)
-
-        # back to spot
-        data2 = dict()
-        data2['asset'] = "USDT"
-        data2['amount'] = 0.5
-        data2['type'] = 2
-        data2['timestamp'] = int(time.time() * 1000)
-        data2['signature'] = self._generate_signature(data2)
-        self._make_request("POST", "/sapi/v1/margin/transfer", data=data2)
-
+    def get_time(self) -> typing.Optional[typing.Tuple[float, float]]:
+        # (offset, rtt) in ms of the exchange clock, signed requests use the offset kept by connectors/time_sync.py
+        return server_time.sample()
 
     def get_contracts(self) -> typing.Dict[str, Contract]:
         # gets exchange information about symbols and their trading
@@ -132,7 +147,10 @@ class BinanceMarginClient:
         data = {
             'symbols': "[\"BTCUSDT\",\"ETHUSDT\",\"ADAUSDT\",\"DOGEUSDT\",\"LTCUSDT\",\"BNBUSDT\"]"
         }
-        exchange_info = self._make_request("GET", "/api/v3/exchangeInfo", data)
+        # same symbols as the spot client, so its response is reused when available
+        exchange_info = self.spot_client.exchange_info
+        if exchange_info is None:
+            exchange_info = self._make_request("GET", "/api/v3/exchangeInfo", data)
 
         contracts = {}
         if exchange_info is not None:
@@ -159,9 +177,13 @@ class BinanceMarginClient:
             return self.prices[contract.symbol]
 
     def get_historical_candles(self, contract: Contract, interval: str) -> typing.List[Candle]:
+        return to_candles(self.get_historical_klines(contract, interval))
+
+    def get_historical_klines(self, contract: Contract, interval: str, pages: int = 1) -> KlineArrays:
         # Kline/Candlestick Data, Kline/candlestick bars for a symbol.
         # Klines are uniquely identified by their open time.
-        # also saves the data in a dataframe with same name as symbol
+        # pages > 1 goes further back, 1000 klines per request (the base series of connectors/candle_series.py)
+        # also saves the data in a csv with same name as symbol
 
         logger.info("Running get_historical_candles")
         data = dict()
@@ -169,25 +191,34 @@ class BinanceMarginClient:
         data['interval'] = interval
         data['limit'] = 1000
 
-        response = self._make_request("GET", "/api/v3/klines", data)
-
-        candles = []
-        if response is not None:
-            for c in response:
-                candles.append(Candle(c,interval,"Margin"))
-
-        df = []
-        for i in candles:
-            dt = datetime.utcfromtimestamp(i.timestamp / 1000).strftime('%Y-%m-%d %H:%M:%S')
-            x = [dt, i.open, i.high, i.low, i.close, i.volume]
-            df.append(x)
+        response = self._make_request("GET", "/api/v3/klines", data) or []
+        for page in range(pages - 1):
+            if len(response) < data['limit']:
+                break  # no older klines
+            data['endTime'] = response[0][0] - 1
+            older = self._make_request("GET", "/api/v3/klines", data)
+            if not older:
+                break
+            response = older + response
+        klines = parse_klines(response)
+
+        # saving this
+        path = 'E:\Ishaan\'s Bot\saved candles\\'
+        save_csv(klines, path + contract.symbol + "_" + interval + ".csv")
+
+        return klines
+
+    def get_candles_since(self, contract: Contract, interval: str, start_time: int) -> typing.List[Candle]:
+        # klines from start_time (open time, ms) up to the one currently forming, used to backfill gaps
+        data = dict()
+        data['symbol'] = contract.symbol
+        data['interval'] = interval
+        data['startTime'] = start_time
+        data['limit'] = 1000
 
-            # saving this
-            path = 'E:\Ishaan\'s Bot\saved candles\\'
-            pd.DataFrame(df, columns=['time', 'open', 'high', 'low', 'close', 'volume']).to_csv(
-                path + contract.symbol + "_" + interval +".csv", index=False)
+        response = self._make_request("GET", "/api/v3/klines", data)
 
-        return candles
+        return to_candles(parse_klines(response))
 
     #  still have to make place order and cancel order and order status
 
@@ -210,10 +241,28 @@ class BinanceMarginClient:
 
     def _on_open(self, ws):
         logger.info("Binance Margin Websocket connection opened")
+        self.ws_subscribed.clear()
+        self._opening = True
+
+        if self._connected_before:
+            metrics.inc("cryptorade_reconnects_total", connection="margin market")
+            # trades were missed while disconnected, the strategies fetch the affected candles from REST
+            for strat in self.strategies.values():
+                strat.reconnected = True
+            self.resampled.reconnected()
+        self._connected_before = True
 
         lst = list(self.contracts.values())
         self.subscribe_channel(lst, "bookTicker")
-        self.subscribe_channel(lst, "aggTrade")  # somesome message about this aggTrade at vid 41, 7:28
+
+        # trade or kline streams only for the symbols the running strategies need
+        with self._streams_lock:
+            self._streams = set()
+        self._update_subscriptions()
+
+        # an acknowledgement received while the requests above were sent doesn't mean all of them were acknowledged
+        self._opening = False
+        self._acknowledged(None)
 
     def _on_close(self, ws):
         logger.warning("Binance Margin Websocket connection closed")
@@ -236,10 +285,13 @@ class BinanceMarginClient:
         }
         """
         if 'result' in data:
+            # acknowledgement of a SUBSCRIBE request
+            self._acknowledged(data.get('id'))
             return
 
         if "e" not in data and "s" in data:
             symbol = data['s']
+            metrics.inc("cryptorade_messages_total", exchange="Margin", stream="bookTicker", symbol=symbol)
             if symbol not in self.prices:  # if not in dictionary already, make
                 self.prices[symbol] = {
                     "bid": float(data['b']),
@@ -249,68 +301,125 @@ class BinanceMarginClient:
                 self.prices[symbol]["bid"] = float(data['b'])
                 self.prices[symbol]["ask"] = float(data['a'])
 
-            # PnL Calculation
-            try:
-                for b_index, strat in self.strategies.items():
-                    if strat.contract.symbol == symbol:
-                        for trade in strat.trades:
-                            if trade.status == "open" and trade.entry_price is not None:
-                                if trade.side == "long":
-                                    trade.pnl = (self.prices[symbol]['bid'] - trade.entry_price) * trade.quantity
-                                if trade.side == "short":
-                                    trade.pnl = (trade.entry_price - self.prices[symbol]['ask']) * trade.quantity
-            except RuntimeError as e:
-                logger.error(("Error while looping through margin strategies: %s", e))
+            # PnL Calculation: the position book revalues the symbol's aggregates, open trades are valued on display
+            positions.on_quote("Margin", symbol, self.prices[symbol]["bid"], self.prices[symbol]["ask"])
 
         elif data['e'] == "aggTrade":
+            received = time.monotonic()
+            lag = server_time.now_ms() - data['T']
+            latency.record("Margin " + data['s'], "exchange_to_receive", lag)
+            metrics.inc("cryptorade_messages_total", exchange="Margin", stream="aggTrade", symbol=data['s'])
+            metrics.set("cryptorade_trade_lag_ms", lag, exchange="Margin", symbol=data['s'])
+            # price, quantity, time
+            self.trade_batcher.add(data['s'], (float(data['p']), float(data['q']), data['T']), received)
+
+        elif data['e'] == "kline":
+            received = time.monotonic()
             symbol = data['s']
+            kline = data['k']
+            latency.record("Margin " + symbol, "exchange_to_receive", server_time.now_ms() - data['E'])
+            metrics.inc("cryptorade_messages_total", exchange="Margin", stream="kline", symbol=symbol)
 
             try:
-                for key, strat in self.strategies.items():
-                    if strat.contract.symbol == symbol:
-                        res = strat.parse_trades(float(data['p']), float(data['q']), data['T'])  # price, quantity, time
-                        strat.check_trade(res)
+                for strat in self.strategies.for_symbol(symbol):
+                    if strat.candle_source == "klines" and strat.tf == kline['i']:
+                        strat.process_kline(kline, received)
             except Exception as e:
-                logger.error("Strategies Parsing On Message in Spot Client Error- %s", e)
+                logger.error("Strategies Kline Parsing On Message in Margin Client Error- %s", e)
+
+    def _dispatch_trades(self, symbol: str, trades: typing.List[typing.Tuple[float, float, int]], received: float):
+        try:
+            new_candles = None
+            for strat in self.strategies.for_symbol(symbol):
+                if strat.candle_source == "trades":
+                    strat.process_trades(trades, received)
+                elif strat.candle_source == "resampled":
+                    if new_candles is None:
+                        # aggregated once for every strategy of the symbol, whatever their timeframes
+                        new_candles = self.resampled.add_trades(symbol, trades)
+                    strat.process_resampled(new_candles.get(strat.tf_equiv, 0), trades, received)
+        except Exception as e:
+            logger.error("Strategies Parsing On Message in Margin Client Error- %s", e)
 
-    def subscribe_channel(self, contracts: typing.List[Contract], channel: str):
+    def _log_evaluation_report(self):
+        logger.info("Margin client: %s trades coalesced into %s batches", self.trade_batcher.trades_received,
+                    self.trade_batcher.batches_dispatched)
+        for b_index, strat in self.strategies.items():
+            logger.info("%s %s %s: %s ticks, %s evaluations, %s saved", strat.strat_name, strat.contract.symbol,
+                        strat.tf, strat.ticks_received, strat.evaluations, strat.ticks_received - strat.evaluations)
+
+    def subscribe_channel(self, contracts: typing.List[Contract], channel: str, method: str = "SUBSCRIBE"):
         # we can subscribe to the "!bookTicker" channel to subscribe to allll the symbols in bookTicker
+        params = []
+        for contract in contracts:
+            params.append(contract.symbol.lower() + "@" + channel)
+
+        self._send_streams_request(params, method)
+
+    def _send_streams_request(self, params: typing.List[str], method: str) -> bool:
         data = dict()  # https://binance-docs.github.io/apidocs/futures/en/#live-subscribing-unsubscribing-to-streams
-        data['method'] = "SUBSCRIBE"
-        data['params'] = []
+        data['method'] = method
+        data['params'] = params
 
-        for contract in contracts:
-            data['params'].append(contract.symbol.lower() + "@" + channel)
-        data['id'] = self._ws_id
-        self._ws_id += 1
+        with self._subscriptions_lock:
+            data['id'] = self._ws_id
+            self._pending_subscriptions.add(self._ws_id)
+            self._ws_id += 1
+            self.ws_subscribed.clear()
 
         try:
             self.ws.send(json.dumps(data))
-            logger.info("Successfully subscribed")
+            logger.info("Successfully sent %s for %s streams", method, len(params))
+            return True
         except Exception as e:
-            logger.error("Binance Margin Websocket error while subscribing to %s %s updates: %s", len(contracts), channel,
-                         e)
+            self._acknowledged(data['id'])
+            logger.error("Binance Margin Websocket error while sending %s for %s: %s", method, params, e)
+            return False
+
+    def _acknowledged(self, ws_id: typing.Optional[int]):
+        # ws_subscribed is set only once no request is waiting for its acknowledgement
+        with self._subscriptions_lock:
+            self._pending_subscriptions.discard(ws_id)
+            if len(self._pending_subscriptions) == 0 and not self._opening:
+                self.ws_subscribed.set()
+
+    def _update_subscriptions(self):
+        # aggTrade streams for strategies building candles from trades, kline streams for the others,
+        # so symbols without a trade-based strategy don't cost one message per trade
+        wanted = set()
+        for strat in self.strategies.values():
+            if strat.candle_source == "klines":
+                wanted.add(strat.contract.symbol.lower() + "@kline_" + strat.tf)
+            else:
+                wanted.add(strat.contract.symbol.lower() + "@aggTrade")
 
+        # _streams only changes for the requests actually sent, a failed one is sent again on the next update
+        with self._streams_lock:
+            added = sorted(wanted - self._streams)
+            removed = sorted(self._streams - wanted)
 
+            if len(added) > 0 and self._send_streams_request(added, "SUBSCRIBE"):
+                self._streams.update(added)
+            if len(removed) > 0 and self._send_streams_request(removed, "UNSUBSCRIBE"):
+                self._streams.difference_update(removed)
 
     ##### FROM STRATEGY MODULE #####
 
 
     def get_trade_size(self, contract: Contract, price: float, usdt_input: float):
-        balance = self.spot_client.Balances
-        if balance is not None:
-            if 'USDT' in balance:
-                balance = balance['USDT'].free
-                if balance < usdt_input:
-                    return None
-            else:
-                return None
-        else:
+        version, balances = self.spot_client.Balances.versioned()  # one consistent version, read without locking
+        if 'USDT' not in balances:
+            return None
+        balance = balances['USDT'].free
+        if self.collateral_pool is not None:
+            balance += self.collateral_pool.available()
+        if balance < usdt_input:
             return None
 
         trade_size = usdt_input / price  #USDT amount to invest
         trade_size = round((round(trade_size / contract.tick_size) * contract.tick_size), 8)
-        logger.info("MARGIN- signal for %s: current USDT balance = %s, trade size = %s", contract.symbol, balance, trade_size)
+        logger.info("MARGIN- signal for %s: current USDT balance = %s (v%s), trade size = %s", contract.symbol, balance,
+                    version, trade_size)
 
         return trade_size
 
@@ -326,7 +435,7 @@ class BinanceMarginClient:
         data['asset'] = "USDT"
         data['amount'] = amount
         data['type'] = direction
-        data['timestamp'] = int(time.time() * 1000)
+        server_time.stamp(data)
         data['signature'] = self._generate_signature(data)
 
         transfer_status = self._make_request("POST", "/sapi/v1/margin/transfer", data=data)
@@ -342,7 +451,7 @@ class BinanceMarginClient:
         data = dict()
         data['asset'] = asset
         data['amount'] = amount
-        data['timestamp'] = int(time.time() * 1000)
+        server_time.stamp(data)
         data['signature'] = self._generate_signature(data)
 
         borrow_status = self._make_request("POST", "/sapi/v1/margin/loan", data)
@@ -359,7 +468,7 @@ class BinanceMarginClient:
         amount = min(amount, self.Balances[asset].free)
 
         data['amount'] = amount
-        data['timestamp'] = int(time.time() * 1000)
+        server_time.stamp(data)
         data['signature'] = self._generate_signature(data)
 
         repay_status = self._make_request("POST", "/sapi/v1/margin/repay", data)
@@ -371,7 +480,7 @@ class BinanceMarginClient:
 
     def _margin_balance(self):
         data = dict()
-        data['timestamp'] = int(time.time() * 1000)
+        server_time.stamp(data)
         data['signature'] = self._generate_signature(data)
 
         response = self._make_request("GET", "/sapi/v1/margin/account", data)
@@ -400,6 +509,9 @@ class BinanceMarginClient:
         elif entry_or_exit == "EXIT":
             order_status = self._exit_order(data=data, usdt_total=usdt_total)
 
+        metrics.inc("cryptorade_orders_total", exchange="Margin", symbol=contract.symbol, kind=entry_or_exit.lower(),
+                    result="sent" if order_status is not None else "failed")
+
         if order_status is not None:
             order_status = OrderStatus(order_status)
         else:
@@ -407,26 +519,31 @@ class BinanceMarginClient:
         return order_status
 
     def _entry_order(self, data: typing.Dict, usdt_total):
+        # with the collateral pool, the USDT is normally in the margin account already
+        transfer = self.collateral_pool is None or not self.collateral_pool.covers(usdt_total+3)
+
         side = data['side']
         if side == "BUY":
-            self._transfer_funds(usdt_total+3, 1)
-            data['timestamp'] = int(time.time() * 1000)
+            if transfer:
+                self._transfer_funds(usdt_total+3, 1)
+            server_time.stamp(data)
             data['signature'] = self._generate_signature(data)
             order_status = self._make_request("POST", "/sapi/v1/margin/order", data)
-            if order_status is None:
+            if order_status is None and transfer:
                 self._transfer_funds(usdt_total+3, 2)
             return order_status
 
         elif side == "SELL":
-            transfer_status = self._transfer_funds(usdt_total+3, 1)
-            if transfer_status is None:
-                return None
+            if transfer:
+                transfer_status = self._transfer_funds(usdt_total+3, 1)
+                if transfer_status is None:
+                    return None
 
             borrow_status = self._borrow_funds(asset=data['symbol'][:-4], amount=data['quantity'])
             if borrow_status is None:
                 return None
 
-            data['timestamp'] = int(time.time() * 1000)
+            server_time.stamp(data)
             data['signature'] = self._generate_signature(data)
             order_status = self._make_request("POST", "/sapi/v1/margin/order", data)
 
@@ -434,7 +551,8 @@ class BinanceMarginClient:
                 repay_status = self._repay_funds(asset=data['symbol'][:-4], amount=data['quantity'])
                 if repay_status is None:
                     print("REPAY FAILED! PLEASE DO MANUALLY")
-                self._transfer_funds(usdt_total+3, 2)
+                if transfer:
+                    self._transfer_funds(usdt_total+3, 2)
             return order_status
 
         else:
@@ -448,18 +566,17 @@ class BinanceMarginClient:
             qty = min(data['quantity'], self.Balances[asset].free)
             qty = int(qty * pow(10, self.contracts[data['symbol']].base_asset_decimals)) / pow(10, self.contracts[data['symbol']].base_asset_decimals)
 
-            data1 = {'symbol': data['symbol'], 'side': data['side'],
-                     'quantity': qty, 'type': data['type'],
-                     'timestamp': int(time.time() * 1000)}
+            data1 = server_time.stamp({'symbol': data['symbol'], 'side': data['side'],
+                                       'quantity': qty, 'type': data['type']})
             data1['signature'] = self._generate_signature(data1)
             order_status = self._make_request("POST", "/sapi/v1/margin/order", data1)
             if order_status is None:
                 return None
-            self._transfer_funds(int(usdt_total), 2)
+            self._return_collateral(usdt_total)
             return order_status
 
         if side == "BUY":
-            data['timestamp'] = int(time.time() * 1000)
+            server_time.stamp(data)
             data['signature'] = self._generate_signature(data)
             order_status = self._make_request("POST", "/sapi/v1/margin/order", data)
             if order_status is None:
@@ -470,23 +587,57 @@ class BinanceMarginClient:
                 print("REPAY FAILED! PLEASE DO MANUALLY")
                 return order_status
 
-            transfer_status = self._transfer_funds(int(usdt_total), 2)
-            if transfer_status is None:
-                print("TRANSFER FROM MARGIN TO SPOT FAILED! PLEASE DO MANUALLY")
-
+            self._return_collateral(usdt_total)
             return order_status
 
         else:
             return None
 
+    def place_oco_order(self, contract: Contract, position_side: str, quantity: float, profit_price: float,
+                        stop_price: float, usdt_total: float) -> typing.Optional[OcoOrderStatus]:
+        # take profit (limit) and stop loss (stop market) protecting a position, one cancels the other on the exchange
+        if position_side == "long":
+            # sized by the strategy from the entry's fills, net of the commission paid in the base asset
+            quantity = int(quantity * pow(10, contract.base_asset_decimals)) / pow(10, contract.base_asset_decimals)
+
+        data = oco_order_params(contract, position_side, quantity, profit_price, stop_price)
+        # a short is closed by buying back the borrowed asset, the exchange repays the loan with the fill
+        data['sideEffectType'] = "NO_SIDE_EFFECT" if position_side == "long" else "AUTO_REPAY"
+        server_time.stamp(data)
+        data['signature'] = self._generate_signature(data)
+
+        order_list = self._make_request("POST", "/sapi/v1/margin/order/oco", data)
+
+        metrics.inc("cryptorade_orders_total", exchange="Margin", symbol=contract.symbol, kind="oco",
+                    result="sent" if order_list is not None else "failed")
+
+        if order_list is not None:
+            order_list = OcoOrderStatus(order_list)
+
+        return order_list
+
+    def settle_exit(self, contract: Contract, position_side: str, usdt_total: float):
+        # an exchange-side exit filled: the collateral goes back to spot, like after _exit_order
+        self._return_collateral(usdt_total)
+
+    def _return_collateral(self, usdt_total: float):
+        if self.collateral_pool is not None:
+            # stays in the margin account for the next entry, the pool moves any surplus in one transfer
+            self.collateral_pool.wake()
+            return
+
+        transfer_status = self._transfer_funds(int(usdt_total), 2)
+        if transfer_status is None:
+            print("TRANSFER FROM MARGIN TO SPOT FAILED! PLEASE DO MANUALLY")
+
     def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
         data = dict()
         data['orderId'] = order_id
         data['symbol'] = contract.symbol
-        data['timestamp'] = int(time.time() * 1000)
+        server_time.stamp(data)
         data['signature'] = self._generate_signature(data)
 
-        order_status = self._make_request("DELETE", "/api/v3/order", data)
+        order_status = self._make_request("DELETE", "/sapi/v1/margin/order", data)
 
         if order_status is not None:
             order_status = OrderStatus(order_status)
@@ -496,16 +647,13 @@ class BinanceMarginClient:
 
     def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
         data = dict()
-        data['timestamp'] = int(time.time() * 1000)
+        server_time.stamp(data)
         data['symbol'] = contract.symbol
         data['orderId'] = order_id
         data['signature'] = self._generate_signature(data)
 
-        order_status = self._make_request("GET", "/api/v3/order", data)
-
-        print("")
-        print(order_status)
-        print("")
+        order_status = self._make_request("GET", "/sapi/v1/margin/order", data)
+        logger.debug("Margin order %s status: %s", order_id, order_status)
 
         if order_status is not None:
             order_status = OrderStatus(order_status)
@@ -0,0 +1,370 @@
+import logging
+import threading
+import time
+import typing
+from threading import Thread
+
+from connectors.kline_parser import KLINE_INTERVALS, from_candles, resample, timeframe_ms, to_candles
+from models import Candle, Contract
+
+logger = logging.getLogger()
+
+# Candles of the strategies with "candle_source": "resampled": one series of one-minute candles per symbol, built
+# once from the aggTrades, and every timeframe used on the symbol rolled up from it (the TF_EQUIV ones and custom ones
+# like "10m" or "45m"). Strategies of the same symbol and timeframe share one candle list.
+#
+# Each rollup keeps the high, low and volume of the closed one-minute candles of its current candle, so a batch of
+# trades updates it in O(1) instead of re-aggregating the minute candles.
+#
+# History: BASE_HISTORY_PAGES pages of one-minute klines are fetched once per symbol and resampled with numpy for
+# every timeframe they cover HISTORY_CANDLES candles of. Longer timeframes fetch the klines of the largest interval
+# they are a multiple of (their own for the standard ones) and resample those.
+
+BASE_TIMEFRAME = "1m"
+BASE_MS = 60 * 1000
+BASE_HISTORY_PAGES = 5  # 5000 one-minute klines, about 3.5 days
+BASE_KEEP = BASE_HISTORY_PAGES * 1000  # one-minute candles kept once the series has twice as many
+HISTORY_CANDLES = 1000  # same depth as the history fetched for the other strategies
+PRUNE_GRACE = 60  # seconds a new timeframe is kept before its strategy is registered
+
+
+class _Rollup:
+    def __init__(self, interval_ms: int, candles: typing.List[Candle]):
+        self.interval_ms = interval_ms
+        self.candles = candles  # the strategies' self.candles
+        self.created = time.monotonic()
+
+        # closed one-minute candles of the current candle
+        self._high = float("-inf")
+        self._low = float("inf")
+        self._volume = 0.0
+        self._folded_ts = 0  # open time of the last one-minute candle folded in
+
+    def _bucket(self, timestamp: int) -> int:
+        return timestamp - timestamp % self.interval_ms
+
+    def sync(self, base: typing.List[Candle]) -> int:
+        # the one-minute candles closed since the last call are folded in, then the forming one is applied;
+        # returns the number of candles started
+        started = 0
+
+        i = len(base) - 1
+        while i > 0 and base[i - 1].timestamp > self._folded_ts:
+            i -= 1
+        for candle in base[i:-1]:
+            self._folded_ts = candle.timestamp
+            if self._bucket(candle.timestamp) < self.candles[-1].timestamp:
+                continue
+            started += self._roll_to(candle)
+            self._high = max(self._high, candle.high)
+            self._low = min(self._low, candle.low)
+            self._volume += candle.volume
+            # the trades it got since the last call, if it closed the candle
+            last = self.candles[-1]
+            last.high = self._high
+            last.low = self._low
+            last.close = candle.close
+            last.volume = self._volume
+
+        current = base[-1]
+        started += self._roll_to(current)
+        last = self.candles[-1]
+        if self._bucket(current.timestamp) == last.timestamp:
+            last.high = max(self._high, current.high)
+            last.low = min(self._low, current.low)
+            last.close = current.close
+            last.volume = self._volume + current.volume
+
+        return started
+
+    def _roll_to(self, candle: Candle) -> int:
+        bucket = self._bucket(candle.timestamp)
+        last = self.candles[-1]
+        if bucket <= last.timestamp:
+            return 0
+
+        started = 0
+        while last.timestamp + self.interval_ms < bucket:
+            # no one-minute candle at all in between (the base series has placeholders, so only on a time jump)
+            last = Candle.from_values(last.timestamp + self.interval_ms, last.open, last.high, last.low, last.close,
+                                      0.0)
+            self.candles.append(last)
+            started += 1
+
+        self.candles.append(Candle.from_values(bucket, candle.open, candle.open, candle.open, candle.open, 0.0))
+        self._high = float("-inf")
+        self._low = float("inf")
+        self._volume = 0.0
+        return started + 1
+
+    def rebuild(self, base: typing.List[Candle], start_ts: int) -> int:
+        # candles from start_ts recomputed from the one-minute candles (new rollup, backfill), as far as these cover
+        # whole candles, then the current candle's aggregate
+        first_covered = self._bucket(base[0].timestamp)
+        if first_covered < base[0].timestamp:
+            first_covered += self.interval_ms
+        start = max(self._bucket(start_ts), first_covered)
+
+        i = len(base)
+        while i > 0 and base[i - 1].timestamp >= start:
+            i -= 1
+        values: typing.Dict[int, typing.List[float]] = dict()
+        for candle in base[i:]:
+            row = values.get(self._bucket(candle.timestamp))
+            if row is None:
+                values[self._bucket(candle.timestamp)] = [candle.open, candle.high, candle.low, candle.close,
+                                                          candle.volume]
+            else:
+                row[1] = max(row[1], candle.high)
+                row[2] = min(row[2], candle.low)
+                row[3] = candle.close
+                row[4] += candle.volume
+
+        for candle in reversed(self.candles):
+            if candle.timestamp < start:
+                break
+            row = values.get(candle.timestamp)
+            if row is not None:
+                candle.open, candle.high, candle.low, candle.close, candle.volume = row
+
+        return self._reset(base, first_covered)
+
+    def _reset(self, base: typing.List[Candle], first_covered: int) -> int:
+        # the one-minute candles from the current candle's open are folded again by sync
+        last = self.candles[-1]
+        if last.timestamp >= first_covered:
+            self._high = float("-inf")
+            self._low = float("inf")
+            self._volume = 0.0
+        else:
+            # the one-minute candles start within this candle: its fetched values stand for the part they miss
+            covered = sum(candle.volume for candle in base[-(self.interval_ms // BASE_MS):]
+                          if self._bucket(candle.timestamp) == last.timestamp)
+            self._high = last.high
+            self._low = last.low
+            self._volume = max(last.volume - covered, 0.0)
+
+        self._folded_ts = last.timestamp - 1
+        return self.sync(base)
+
+
+class SymbolCandles:
+    def __init__(self, client, contract: Contract):
+        self._client = client
+        self.contract = contract
+
+        self.lock = threading.Lock()  # websocket thread (trades, backfills) against new timeframes
+        self._load_lock = threading.Lock()
+        self.base: typing.List[Candle] = []
+        self.rollups: typing.Dict[int, _Rollup] = dict()
+
+        self.reconnected = False
+        self._backfill_running = False
+        self._backfill_results: typing.List[typing.List[Candle]] = []
+
+    ##### TIMEFRAMES #####
+
+    def view(self, timeframe: str) -> typing.List[Candle]:
+        # candle list of the timeframe, history included, updated with every batch of trades of the symbol
+        interval_ms = timeframe_ms(timeframe)
+        with self._load_lock:
+            with self.lock:
+                if interval_ms in self.rollups:
+                    return self.rollups[interval_ms].candles
+
+            if len(self.base) == 0:
+                base = to_candles(self._client.get_historical_klines(self.contract, BASE_TIMEFRAME,
+                                                                    BASE_HISTORY_PAGES))
+                with self.lock:
+                    self.base = base
+            if len(self.base) == 0:
+                return []
+
+            candles = self._history(interval_ms)
+            if len(candles) == 0:
+                return candles
+
+            with self.lock:
+                rollup = _Rollup(interval_ms, candles)
+                rollup.rebuild(self.base, candles[-1].timestamp)
+                self.rollups[interval_ms] = rollup
+            logger.info("%s %s candles resampled from the %s series", self.contract.symbol, timeframe, BASE_TIMEFRAME)
+            return candles
+
+    def _history(self, interval_ms: int) -> typing.List[Candle]:
+        with self.lock:
+            base = from_candles(self.base)
+        if len(base.timestamp) * BASE_MS >= HISTORY_CANDLES * interval_ms:
+            return to_candles(resample(base, interval_ms))
+
+        # not enough one-minute history: the largest interval the timeframe is a multiple of
+        source_ms, source = max((seconds * 1000, name) for name, seconds in KLINE_INTERVALS.items()
+                                if interval_ms % (seconds * 1000) == 0)
+        pages = min(BASE_HISTORY_PAGES, -(-HISTORY_CANDLES * interval_ms // (source_ms * 1000)))
+        return to_candles(resample(self._client.get_historical_klines(self.contract, source, pages), interval_ms))
+
+    def retain(self, intervals: typing.Set[int]):
+        with self.lock:
+            for interval_ms in list(self.rollups):
+                rollup = self.rollups[interval_ms]
+                if interval_ms not in intervals and time.monotonic() - rollup.created > PRUNE_GRACE:
+                    del self.rollups[interval_ms]
+
+    ##### TRADES (websocket thread) #####
+
+    def add_trades(self, trades: typing.List[typing.Tuple[float, float, int]]) -> typing.Dict[int, int]:
+        # returns the number of candles started per timeframe
+        with self.lock:
+            if len(self.base) == 0:
+                return dict()
+            self._check_stream()
+
+            start = 0
+            while start < len(trades):
+                price, size, timestamp = trades[start]
+                last = self.base[-1]
+
+                if timestamp >= last.timestamp + BASE_MS:
+                    self._new_candle(price, size, timestamp)
+                    start += 1
+                    continue
+
+                # same grouping as Strategy.parse_trade_batch: one update per run of trades within the minute
+                candle_end = last.timestamp + BASE_MS
+                high = price
+                low = price
+                volume = 0.0
+                end = start
+                while end < len(trades) and trades[end][2] < candle_end:
+                    if trades[end][0] > high:
+                        high = trades[end][0]
+                    if trades[end][0] < low:
+                        low = trades[end][0]
+                    volume += trades[end][1]
+                    end += 1
+
+                last.close = trades[end - 1][0]
+                last.volume += volume
+                if high > last.high:
+                    last.high = high
+                if low < last.low:
+                    last.low = low
+                start = end
+
+            started = {interval_ms: rollup.sync(self.base) for interval_ms, rollup in self.rollups.items()}
+
+            if len(self.base) > 2 * BASE_KEEP:
+                del self.base[:len(self.base) - BASE_KEEP]
+            return started
+
+    def _new_candle(self, price: float, size: float, timestamp: int):
+        last = self.base[-1]
+        if timestamp >= last.timestamp + 2 * BASE_MS:
+            # placeholders keep the series continuous for now, the real klines replace them once fetched
+            self._request_backfill(last.timestamp)
+            while last.timestamp + 2 * BASE_MS <= timestamp:
+                last = Candle.from_values(last.timestamp + BASE_MS, last.open, last.high, last.low, last.close, 0.0)
+                self.base.append(last)
+
+        self.base.append(Candle.from_values(last.timestamp + BASE_MS, price, price, price, price, size))
+
+    ##### GAPS #####
+
+    def _check_stream(self):
+        # must be called with the lock held
+        if len(self._backfill_results) > 0:
+            self._apply_backfill(self._backfill_results.pop(0))
+
+        if self.reconnected:
+            self.reconnected = False
+            self._request_backfill(self.base[-1].timestamp)
+
+    def _request_backfill(self, start_ts: int):
+        if self._backfill_running:
+            return
+        self._backfill_running = True
+
+        t = Thread(target=self._fetch_backfill, args=(start_ts,))
+        t.start()
+
+    def _fetch_backfill(self, start_ts: int):
+        try:
+            candles = self._client.get_candles_since(self.contract, BASE_TIMEFRAME, start_ts)
+            if len(candles) > 0:
+                self._backfill_results.append(candles)
+        except Exception as e:
+            logger.error("Error while backfilling %s %s candles: %s", self.contract.symbol, BASE_TIMEFRAME, e)
+        finally:
+            self._backfill_running = False
+
+    def _apply_backfill(self, fetched: typing.List[Candle]):
+        last_ts = self.base[-1].timestamp
+        patched = 0
+
+        for candle in fetched:
+            index = len(self.base) - 1 - int((last_ts - candle.timestamp) / BASE_MS)
+            if index < 0 or index >= len(self.base) or self.base[index].timestamp != candle.timestamp:
+                continue
+
+            existing = self.base[index]
+            existing.open = candle.open
+            if index == len(self.base) - 1:
+                # still forming: trades processed after the REST response are only in our own candle
+                existing.high = max(existing.high, candle.high)
+                existing.low = min(existing.low, candle.low)
+                existing.volume = max(existing.volume, candle.volume)
+            else:
+                existing.high = candle.high
+                existing.low = candle.low
+                existing.close = candle.close
+                existing.volume = candle.volume
+            patched += 1
+
+        for rollup in self.rollups.values():
+            rollup.rebuild(self.base, fetched[0].timestamp)
+
+        logger.info("Backfilled %s %s %s candles from REST", patched, self.contract.symbol, BASE_TIMEFRAME)
+
+
+class ResampledCandles:
+    """
+    Symbol series of one client. Strategies get their candle list from view() when they are activated, the client
+    feeds every batch of aggTrades of a symbol to add_trades() once, before dispatching it to the strategies.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+        self._series: typing.Dict[str, SymbolCandles] = dict()
+        client.strategies.add_listener(self._prune)
+
+    def view(self, contract: Contract, timeframe: str) -> typing.List[Candle]:
+        with self._lock:
+            series = self._series.get(contract.symbol)
+            if series is None:
+                series = SymbolCandles(self._client, contract)
+                self._series[contract.symbol] = series
+        return series.view(timeframe)
+
+    def add_trades(self, symbol: str, trades: typing.List[typing.Tuple[float, float, int]]) -> typing.Dict[int, int]:
+        series = self._series.get(symbol)
+        if series is None:
+            return dict()
+        return series.add_trades(trades)
+
+    def reconnected(self):
+        for series in list(self._series.values()):
+            series.reconnected = True
+
+    def _prune(self):
+        # timeframes no running strategy uses anymore stop being rolled up
+        used: typing.Dict[str, typing.Set[int]] = dict()
+        for strategy in self._client.strategies.values():
+            if strategy.candle_source == "resampled":
+                used.setdefault(strategy.contract.symbol, set()).add(strategy.tf_equiv)
+
+        with self._lock:
+            for symbol, series in list(self._series.items()):
+                series.retain(used.get(symbol, set()))
+                if len(series.rollups) == 0:
+                    del self._series[symbol]
@@ -0,0 +1,100 @@
+import logging
+import threading
+import typing
+
+from connectors.time_sync import server_time
+
+if typing.TYPE_CHECKING:
+    from connectors.binance_margin import BinanceMarginClient
+
+logger = logging.getLogger()
+
+# USDT kept in the margin account for the margin strategies, so an entry is only the borrow (shorts) and the order,
+# instead of a spot -> margin transfer before it and a transfer back after the exit.
+#
+# USDT needed in the margin account:
+#   - strategy without an open trade: usdt_input + ENTRY_MARGIN, for its next entry
+#   - open long: nothing, the USDT was spent on the asset
+#   - open short: usdt_input + ENTRY_MARGIN as collateral, plus the sale proceeds that buy the asset back
+#   - plus the configured buffer
+#
+# A background thread moves the difference in one transfer when strategies start or stop, after exits, and every
+# REBALANCE_INTERVAL seconds.
+
+ENTRY_MARGIN = 3  # USDT on top of usdt_input, same as the former transfer before each entry
+REBALANCE_INTERVAL = 30  # seconds
+MIN_TRANSFER = 10  # USDT, smaller surpluses stay in the margin account until the next rebalance
+
+
+class CollateralPool:
+    def __init__(self, margin: "BinanceMarginClient", buffer: float = 0.0, interval: float = REBALANCE_INTERVAL):
+        self._margin = margin
+        self.buffer = buffer
+        self.interval = interval
+        self.running = True
+
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+        margin.collateral_pool = self
+        margin.strategies.add_listener(self.wake)
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def wake(self):
+        # rebalance now instead of at the next interval
+        self._wake.set()
+
+    def required(self) -> float:
+        required = self.buffer
+        for strategy in self._margin.strategies.values():
+            open_trades = [trade for trade in list(strategy.trades) if trade.status == "open"]
+            if len(open_trades) == 0:
+                required += strategy.usdt_input + ENTRY_MARGIN
+            for trade in open_trades:
+                if trade.side == "short" and trade.entry_price is not None:
+                    required += strategy.usdt_input + ENTRY_MARGIN + trade.entry_price * trade.quantity
+        return required
+
+    def available(self) -> float:
+        balance = self._margin.Balances.get("USDT")
+        return balance.free if balance is not None else 0.0
+
+    def covers(self, amount: float) -> bool:
+        return self.available() >= amount
+
+    def rebalance(self):
+        with self._lock:
+            difference = self.required() - self.available()
+
+            if difference > 0:
+                spot_balance = self._margin.spot_client.Balances.get("USDT")
+                amount = min(difference, spot_balance.free if spot_balance is not None else 0.0)
+                amount = int(amount * 100 + 0.999999) / 100  # rounded up to the cent
+                if amount > 0:
+                    self._transfer(amount, 1)
+
+            elif -difference >= MIN_TRANSFER:
+                self._transfer(int(-difference * 100) / 100, 2)
+
+    def _transfer(self, amount: float, direction: int):
+        # direction: 1 for spot -> margin, 2 for margin -> spot
+        requested_at = server_time.timestamp()
+        if self._margin._transfer_funds(amount, direction) is None:
+            return
+
+        # the balance websocket confirms the new balances shortly, until then the next rebalance must not move the
+        # same amount again (unless its events already arrived during the request)
+        sign = 1 if direction == 1 else -1
+        self._margin.Balances.adjust("USDT", sign * amount, requested_at)
+        self._margin.spot_client.Balances.adjust("USDT", -sign * amount, requested_at)
+
+    def _run(self):
+        while self.running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.error("Error while rebalancing the margin collateral: %s", e)
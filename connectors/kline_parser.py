@@ -0,0 +1,105 @@
+import re
+import typing
+
+from models import Candle
+
+if typing.TYPE_CHECKING:
+    import numpy as np
+
+# Bulk parsing of the REST klines response ([[open time, "open", "high", "low", "close", "volume", ...], ...]) into
+# typed arrays, instead of six float() calls per row. numpy and pandas are imported on first use, like in the
+# strategies.
+
+
+# intervals the exchange serves klines for, in seconds; other timeframes can only be resampled from one of these
+KLINE_INTERVALS = {
+    "1m": 60, "3m": 180, "5m": 300, "15m": 900, "30m": 1800,
+    "1h": 3600, "2h": 7200, "4h": 14400, "6h": 21600, "8h": 28800, "12h": 43200,
+    "1d": 86400,
+}
+_TIMEFRAME_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def timeframe_ms(timeframe: str) -> int:
+    # "15m", "4h", "1d", also custom ones like "10m" or "45m"
+    match = re.fullmatch(r"(\d+)([mhd])", timeframe)
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid timeframe {timeframe}")
+    return int(match.group(1)) * _TIMEFRAME_UNITS[match.group(2)] * 1000
+
+
+class KlineArrays(typing.NamedTuple):
+    timestamp: "np.ndarray"  # int64, open time in ms
+    open: "np.ndarray"  # float64
+    high: "np.ndarray"
+    low: "np.ndarray"
+    close: "np.ndarray"
+    volume: "np.ndarray"
+
+
+def parse_klines(response: typing.Optional[typing.List[typing.List]]) -> KlineArrays:
+    import numpy as np
+
+    rows = response or []
+    timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    # numpy converts the price strings while building the array, in one pass over the payload
+    values = np.array([row[1:6] for row in rows], dtype=np.float64).reshape(len(rows), 5)
+    opens, highs, lows, closes, volumes = np.ascontiguousarray(values.T)
+
+    return KlineArrays(timestamps, opens, highs, lows, closes, volumes)
+
+
+def resample(klines: KlineArrays, interval_ms: int) -> KlineArrays:
+    # klines of a lower interval (sorted by open time) rolled up into candles of interval_ms, aligned on the epoch
+    # like the exchange's. A first candle the klines only partly cover is dropped, the last one may still be forming.
+    import numpy as np
+
+    if len(klines.timestamp) == 0:
+        return klines
+
+    buckets = klines.timestamp - klines.timestamp % interval_ms
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    if klines.timestamp[0] != buckets[0]:
+        starts = starts[1:]
+        if len(starts) == 0:
+            return parse_klines([])
+    ends = np.append(starts[1:], len(buckets)) - 1
+    first = starts[0]
+
+    return KlineArrays(buckets[starts], klines.open[starts], np.maximum.reduceat(klines.high[first:], starts - first),
+                       np.minimum.reduceat(klines.low[first:], starts - first), klines.close[ends],
+                       np.add.reduceat(klines.volume[first:], starts - first))
+
+
+def to_candles(klines: KlineArrays) -> typing.List[Candle]:
+    # tolist() gives plain Python ints and floats, so the candles behave exactly like the ones built from trades
+    return list(map(Candle.from_values, klines.timestamp.tolist(), klines.open.tolist(), klines.high.tolist(),
+                    klines.low.tolist(), klines.close.tolist(), klines.volume.tolist()))
+
+
+def from_candles(candles: typing.List[Candle]) -> KlineArrays:
+    import numpy as np
+
+    values = np.array([(c.open, c.high, c.low, c.close, c.volume) for c in candles], dtype=np.float64)
+    values = values.reshape(len(candles), 5)
+    opens, highs, lows, closes, volumes = np.ascontiguousarray(values.T)
+    timestamps = np.fromiter((c.timestamp for c in candles), dtype=np.int64, count=len(candles))
+
+    return KlineArrays(timestamps, opens, highs, lows, closes, volumes)
+
+
+def save_csv(klines: KlineArrays, path: str):
+    import numpy as np
+    import pandas as pd
+
+    # "YYYY-MM-DD HH:MM:SS" in UTC for every row at once, same format as the former strftime per candle
+    times = np.char.replace(np.datetime_as_string(klines.timestamp.astype('datetime64[ms]'), unit='s'), 'T', ' ')
+
+    pd.DataFrame({
+        'time': times,
+        'open': klines.open,
+        'high': klines.high,
+        'low': klines.low,
+        'close': klines.close,
+        'volume': klines.volume,
+    }).to_csv(path, index=False)
@@ -0,0 +1,330 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import typing
+import zlib
+
+from connectors.time_sync import server_time
+from latency import latency
+from metrics import metrics
+from exit_triggers import triggers
+from order_manager import orders
+from position_book import positions
+from trade_journal import journal
+from models import *
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+STATS_INTERVAL = 10  # seconds between two evaluation counters updates sent by a worker
+
+StrategyKey = typing.Tuple[str, int]  # exchange, b_index
+
+
+class RemoteStrategy:
+    """
+    Stand-in registered in the client's strategies registry for a strategy running in a worker process.
+
+    The client dispatches market data to it exactly like to a local strategy, and it forwards it to the worker.
+    Logs and trades sent back by the worker are kept here, so the UI, the PnL calculation and the headless log
+    flush work unchanged.
+    """
+
+    def __init__(self, executor: "ShardedExecutor", key: StrategyKey, shard: int, strategy: "Strategy"):
+        self._executor = executor
+        self._key = key
+        self.shard = shard
+
+        self.contract = strategy.contract
+        self.exchange = strategy.exchange
+        self.tf = strategy.tf
+        self.usdt_input = strategy.usdt_input
+        self.strat_name = strategy.strat_name
+        self.latency_key = strategy.latency_key
+        self.strategy_key = strategy.strategy_key
+        self.candle_source = strategy.candle_source
+
+        self.trades: typing.List[Trade] = []
+        self.logs = []
+        self.ticks_received = 0
+        self.evaluations = 0
+
+    @property
+    def reconnected(self) -> bool:
+        return False
+
+    @reconnected.setter
+    def reconnected(self, value: bool):
+        if value:
+            self._executor.send(self.shard, ("reconnected", self._key))
+
+    # time.monotonic() is system-wide on the platforms we run on, so arrival times stay valid in the worker
+    def process_trades(self, trades: typing.List[typing.Tuple[float, float, int]],
+                       received: typing.Optional[float] = None):
+        self.ticks_received += len(trades)
+        self._executor.send(self.shard, ("trades", self._key, trades, received))
+
+    def process_kline(self, kline: typing.Dict, received: typing.Optional[float] = None):
+        self.ticks_received += 1
+        self._executor.send(self.shard, ("kline", self._key, kline, received))
+
+    def _update_trade(self, trade: Trade):
+        for existing in self.trades:
+            if existing.time == trade.time:
+                # open trades are valued here from the bookTicker prices, everything else comes from the worker
+                if existing.status == "open" and trade.status == "closed":
+                    # the worker's position book set the realized pnl, the exit price is derived back from it
+                    move = trade.pnl / trade.quantity if trade.quantity else 0.0
+                    positions.close(self, existing, existing.entry_price + (move if existing.side == "long" else -move))
+                existing.status = trade.status
+                existing.entry_price = trade.entry_price
+                existing.quantity = trade.quantity
+                existing.stop_loss_line = trade.stop_loss_line
+                existing.profit_line = trade.profit_line
+                return
+        self.trades.append(trade)
+        if trade.status == "open":
+            positions.open(self, trade)
+
+
+class ShardedExecutor:
+    """
+    Runs strategies in worker processes, one shard per worker, so strategy math doesn't share the GIL with the
+    websockets and the other strategies. Symbols are assigned to shards by hash, so all strategies of a symbol
+    live in the same worker.
+
+    Market data goes to the workers through one queue per worker. Workers send logs and trade updates back, and
+    ask this process to run the client methods they need (balances, orders, klines) since only it holds the
+    connections.
+    """
+
+    def __init__(self, exchanges: typing.Dict, workers: int, journal_path: typing.Optional[str] = None):
+        # with a journal, each worker writes the trades of its strategies to it and restores their open trades
+        self._exchanges = exchanges
+        self.workers = workers
+
+        ctx = multiprocessing.get_context("spawn")  # forking would copy the websocket threads' state
+        self._inbound = [ctx.Queue() for _ in range(workers)]
+        self._responses = [ctx.Queue() for _ in range(workers)]
+        self._outbound = ctx.Queue()
+
+        self._remote: typing.Dict[StrategyKey, RemoteStrategy] = dict()
+        self.running = True
+
+        self._processes = []
+        for worker_id in range(workers):
+            p = ctx.Process(target=_worker_main, args=(worker_id, self._inbound[worker_id], self._outbound,
+                                                       self._responses[worker_id], journal_path), daemon=True)
+            p.start()
+            self._processes.append(p)
+
+        t = threading.Thread(target=self._read_events, daemon=True)
+        t.start()
+
+        # the workers' lag measurements use the exchange clock offset measured here
+        server_time.add_listener(self._send_clock_offset)
+        self._send_clock_offset(server_time.offset_ms)
+
+        logger.info("Sharded execution started with %s worker processes", workers)
+
+    def shard_for(self, symbol: str) -> int:
+        return zlib.crc32(symbol.encode()) % self.workers
+
+    def send(self, shard: int, msg: typing.Tuple):
+        self._inbound[shard].put(msg)
+
+    def start_strategy(self, b_index: int, strategy: "Strategy", strategy_type: str,
+                       other_params: typing.Dict) -> RemoteStrategy:
+        # the strategy built by the caller is only used for its settings and candles, the worker builds its own
+        if strategy.candle_source == "resampled":
+            raise ValueError("resampled candles are rolled up in the ingest process, not in the workers")
+        key = (strategy.exchange, b_index)
+        shard = self.shard_for(strategy.contract.symbol)
+        remote = RemoteStrategy(self, key, shard, strategy)
+        self._remote[key] = remote
+
+        self.send(shard, ("start", key, strategy_type, strategy.contract, strategy.exchange, strategy.tf,
+                          strategy.usdt_input, strategy.risk_to_reward, other_params, strategy.candles,
+                          strategy.strategy_key))
+        return remote
+
+    def _send_clock_offset(self, offset_ms: float):
+        if self.running:
+            for shard in range(self.workers):
+                self.send(shard, ("clock", None, offset_ms))
+
+    def stop_strategy(self, exchange: str, b_index: int):
+        remote = self._remote.pop((exchange, b_index), None)
+        if remote is not None:
+            positions.remove_strategy(remote)
+            self.send(remote.shard, ("stop", (exchange, b_index)))
+
+    def stop(self):
+        self.running = False
+        for shard in range(self.workers):
+            self.send(shard, ("stop_worker",))
+
+    def _read_events(self):
+        while self.running:
+            try:
+                msg = self._outbound.get(timeout=1)
+            except Exception:
+                continue
+
+            kind = msg[0]
+            if kind == "request":
+                # own thread: an order must not hold up the logs and trades of the other workers
+                threading.Thread(target=self._answer_request, args=msg[1:]).start()
+                continue
+            elif kind == "latency":
+                latency.merge(msg[1])
+                continue
+            elif kind == "metrics":
+                metrics.merge(msg[1])  # the strategies' counters (candles, signals)
+                continue
+
+            remote = self._remote.get(msg[1])
+            if remote is None:
+                continue
+
+            if kind == "log":
+                remote.logs.append({"log": msg[2], "displayed": False})
+            elif kind == "trade":
+                remote._update_trade(msg[2])
+            elif kind == "stats":
+                remote.evaluations = msg[2]
+
+    def _answer_request(self, worker_id: int, exchange: str, method: str, args: typing.Tuple):
+        result = None
+        try:
+            if method in _WorkerClient.allowed_methods:
+                result = getattr(self._exchanges[exchange], method)(*args)
+        except Exception as e:
+            logger.error("Error while running %s for worker %s: %s", method, worker_id, e)
+        self._responses[worker_id].put(result)
+
+
+class _WorkerClient:
+    # client seen by the strategies inside a worker: every call is executed by the ingest process
+    allowed_methods = ["get_trade_size", "place_order", "get_candles_since", "get_order_status", "cancel_order",
+                       "settle_exit"]
+
+    def __init__(self, worker_id: int, exchange: str, outbound, responses, lock: threading.Lock):
+        self._worker_id = worker_id
+        self._exchange = exchange
+        self._outbound = outbound
+        self._responses = responses
+        self._lock = lock  # shared by the worker's clients, one request in flight per worker
+
+    def _request(self, method: str, *args):
+        with self._lock:
+            self._outbound.put(("request", self._worker_id, self._exchange, method, args))
+            return self._responses.get()
+
+    def get_trade_size(self, contract: Contract, price: float, usdt_input: float):
+        return self._request("get_trade_size", contract, price, usdt_input)
+
+    def place_order(self, contract: Contract, order_type: str, quantity: float, side: str, usdt_total: float,
+                    entry_or_exit: str, price=None, tif=None) -> OrderStatus:
+        return self._request("place_order", contract, order_type, quantity, side, usdt_total, entry_or_exit, price,
+                             tif)
+
+    def get_candles_since(self, contract: Contract, interval: str, start_time: int) -> typing.List[Candle]:
+        return self._request("get_candles_since", contract, interval, start_time)
+
+    # exit orders of the trades restored in a worker, see Strategy._take_back_exit
+    def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
+        return self._request("get_order_status", contract, order_id)
+
+    def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
+        return self._request("cancel_order", contract, order_id)
+
+    def settle_exit(self, contract: Contract, position_side: str, usdt_total: float):
+        return self._request("settle_exit", contract, position_side, usdt_total)
+
+
+def _publish_changes(key: StrategyKey, strategy: "Strategy", known_trades: typing.Dict, outbound):
+    while strategy.logs:
+        outbound.put(("log", key, strategy.logs.pop(0)['log']))
+
+    for trade in strategy.trades:
+        state = (trade.status, trade.entry_price, trade.quantity, trade.stop_loss_line, trade.profit_line)
+        if known_trades.get(trade.time) != state:
+            known_trades[trade.time] = state
+            outbound.put(("trade", key, trade))
+
+
+def _worker_main(worker_id: int, inbound, outbound, responses, journal_path: typing.Optional[str]):
+    from strategies import STRATEGY_TYPES
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the ingest process decides when workers stop
+
+    if journal_path is not None:
+        journal.open(journal_path)  # SQLite serializes the writes of the workers
+
+    lock = threading.Lock()
+    clients = {exchange: _WorkerClient(worker_id, exchange, outbound, responses, lock)
+               for exchange in ["Spot", "Margin"]}
+    strategies: typing.Dict[StrategyKey, "Strategy"] = dict()
+    known_trades: typing.Dict[StrategyKey, typing.Dict] = dict()
+    last_stats = time.monotonic()
+
+    while True:
+        msg = inbound.get()
+        kind = msg[0]
+
+        if kind == "stop_worker":
+            journal.close()
+            break
+        elif kind == "clock":
+            server_time.set_offset(msg[2])
+            continue
+
+        key = msg[1]
+        try:
+            if kind == "start":
+                strategy_type, contract, exchange, timeframe, usdt_input, risk_to_reward, other_params, candles, \
+                    strategy_key = msg[2:]
+                strategy = STRATEGY_TYPES[strategy_type](clients[exchange], contract, exchange, timeframe, usdt_input,
+                                                         risk_to_reward, other_params)
+                strategy.candles = candles
+                strategy.strategy_key = strategy_key  # assigned in the main process, unique across the workers
+                strategy.exchange_exits = False  # the user data streams, with the fills of exit orders, are not here
+                strategy.restore_trades(journal.open_trades(strategy.strategy_key))
+                strategies[key] = strategy
+                known_trades[key] = dict()
+                _publish_changes(key, strategy, known_trades[key], outbound)
+                continue
+
+            if key not in strategies:
+                continue
+
+            if kind == "stop":
+                stopped = strategies.pop(key)
+                triggers.remove_strategy(stopped)
+                positions.remove_strategy(stopped)
+                orders.remove_strategy(stopped)
+                stopped.release()
+                del known_trades[key]
+                continue
+            elif kind == "trades":
+                strategies[key].process_trades(msg[2], msg[3])
+            elif kind == "kline":
+                strategies[key].process_kline(msg[2], msg[3])
+            elif kind == "reconnected":
+                strategies[key].reconnected = True
+
+            _publish_changes(key, strategies[key], known_trades[key], outbound)
+        except Exception as e:
+            logger.error("Worker %s error while processing %s for %s: %s", worker_id, kind, key, e)
+
+        if time.monotonic() - last_stats >= STATS_INTERVAL:
+            last_stats = time.monotonic()
+            for k, strategy in strategies.items():
+                outbound.put(("stats", k, strategy.evaluations))
+            outbound.put(("latency", latency.drain()))
+            outbound.put(("metrics", metrics.drain()))
@@ -0,0 +1,107 @@
+import threading
+import typing
+from types import MappingProxyType
+
+if typing.TYPE_CHECKING:
+    from strategies import TechnicalStrategy, BreakoutStrategy, MacdEmaStrategy, EmaRsiStochStrategy
+
+    AnyStrategy = typing.Union[TechnicalStrategy, BreakoutStrategy, MacdEmaStrategy, EmaRsiStochStrategy]
+
+
+class StrategyRegistry:
+    """
+    Copy-on-write container for the running strategies of a client.
+
+    Writers (the Tk thread activating/deactivating a strategy) build a new dictionary under a lock and publish it
+    with a single reference assignment. Readers (websocket threads, the UI) only ever see a complete, immutable
+    version, so they can iterate it without locks and without 'dictionary changed size during iteration' errors.
+    """
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._version = 0
+        self._strategies: typing.Mapping[int, "AnyStrategy"] = MappingProxyType(dict())
+        self._by_symbol: typing.Mapping[str, typing.Tuple["AnyStrategy", ...]] = MappingProxyType(dict())
+        self._listeners: typing.List[typing.Callable[[], None]] = []
+
+    def add_listener(self, callback: typing.Callable[[], None]):
+        # called after every published change, outside the write lock (the client adjusts its subscriptions)
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+    def _publish(self, strategies: typing.Dict[int, "AnyStrategy"]):
+        # must be called with the write lock held
+        by_symbol = dict()
+        for strat in strategies.values():
+            by_symbol.setdefault(strat.contract.symbol, []).append(strat)
+
+        # readers pick up either the old or the new references, both of which are complete
+        self._by_symbol = MappingProxyType({symbol: tuple(strats) for symbol, strats in by_symbol.items()})
+        self._strategies = MappingProxyType(strategies)
+        self._version += 1
+
+    ##### WRITERS #####
+
+    def __setitem__(self, b_index: int, strategy: "AnyStrategy"):
+        with self._write_lock:
+            strategies = dict(self._strategies)
+            strategies[b_index] = strategy
+            self._publish(strategies)
+        self._notify()
+
+    def __delitem__(self, b_index: int):
+        with self._write_lock:
+            strategies = dict(self._strategies)
+            del strategies[b_index]
+            self._publish(strategies)
+        self._notify()
+
+    def pop(self, b_index: int, default=None):
+        with self._write_lock:
+            if b_index not in self._strategies:
+                return default
+            strategies = dict(self._strategies)
+            strategy = strategies.pop(b_index)
+            self._publish(strategies)
+        self._notify()
+        return strategy
+
+    ##### READERS #####
+
+    def snapshot(self) -> typing.Mapping[int, "AnyStrategy"]:
+        # immutable view of the current version, safe to iterate from any thread
+        return self._strategies
+
+    def for_symbol(self, symbol: str) -> typing.Tuple["AnyStrategy", ...]:
+        return self._by_symbol.get(symbol, ())
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def items(self):
+        return self._strategies.items()
+
+    def values(self):
+        return self._strategies.values()
+
+    def keys(self):
+        return self._strategies.keys()
+
+    def get(self, b_index: int, default=None):
+        return self._strategies.get(b_index, default)
+
+    def __getitem__(self, b_index: int) -> "AnyStrategy":
+        return self._strategies[b_index]
+
+    def __contains__(self, b_index) -> bool:
+        return b_index in self._strategies
+
+    def __iter__(self):
+        return iter(self._strategies)
+
+    def __len__(self) -> int:
+        return len(self._strategies)
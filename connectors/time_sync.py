@@ -0,0 +1,149 @@
+import collections
+import logging
+import statistics
+import threading
+import time
+import typing
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger()
+
+# Offset between the exchange's clock and ours, so signed requests carry the exchange's time instead of the host's
+# (a drifting host clock gets them rejected with -1021, timestamp outside of the recvWindow), and lags computed from
+# event times aren't skewed by the drift.
+#
+# Every SYNC_INTERVAL seconds, SAMPLES_PER_SYNC requests to /api/v3/time are timed:
+#   offset = server time - local time at the middle of the request
+#   rtt    = round trip of the request
+# The sample with the lowest RTT is the least affected by uneven network delays, and the offset used is the median
+# of the last OFFSET_HISTORY of those, so a single slow or skewed round doesn't move it. A -1021 rejection starts a
+# new history right away (the host clock was probably stepped).
+
+SYNC_INTERVAL = 60  # seconds
+SAMPLES_PER_SYNC = 5
+OFFSET_HISTORY = 5
+MAX_SAMPLE_RTT = 2000  # ms, slower samples say little about the offset
+DEFAULT_RECV_WINDOW = 5000  # ms, same as Binance's default (60000 at most)
+TIMESTAMP_ERROR = -1021
+
+
+class TimeSync:
+    def __init__(self):
+        self.offset_ms = 0.0  # exchange time - local time
+        self.rtt_ms: typing.Optional[float] = None
+        self.recv_window = DEFAULT_RECV_WINDOW
+        self.interval = SYNC_INTERVAL
+        self.running = False
+
+        self._base_url = "https://api.binance.com"
+        self._offsets: typing.Deque[float] = collections.deque(maxlen=OFFSET_HISTORY)
+        self._reset = False
+        self._wake = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._listeners: typing.List[typing.Callable[[float], None]] = []
+
+    def add_listener(self, callback: typing.Callable[[float], None]):
+        # called with the new offset when it changes (worker processes get it from the ingest process)
+        self._listeners.append(callback)
+
+    def start(self, testnet: bool = False, recv_window: typing.Optional[int] = None,
+              interval: float = SYNC_INTERVAL):
+        # the first round runs in the caller, before any signed request
+        if testnet:
+            self._base_url = "https://testnet.binance.vision/api"
+        if recv_window is not None:
+            self.recv_window = recv_window
+        self.interval = interval
+
+        self.sync()
+        if not self.running:
+            self.running = True
+            t = threading.Thread(target=self._run, daemon=True)
+            t.start()
+
+    def resync(self):
+        # a request was rejected for its timestamp: the offset is wrong, sample again now
+        self._reset = True
+        if self.running:
+            self._wake.set()
+        else:
+            threading.Thread(target=self.sync, daemon=True).start()
+
+    ##### SAMPLING #####
+
+    def sample(self) -> typing.Optional[typing.Tuple[float, float]]:
+        # (offset, rtt) in ms
+        try:
+            start = time.time() * 1000
+            response = requests.get(self._base_url + "/api/v3/time", timeout=5)
+            end = time.time() * 1000
+        except Exception as e:
+            logger.error("Connection error while getting the server time: %s", e)
+            return None
+
+        if response.status_code != 200:
+            logger.error("Error while getting the server time (error code %s)", response.status_code)
+            return None
+
+        return response.json()['serverTime'] - (start + end) / 2, end - start
+
+    def sync(self) -> bool:
+        with self._sync_lock:
+            samples = [sample for sample in (self.sample() for _ in range(SAMPLES_PER_SYNC)) if sample is not None]
+            samples = [sample for sample in samples if sample[1] <= MAX_SAMPLE_RTT]
+            if len(samples) == 0:
+                logger.warning("Server time not synchronized, keeping an offset of %.1f ms", self.offset_ms)
+                return False
+
+            offset, rtt = min(samples, key=lambda sample: sample[1])
+            if self._reset:
+                self._offsets.clear()
+                self._reset = False
+            self._offsets.append(offset)
+
+            previous = self.offset_ms
+            self.offset_ms = statistics.median(self._offsets)
+            self.rtt_ms = rtt
+
+        metrics.set("cryptorade_clock_offset_ms", round(self.offset_ms, 1))
+        metrics.set("cryptorade_clock_rtt_ms", round(rtt, 1))
+        logger.debug("Server time offset %.1f ms (rtt %.1f ms)", self.offset_ms, rtt)
+
+        if self.offset_ms != previous:
+            for callback in self._listeners:
+                callback(self.offset_ms)
+        return True
+
+    def set_offset(self, offset_ms: float):
+        # offset measured by another process
+        self.offset_ms = offset_ms
+
+    def _run(self):
+        while self.running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Error while synchronizing the server time: %s", e)
+
+    ##### CLOCK #####
+
+    def now_ms(self) -> float:
+        # exchange time
+        return time.time() * 1000 + self.offset_ms
+
+    def timestamp(self) -> int:
+        return int(self.now_ms())
+
+    def stamp(self, data: typing.Dict) -> typing.Dict:
+        # timestamp and recvWindow of a signed request, to be set right before the signature
+        data['timestamp'] = self.timestamp()
+        data['recvWindow'] = self.recv_window
+        return data
+
+
+server_time = TimeSync()
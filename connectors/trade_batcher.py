@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+TradeTick = typing.Tuple[float, float, int]  # price, quantity, trade time
+
+TRADE_BATCH_INTERVAL = 0.05  # seconds, 0 processes every trade as it arrives
+
+
+class TradeBatcher:
+    """
+    Coalesces aggTrades per symbol on the websocket thread and hands them to the strategies in batches from a
+    worker thread, so candles are updated and exits/signals evaluated once per batch instead of once per trade.
+    With an interval of 0, every trade is dispatched immediately on the websocket thread, as before.
+
+    Each batch is dispatched with the time.monotonic() arrival of its first trade, for the latency histograms.
+    """
+
+    def __init__(self, dispatch: typing.Callable[[str, typing.List[TradeTick], float], None], interval: float,
+                 report: typing.Optional[typing.Callable[[], None]] = None, report_interval: float = 600):
+        self.interval = interval
+        self._dispatch = dispatch
+        self._report = report
+        self._report_interval = report_interval
+
+        self._batches: typing.Dict[str, typing.List[TradeTick]] = dict()
+        self._received: typing.Dict[str, float] = dict()
+        self._lock = threading.Lock()
+        self.running = True
+
+        self.trades_received = 0
+        self.batches_dispatched = 0
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def add(self, symbol: str, trade: TradeTick, received: float):
+        self.trades_received += 1
+
+        if self.interval <= 0:
+            self.batches_dispatched += 1
+            self._dispatch(symbol, [trade], received)
+            return
+
+        with self._lock:
+            if symbol in self._batches:
+                self._batches[symbol].append(trade)
+            else:
+                self._batches[symbol] = [trade]
+                self._received[symbol] = received
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(trades) for trades in self._batches.values())
+
+    def _run(self):
+        last_report = time.monotonic()
+
+        while self.running:
+            time.sleep(max(self.interval, 0.01))
+
+            with self._lock:
+                batches = self._batches
+                received = self._received
+                self._batches = dict()
+                self._received = dict()
+
+            for symbol, trades in batches.items():
+                self.batches_dispatched += 1
+                self._dispatch(symbol, trades, received[symbol])
+
+            if self._report is not None and time.monotonic() - last_report >= self._report_interval:
+                last_report = time.monotonic()
+                self._report()
@@ -0,0 +1,119 @@
+import bisect
+import threading
+import typing
+
+from models import Trade
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+# Stop loss and take profit levels of the open trades of every strategy, sorted per symbol, so each new price is
+# compared with the nearest levels only (bisect) instead of going through every open trade.
+#
+#   upper levels: crossed when price >= level   (long take profit, short stop loss)
+#   lower levels: crossed when price <= level   (long stop loss, short take profit)
+#
+# Crossed trades are taken out of the index and handed to their strategy, which puts them back if the exit order
+# fails.
+
+SymbolKey = typing.Tuple[str, str]  # exchange, symbol
+TradeKey = typing.Tuple[str, int]  # strategy key, trade time
+
+# strategy, trade, True for a stop loss / False for a take profit
+Crossed = typing.Tuple["Strategy", Trade, bool]
+
+
+class _Levels:
+    __slots__ = ("levels", "entries")
+
+    def __init__(self):
+        self.levels: typing.List[float] = []
+        self.entries: typing.List[typing.Tuple[TradeKey, "Strategy", Trade, bool]] = []
+
+    def insert(self, level: float, entry: typing.Tuple[TradeKey, "Strategy", Trade, bool]):
+        i = bisect.bisect_right(self.levels, level)
+        self.levels.insert(i, level)
+        self.entries.insert(i, entry)
+
+    def remove(self, level: float, key: TradeKey):
+        i = bisect.bisect_left(self.levels, level)
+        while i < len(self.levels) and self.levels[i] == level:
+            if self.entries[i][0] == key:
+                del self.levels[i]
+                del self.entries[i]
+                return
+            i += 1
+
+
+class TriggerIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._upper: typing.Dict[SymbolKey, _Levels] = dict()
+        self._lower: typing.Dict[SymbolKey, _Levels] = dict()
+        # levels each trade was indexed with, to find its entries again
+        self._indexed: typing.Dict[TradeKey, typing.Tuple[SymbolKey, float, float]] = dict()
+
+    def add(self, strategy: "Strategy", trade: Trade):
+        # the exit lines must be set; a trade already indexed is replaced (exit points recomputed, trade restored)
+        key = (strategy.strategy_key, trade.time)
+        symbol_key = (strategy.exchange, strategy.contract.symbol)
+        if trade.side == "long":
+            upper, upper_sl, lower, lower_sl = trade.profit_line, False, trade.stop_loss_line, True
+        else:
+            upper, upper_sl, lower, lower_sl = trade.stop_loss_line, True, trade.profit_line, False
+
+        with self._lock:
+            self._remove(key)
+            self._upper.setdefault(symbol_key, _Levels()).insert(upper, (key, strategy, trade, upper_sl))
+            self._lower.setdefault(symbol_key, _Levels()).insert(lower, (key, strategy, trade, lower_sl))
+            self._indexed[key] = (symbol_key, upper, lower)
+
+    def remove(self, strategy: "Strategy", trade: Trade):
+        with self._lock:
+            self._remove((strategy.strategy_key, trade.time))
+
+    def remove_strategy(self, strategy: "Strategy"):
+        # a stopped strategy doesn't manage the exits of its trades anymore
+        with self._lock:
+            for key in [key for key in self._indexed if key[0] == strategy.strategy_key]:
+                self._remove(key)
+
+    def _remove(self, key: TradeKey):
+        indexed = self._indexed.pop(key, None)
+        if indexed is None:
+            return
+        symbol_key, upper, lower = indexed
+        self._upper[symbol_key].remove(upper, key)
+        self._lower[symbol_key].remove(lower, key)
+
+    def crossed(self, exchange: str, symbol: str, price: float, high: typing.Optional[float] = None,
+                low: typing.Optional[float] = None) -> typing.List[Crossed]:
+        # high / low: extremes of a batch of trades ending at price, so a level touched within the batch counts too
+        high = price if high is None else max(high, price)
+        low = price if low is None else min(low, price)
+        symbol_key = (exchange, symbol)
+        upper = self._upper.get(symbol_key)
+        lower = self._lower.get(symbol_key)
+        if upper is None:
+            return []
+
+        result = []
+        with self._lock:
+            # only the nearest levels are compared, nothing is crossed on almost every tick
+            if (len(upper.levels) == 0 or upper.levels[0] > high) and \
+                    (len(lower.levels) == 0 or lower.levels[-1] < low):
+                return result
+
+            crossed = upper.entries[:bisect.bisect_right(upper.levels, high)]
+            crossed += lower.entries[bisect.bisect_left(lower.levels, low):]
+            for key, strategy, trade, stop_loss in crossed:
+                if key in self._indexed:  # a trade crossing both of its levels at once is only taken once
+                    self._remove(key)
+                    result.append((strategy, trade, stop_loss))
+        return result
+
+    def __len__(self) -> int:
+        return len(self._indexed)
+
+
+triggers = TriggerIndex()
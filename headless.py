@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import time
+import typing
+
+import keygen
+from checkpoint import CHECKPOINT_FILE, Checkpointer, CheckpointStore, restore_strategy
+from connectors.collateral_pool import CollateralPool
+from connectors.kline_parser import to_candles
+from connectors.sharding import ShardedExecutor
+from latency import latency
+from position_book import positions
+from metrics import register_client_gauges, start_metrics_server
+from trade_journal import DEFAULT_JOURNAL_PATH, journal
+from startup import start_connectors
+from strategies import STRATEGY_TYPES
+
+# Runs the bot without the Tk interface: strategies come from a JSON config file instead of StrategyEditor rows.
+#
+# {
+#     "testnet": false,
+#     "strategies": [
+#         {"strategy_type": "Technical", "contract": "BTCUSDT_Spot", "timeframe": "15m",
+#          "usdt_input": 20, "risk_to_reward": 2,
+#          "parameters": {"rsi_length": 14, "ema_fast": 12, "ema_slow": 26, "ema_signal": 9,
+#                         "candle_source": "klines"}}
+#     ]
+# }
+#
+# "candle_source" is optional: "trades" (default) builds candles from every aggTrade, "klines" uses the exchange's
+# kline stream instead, which is enough for strategies that only act on candle close (not Breakout).
+# "resampled" rolls the symbol's one-minute candles up to the timeframe, aggregated once for every strategy of the
+# symbol; custom timeframes ("10m", "45m") always use it. Neither is available with --workers.
+# "shared_candles": true publishes the strategy's candles in shared memory, readable from other processes with
+# shared_candles.CandleBufferReader (the buffer name is logged when it is created).
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+stream_handler = logging.StreamHandler()
+formatter = logging.Formatter('%(asctime)s %(levelname)s :: %(message)s')
+stream_handler.setFormatter(formatter)
+stream_handler.setLevel(logging.INFO)
+file_handler = logging.FileHandler('info.log')
+file_handler.setFormatter(formatter)
+file_handler.setLevel(logging.DEBUG)
+logger.addHandler(stream_handler)
+logger.addHandler(file_handler)
+
+LOG_FLUSH_INTERVAL = 5  # seconds
+LATENCY_REPORT_INTERVAL = 600  # seconds
+
+
+def load_config(path: str) -> typing.Dict:
+    with open(path, "r") as f:
+        config = json.load(f)
+
+    if "strategies" not in config:
+        raise ValueError(f"{path} has no 'strategies' list")
+
+    return config
+
+
+def start_strategies(exchanges: typing.Dict, strategies_config: typing.List[typing.Dict],
+                     executor: typing.Optional[ShardedExecutor] = None) -> int:
+    # same steps as StrategyEditor._switch_strategy, minus the widgets
+    # with an executor, the strategies run in its worker processes and the clients only hold their stand-ins
+    # history is fetched once per contract/timeframe as arrays, and every strategy gets its own candles built from
+    # them, since parse_trades mutates the last candles
+    history = dict()
+    started = 0
+
+    for b_index, row in enumerate(strategies_config, start=1):
+        try:
+            strat_selected = row['strategy_type']
+            symbol, exchange = row['contract'].split("_")
+            timeframe = row['timeframe']
+            usdt_input = float(row['usdt_input'])
+            risk_to_reward = float(row['risk_to_reward'])
+        except (KeyError, ValueError) as e:
+            logger.error("Invalid strategy #%s in config: %s", b_index, e)
+            continue
+
+        if strat_selected not in STRATEGY_TYPES:
+            logger.error("Unknown strategy type %s for strategy #%s", strat_selected, b_index)
+            continue
+
+        if exchange not in exchanges or symbol not in exchanges[exchange].contracts:
+            logger.error("Unknown contract %s for strategy #%s", row['contract'], b_index)
+            continue
+
+        client = exchanges[exchange]
+        contract = client.contracts[symbol]
+
+        try:
+            new_strategy = STRATEGY_TYPES[strat_selected](client, contract, exchange, timeframe, usdt_input,
+                                                          risk_to_reward, row.get('parameters', dict()))
+        except KeyError as e:
+            logger.error("Missing %s parameter for strategy #%s", e, b_index)
+            continue
+
+        if executor is not None and new_strategy.candle_source == "resampled":
+            # the symbol series live in the ingest process, a worker would only get the trades (and custom timeframes
+            # have no klines to backfill from)
+            logger.error("Strategy #%s (%s %s) uses resampled candles, which are not available with --workers",
+                         b_index, symbol, timeframe)
+            continue
+
+        if new_strategy.candle_source == "resampled":
+            new_strategy.load_candles()  # one-minute history fetched once per symbol, whatever the timeframes
+        else:
+            key = (exchange, symbol, timeframe)
+            if key not in history:
+                history[key] = client.get_historical_klines(contract, timeframe)
+            new_strategy.candles = to_candles(history[key])
+
+        if len(new_strategy.candles) == 0:
+            logger.error("No historical data retrieved for %s", contract.symbol)
+            continue
+
+        new_strategy.assign_key(client.strategies.values())
+        if executor is not None:
+            # the worker restores the open trades of its own strategy
+            client.strategies[b_index] = executor.start_strategy(b_index, new_strategy, strat_selected,
+                                                                 row.get('parameters', dict()))
+        else:
+            new_strategy.restore_trades(journal.open_trades(new_strategy.strategy_key))
+            client.strategies[b_index] = new_strategy
+        started += 1
+        logger.info("%s strategy on %s / %s started", strat_selected, symbol, timeframe)
+
+    return started
+
+
+def restore_strategies(exchanges: typing.Dict, states: typing.List[typing.Dict]) -> int:
+    # warm restart: strategies come from the last checkpoint, only the klines missed since then are fetched
+    start = time.perf_counter()
+    restored = 0
+
+    for state in states:
+        client = exchanges.get(state['exchange'])
+        if client is None:
+            continue
+        strategy = restore_strategy(client, state)
+        if strategy is None or len(strategy.candles) == 0:
+            continue
+        client.strategies[state['b_index']] = strategy
+        restored += 1
+
+    logger.info("Warm restart: %s/%s strategies restored in %.1f s", restored, len(states), time.perf_counter() - start)
+    return restored
+
+
+def flush_logs(exchanges: typing.Dict):
+    # nothing displays these lists in headless mode, so they are logged and emptied instead of growing forever
+    for client in exchanges.values():
+        # popping instead of clearing, so entries appended by the websocket threads meanwhile aren't lost
+        while client.logs:
+            log = client.logs.pop(0)
+            if not log['displayed']:
+                logger.info("%s", log['log'])
+
+        for strategy in client.strategies.values():
+            while strategy.logs:
+                strategy.logs.pop(0)  # already sent to the logger by Strategy._add_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot without the GUI")
+    parser.add_argument("config", help="JSON file with the strategies to run")
+    parser.add_argument("--import-report", action="store_true", help="log the slowest imports before starting")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run the strategies in this many worker processes (0: in this process)")
+    parser.add_argument("--profile", action="store_true",
+                        help="sample where the threads spend their time and time the callbacks (profile_report.jsonl)")
+    parser.add_argument("--profile-budget-ms", type=float, default=100,
+                        help="callbacks taking longer than this are logged when profiling")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve Prometheus metrics on http://127.0.0.1:<port>/metrics (0: disabled)")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH,
+                        help="SQLite file where trades are recorded and open trades restored from (\"\" to disable)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                        help="file where the running strategies are checkpointed every minute")
+    parser.add_argument("--warm-restart", action="store_true",
+                        help="restore the strategies of the checkpoint instead of starting the config's ones")
+    parser.add_argument("--collateral-buffer", type=float, default=None,
+                        help="keep the margin strategies' USDT in the margin account, plus this many USDT "
+                             "(rebalanced in the background instead of transfers around every margin trade)")
+    parser.add_argument("--recv-window", type=int, default=None,
+                        help="milliseconds a signed request stays valid after its timestamp (default 5000, max 60000)")
+    parser.add_argument("--latency-label", default="",
+                        help="label of the latency histograms appended to latency_report.jsonl when stopping")
+    args = parser.parse_args()
+
+    if args.import_report:
+        from import_profile import import_time_report
+        for e in import_time_report("headless", top=15):
+            logger.info("Import %s: %.1f ms (%.1f ms self)", e['module'], e['cumulative_ms'], e['self_ms'])
+
+    config = load_config(args.config)
+    testnet = config.get('testnet', False)
+
+    profiler = None
+    if args.profile:
+        # strategies running in worker processes (--workers) are not profiled
+        from profiler import enable_profiling
+        profiler = enable_profiling(budget_ms=args.profile_budget_ms)
+
+    publicKey, secretKey = keygen.getKeys()
+    spot, margin, balance_websocket = start_connectors(publicKey, secretKey, testnet=testnet, recv_window=args.recv_window)
+
+    exchanges = {"Spot": spot, "Margin": margin}
+
+    if args.collateral_buffer is not None:
+        CollateralPool(margin, args.collateral_buffer)
+
+    if args.metrics_port > 0:
+        register_client_gauges(exchanges, balance_websocket)
+        start_metrics_server(args.metrics_port)
+
+    journal_path = args.journal or None
+    if journal_path is not None and args.workers == 0:
+        journal.open(journal_path)
+
+    executor = ShardedExecutor(exchanges, args.workers, journal_path) if args.workers > 0 else None
+
+    # strategies running in worker processes are not checkpointed
+    store = CheckpointStore(args.checkpoint)
+    states = store.load() if args.warm_restart and executor is None else []
+    if len(states) > 0:
+        restore_strategies(exchanges, states)
+    else:
+        started = start_strategies(exchanges, config['strategies'], executor)
+        logger.info("Headless mode: %s/%s strategies running", started, len(config['strategies']))
+
+    if journal_path is not None:
+        journal.log_unclaimed({strategy.strategy_key for client in exchanges.values()
+                               for strategy in client.strategies.values()}, journal_path)
+
+    checkpointer = Checkpointer(exchanges, store) if executor is None else None
+
+    last_latency_report = time.monotonic()
+    try:
+        while True:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            flush_logs(exchanges)
+
+            if time.monotonic() - last_latency_report >= LATENCY_REPORT_INTERVAL:
+                last_latency_report = time.monotonic()
+                latency.log_report()
+                positions.log_report()
+    except KeyboardInterrupt:
+        logger.info("Stopping")
+        positions.log_report()
+        latency.log_report()
+        latency.dump(label=args.latency_label)
+        if profiler is not None:
+            profiler.report()
+        if executor is not None:
+            executor.stop()
+        if checkpointer is not None:
+            checkpointer.running = False
+            checkpointer.checkpoint()
+        journal.close()
+        spot.reconnect = False
+        margin.reconnect = False
+        balance_websocket.spot_reconnect = False
+        balance_websocket.margin_reconnect = False
+
+        spot.ws.close()
+        margin.ws.close()
+        balance_websocket.spot_ws.close()
+        balance_websocket.margin_ws.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing
+
+# Import-time report and cold-start benchmark.
+#
+#   python import_profile.py headless                 -> slowest imports when loading the headless runner
+#   python import_profile.py --benchmark --runs 10    -> cold-start time, appended to startup_benchmark.jsonl
+#
+# Every measurement runs in a fresh interpreter, so nothing is already cached in sys.modules.
+
+BENCHMARK_FILE = "startup_benchmark.jsonl"
+DEFAULT_MODULES = ["headless"]
+
+
+def import_time_report(module: str, top: int = 20) -> typing.List[typing.Dict]:
+    # uses the interpreter's own -X importtime output: "import time: self [us] | cumulative | imported package"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else f"import {module} failed", file=sys.stderr)
+
+    entries.sort(key=lambda e: e['cumulative_ms'], reverse=True)
+    return entries[:top]
+
+
+def cold_start(module: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+def benchmark(modules: typing.List[str], runs: int) -> typing.List[typing.Dict]:
+    results = []
+    for module in modules:
+        timings = [cold_start(module) * 1000 for _ in range(runs)]
+        results.append({"date": datetime.datetime.now().isoformat(timespec="seconds"), "module": module,
+                        "runs": runs, "median_ms": round(statistics.median(timings), 1),
+                        "min_ms": round(min(timings), 1), "python": sys.version.split()[0]})
+
+    # appended, so cold-start times can be compared across releases
+    with open(BENCHMARK_FILE, "a") as f:
+        for r in results:
+            f.write(json.dumps(r) + "\n")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time report and cold-start benchmark")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=20, help="number of imports shown in the report")
+    parser.add_argument("--benchmark", action="store_true", help="measure cold-start time instead")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for r in benchmark(args.modules, args.runs):
+            print(f"{r['module']}: median {r['median_ms']} ms, min {r['min_ms']} ms over {r['runs']} runs")
+        return
+
+    for module in args.modules:
+        print(f"import {module}")
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for e in import_time_report(module, args.top):
+            print(f"{e['cumulative_ms']:>14.1f} {e['self_ms']:>9.1f}  {e['module']}")
+
+
+if __name__ == '__main__':
+    main()
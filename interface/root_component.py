@@ -12,6 +12,7 @@ from interface.logging_component import Logging
 from interface.watchlist_component import WatchList
 from interface.trades_component import TradesWatch
 from interface.strategy_component import StrategyEditor
+from position_book import positions
 
 logger = logging.getLogger()
 
@@ -46,6 +47,8 @@ class Root(tk.Tk):
         self._trades_frame = TradesWatch(self._right_frame, bg = BG_COLOR)
         self._trades_frame.pack(side=tk.TOP)
 
+        self._final_trades = set()  # closed trades already displayed with their realized PnL
+
         self._update_ui()
 
     def _ask_before_close(self):
@@ -79,29 +82,25 @@ class Root(tk.Tk):
         # Trade Component and Trade Logs
 
         for client in [self.spot, self.margin]:
-            try:
-                for b_index, strategy in client.strategies.items():
-                    for log in strategy.logs:
-                        if not log['displayed']:
-                            self.logging_frame.add_log(log['log'])
-                            log['displayed'] = True
-
-                    for trade in strategy.trades:
-                        if trade.time not in self._trades_frame.body_widgets['Time']:
-                            self._trades_frame.add_trade(trade)
-
-                        precision = 3
-
-                        pnl_str = str(round(trade.pnl, precision))
-                        self._trades_frame.body_widgets['PnL_var'][trade.time].set(pnl_str)
-                        self._trades_frame.body_widgets['Status_var'][trade.time].set(trade.status.capitalize())
-
-            except RuntimeError as e:
-                logger.error("Error while looping thorough the strategies dictionary: %s", e)
-
-
+            for b_index, strategy in client.strategies.snapshot().items():
+                for log in strategy.logs:
+                    if not log['displayed']:
+                        self.logging_frame.add_log(log['log'])
+                        log['displayed'] = True
+
+                for trade in strategy.trades:
+                    if trade.time in self._final_trades:
+                        continue
+                    if trade.time not in self._trades_frame.body_widgets['Time']:
+                        self._trades_frame.add_trade(trade)
 
+                    precision = 3
 
+                    pnl_str = str(round(positions.trade_pnl(trade), precision))
+                    self._trades_frame.body_widgets['PnL_var'][trade.time].set(pnl_str)
+                    self._trades_frame.body_widgets['Status_var'][trade.time].set(trade.status.capitalize())
+                    if trade.status != "open":
+                        self._final_trades.add(trade.time)
 
         # Watchlist prices
 
@@ -4,7 +4,12 @@ from pprint import pprint
 from interface.styling import *
 from connectors.binance_spot import BinanceSpotClient
 from connectors.binance_margin import BinanceMarginClient
-from strategies import TechnicalStrategy, BreakoutStrategy, MacdEmaStrategy, EmaRsiStochStrategy
+from checkpoint import restore_strategy
+from exit_triggers import triggers
+from order_manager import orders
+from position_book import positions
+from strategies import STRATEGY_TYPES
+from trade_journal import journal
 
 
 class StrategyEditor(tk.Frame):
@@ -131,6 +136,26 @@ class StrategyEditor(tk.Frame):
 
         self._body_index += 1
 
+    def restore_rows(self, states: typing.List[typing.Dict]):
+        # warm restart: one row per checkpointed strategy, activated from its checkpoint
+        for state in states:
+            if state['exchange'] not in self._exchanges or state['strategy_type'] not in self._extra_params:
+                continue
+
+            b_index = self._body_index
+            self._add_strategy_row()
+
+            self.body_widgets['strategy_type_var'][b_index].set(state['strategy_type'])
+            self.body_widgets['contract_var'][b_index].set(state['symbol'] + "_" + state['exchange'])
+            self.body_widgets['timeframe_var'][b_index].set(state['timeframe'])
+            self.body_widgets['usdt_input'][b_index].insert(tk.END, str(state['usdt_input']))
+            self.body_widgets['risk_to_reward'][b_index].insert(tk.END, str(state['risk_to_reward']))
+            for code_name, value in state['parameters'].items():
+                if code_name in self._additional_parameters[b_index]:
+                    self._additional_parameters[b_index][code_name] = value
+
+            self._switch_strategy(b_index, state)
+
     def _delete_row(self, b_index: int):
         for element in self._base_params:
             self.body_widgets[element['code_name']][b_index].grid_forget()
@@ -200,7 +225,7 @@ class StrategyEditor(tk.Frame):
 
         self._popup_window.destroy()
 
-    def _switch_strategy(self, b_index: int):
+    def _switch_strategy(self, b_index: int, state: typing.Optional[typing.Dict] = None):
         # one to activate/ deactivate strategy
         # one for checking that we didn't forget to add any parameters among the mandatory ones
         for param in ["usdt_input", "risk_to_reward"]:
@@ -228,34 +253,28 @@ class StrategyEditor(tk.Frame):
         # if button is currently off, it means we clicked it to activate the strat
         if self.body_widgets['activation'][b_index].cget("text") == "OFF":
 
-            if strat_selected == "Technical":
-                new_strategy = TechnicalStrategy(self._exchanges[exchange], contract, exchange, timeframe,
-                                                 usdt_input, risk_to_reward,
-                                                 self._additional_parameters[b_index])
-
-            elif strat_selected == "Breakout":
-                new_strategy = BreakoutStrategy(self._exchanges[exchange], contract, exchange, timeframe,
-                                                usdt_input, risk_to_reward,
-                                                self._additional_parameters[b_index])
-
-            elif strat_selected == "MACD_EMA":
-                new_strategy = MacdEmaStrategy(self._exchanges[exchange], contract, exchange, timeframe,
-                                               usdt_input, risk_to_reward,
-                                               self._additional_parameters[b_index])
-
-            elif strat_selected == "EmaRsiStoch":
-                new_strategy = EmaRsiStochStrategy(self._exchanges[exchange], contract, exchange, timeframe,
-                                               usdt_input, risk_to_reward,
-                                               self._additional_parameters[b_index])
-            else:
+            if strat_selected not in STRATEGY_TYPES:
                 return
 
-            new_strategy.candles = self._exchanges[exchange].get_historical_candles(contract, timeframe)
+            if state is not None:
+                # checkpointed candles and trades, only the klines missed since the checkpoint are fetched
+                new_strategy = restore_strategy(self._exchanges[exchange], state)
+                if new_strategy is None:
+                    self.root.logging_frame.add_log(f"Could not restore {strat_selected} strategy on {symbol}")
+                    return
+            else:
+                new_strategy = STRATEGY_TYPES[strat_selected](self._exchanges[exchange], contract, exchange, timeframe,
+                                                              usdt_input, risk_to_reward,
+                                                              self._additional_parameters[b_index])
+                new_strategy.load_candles()
 
             if len(new_strategy.candles) == 0:
                 self.root.logging_frame.add_log(f"No historical data retrieved for {contract.symbol}")
                 return
 
+            if state is None:
+                new_strategy.assign_key(self._exchanges[exchange].strategies.values())
+                new_strategy.restore_trades(journal.open_trades(new_strategy.strategy_key))
             self._exchanges[exchange].strategies[b_index] = new_strategy
 
             # deactivate the buttons to avoid user changing the values while it is running
@@ -268,7 +287,11 @@ class StrategyEditor(tk.Frame):
             self.root.logging_frame.add_log(f"{strat_selected} strategy on {symbol} / {timeframe} started")
 
         else:
-            del self._exchanges[exchange].strategies[b_index]
+            stopped = self._exchanges[exchange].strategies.pop(b_index)
+            triggers.remove_strategy(stopped)
+            positions.remove_strategy(stopped)
+            orders.remove_strategy(stopped)
+            stopped.release()
 
             for param in self._base_params:
                 code_name = param['code_name']
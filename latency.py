@@ -0,0 +1,142 @@
+import bisect
+import datetime
+import json
+import logging
+import sys
+import threading
+import typing
+
+logger = logging.getLogger()
+
+# Latency of every stage of the order path, measured with time.monotonic() (except the exchange stage, which
+# compares the exchange's timestamp to our wall clock):
+#
+#   exchange_to_receive  trade / kline event time -> _on_message                    (per stream: "Spot BTCUSDT")
+#   receive_to_parse     _on_message -> candles updated (includes trade batching)   (per strategy)
+#   exchange_to_parse    trade time -> candles updated, what the old 2000 ms warning looked at
+#   parse_to_signal      candles updated -> check_trade decided to open a position
+#   signal_to_send       signal -> place_order sent (trade size request included)
+#   send_to_ack          place_order sent -> exchange response
+#   receive_to_ack       _on_message -> exchange response, for entries
+#   exit_send_to_ack     same as send_to_ack, for take profit / stop loss orders
+
+LATENCY_REPORT_FILE = "latency_report.jsonl"
+
+BUCKET_BOUNDS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]  # ms
+
+# samples above these are counted as slow and reported in the log
+WARN_THRESHOLDS = {"exchange_to_receive": 2000, "exchange_to_parse": 2000, "send_to_ack": 2000,
+                   "exit_send_to_ack": 2000}
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)  # the last one counts everything above the last bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+    def add(self, ms: float, threshold: typing.Optional[float] = None):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        if threshold is not None and ms >= threshold:
+            self.slow += 1
+
+    def merge(self, data: typing.Dict):
+        for i, n in enumerate(data['buckets']):
+            self.buckets[i] += n
+        self.count += data['count']
+        self.total += data['total']
+        self.max = max(self.max, data['max'])
+        self.slow += data['slow']
+
+    def percentile(self, p: float) -> float:
+        # upper bound of the bucket holding the p-th percentile
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self) -> typing.Dict:
+        return {"buckets": self.buckets, "count": self.count, "total": self.total, "max": self.max,
+                "slow": self.slow}
+
+
+class LatencyRecorder:
+    """
+    Per-stage latency histograms, keyed by stream ("Spot BTCUSDT") or strategy ("Spot BTCUSDT 15m Technical").
+    Recording is a dictionary lookup and a bisect under a lock, cheap enough for every trade batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: typing.Dict[typing.Tuple[str, str], LatencyHistogram] = dict()
+
+    def record(self, key: str, stage: str, ms: float):
+        with self._lock:
+            histogram = self._histograms.get((key, stage))
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._histograms[(key, stage)] = histogram
+            histogram.add(ms, WARN_THRESHOLDS.get(stage))
+
+    def snapshot(self) -> typing.Dict[str, typing.Dict[str, typing.Dict]]:
+        with self._lock:
+            result = dict()
+            for (key, stage), histogram in self._histograms.items():
+                result.setdefault(key, dict())[stage] = histogram.to_dict()
+            return result
+
+    def drain(self) -> typing.Dict[str, typing.Dict[str, typing.Dict]]:
+        # snapshot and reset, used by worker processes to send their samples to the main one
+        with self._lock:
+            result = dict()
+            for (key, stage), histogram in self._histograms.items():
+                result.setdefault(key, dict())[stage] = histogram.to_dict()
+            self._histograms = dict()
+            return result
+
+    def merge(self, data: typing.Dict[str, typing.Dict[str, typing.Dict]]):
+        with self._lock:
+            for key, stages in data.items():
+                for stage, values in stages.items():
+                    histogram = self._histograms.get((key, stage))
+                    if histogram is None:
+                        histogram = LatencyHistogram()
+                        self._histograms[(key, stage)] = histogram
+                    histogram.merge(values)
+
+    def summary(self) -> typing.List[typing.Dict]:
+        with self._lock:
+            rows = []
+            for (key, stage), h in sorted(self._histograms.items()):
+                rows.append({"key": key, "stage": stage, "count": h.count,
+                             "mean_ms": round(h.total / h.count, 3) if h.count else 0.0,
+                             "p50_ms": h.percentile(50), "p99_ms": h.percentile(99), "max_ms": round(h.max, 3),
+                             "slow": h.slow})
+            return rows
+
+    def log_report(self):
+        for row in self.summary():
+            logger.info("Latency %s %s: %s samples, mean %s ms, p50 <= %s ms, p99 <= %s ms, max %s ms%s",
+                        row['key'], row['stage'], row['count'], row['mean_ms'], row['p50_ms'], row['p99_ms'],
+                        row['max_ms'], f", {row['slow']} slow" if row['slow'] else "")
+
+    def dump(self, path: str = LATENCY_REPORT_FILE, label: str = ""):
+        # appended, so the histograms of two releases can be compared
+        entry = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "label": label,
+                 "python": sys.version.split()[0], "bucket_bounds_ms": BUCKET_BOUNDS, "histograms": self.snapshot()}
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+latency = LatencyRecorder()
@@ -1,14 +1,15 @@
 import datetime
+import os
 import time
-import tkinter as tk
-import pandas as pd
 import logging
 import keygen
 from pprint import pprint
 # from connectors.bitmex_api import get_contracts
-from connectors.binance_margin import BinanceMarginClient
-from connectors.binance_spot import BinanceSpotClient
-from connectors.balance_websocket import BalanceWebsocket
+from checkpoint import Checkpointer, CheckpointStore
+from latency import latency
+from metrics import register_client_gauges, start_metrics_server
+from startup import start_connectors
+from trade_journal import journal
 from interface.root_component import Root
 
 logger = logging.getLogger()
@@ -24,13 +25,38 @@ logger.addHandler(stream_handler)
 logger.addHandler(file_handler)
 
 if __name__ == '__main__':
+    if os.environ.get("CRYPTORADE_PROFILE"):
+        from profiler import enable_profiling
+        enable_profiling(ui=True)
+
     publicKey, secretKey = keygen.getKeys()
-    spot = BinanceSpotClient(public_key=publicKey, secret_key=secretKey, testnet=False)
-    margin = BinanceMarginClient(public_key=publicKey, spot= spot, secret_key=secretKey, testnet=False)
-    balance_websocket = BalanceWebsocket(public_key=publicKey, secret_key=secretKey, spot=spot, margin=margin, testnet=False)
-    time.sleep(1.5)  # necessary to not get error while subscribing due to external thread
-    spot.make_snapshot()
+    recv_window = int(os.environ["CRYPTORADE_RECV_WINDOW"]) if os.environ.get("CRYPTORADE_RECV_WINDOW") else None
+    spot, margin, balance_websocket = start_connectors(publicKey, secretKey, testnet=False, recv_window=recv_window)
+
+    if os.environ.get("CRYPTORADE_COLLATERAL_BUFFER"):
+        from connectors.collateral_pool import CollateralPool
+        CollateralPool(margin, float(os.environ["CRYPTORADE_COLLATERAL_BUFFER"]))
+
+    if os.environ.get("CRYPTORADE_METRICS_PORT"):
+        register_client_gauges({"Spot": spot, "Margin": margin}, balance_websocket)
+        start_metrics_server(int(os.environ["CRYPTORADE_METRICS_PORT"]))
+
+    # open trades of the previous run are given back to their strategies when they are activated again
+    journal.open()
 
     root = Root(spot=spot, margin=margin, balance_websocket=balance_websocket)
 
+    store = CheckpointStore()
+    if os.environ.get("CRYPTORADE_WARM_RESTART"):
+        root._strategy_frame.restore_rows(store.load())
+    journal.log_unclaimed({strategy.strategy_key for client in (spot, margin)
+                           for strategy in client.strategies.values()})
+    checkpointer = Checkpointer({"Spot": spot, "Margin": margin}, store)
+
     root.mainloop()
+    checkpointer.running = False
+    checkpointer.checkpoint()
+    journal.close()
+
+    # histograms of the order path stages, appended so releases can be compared
+    latency.dump()
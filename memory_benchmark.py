@@ -0,0 +1,91 @@
+import argparse
+import datetime
+import json
+import sys
+import tracemalloc
+import typing
+
+from models import Candle, Contract, Trade
+
+# Memory used per candle and per trade by the models.
+#
+#   python memory_benchmark.py --count 100000    -> bytes per object, appended to memory_benchmark.jsonl
+#
+# The dict-backed classes below have the layout the models had before __slots__, for comparison.
+
+BENCHMARK_FILE = "memory_benchmark.jsonl"
+
+
+class _DictCandle:
+    def __init__(self, timestamp, open_, high, low, close, volume):
+        self.timestamp = timestamp
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+
+class _DictTrade:
+    def __init__(self, trade_info):
+        self.time = trade_info['time']
+        self.contract = trade_info['contract']
+        self.strategy = trade_info['strategy']
+        self.side = trade_info['side']
+        self.entry_price = trade_info['entry_price']
+        self.status = trade_info['status']
+        self.pnl = trade_info['pnl']
+        self.quantity = trade_info['quantity']
+        self.entry_id = trade_info['entry_id']
+        self.stop_loss_line = None
+        self.profit_line = None
+
+
+def _bytes_per_object(build: typing.Callable[[int], object], count: int) -> float:
+    # the values are created before measuring, so only the objects themselves are counted
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    list_size = sys.getsizeof(objects)
+    return (after - before - list_size) / count
+
+
+def benchmark(count: int) -> typing.Dict:
+    prices = [float(i) for i in range(count)]
+    contract = Contract.__new__(Contract)
+    trade_info = {"time": 0, "entry_price": 1.0, "contract": contract, "strategy": "Technical", "side": "long",
+                  "status": "open", "pnl": 0.0, "quantity": 1.0, "entry_id": 1}
+
+    result = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "count": count,
+        "python": sys.version.split()[0],
+        "candle_dict_bytes": _bytes_per_object(
+            lambda i: _DictCandle(i, prices[i], prices[i], prices[i], prices[i], prices[i]), count),
+        "candle_slots_bytes": _bytes_per_object(
+            lambda i: Candle.from_values(i, prices[i], prices[i], prices[i], prices[i], prices[i]), count),
+        "trade_dict_bytes": _bytes_per_object(lambda i: _DictTrade(trade_info), count),
+        "trade_slots_bytes": _bytes_per_object(lambda i: Trade(trade_info), count),
+    }
+
+    with open(BENCHMARK_FILE, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory used per candle and per trade")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    r = benchmark(args.count)
+    print(f"Candle: {r['candle_dict_bytes']:.0f} bytes with __dict__, {r['candle_slots_bytes']:.0f} bytes with __slots__")
+    print(f"Trade: {r['trade_dict_bytes']:.0f} bytes with __dict__, {r['trade_slots_bytes']:.0f} bytes with __slots__")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import logging
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from position_book import positions
+
+logger = logging.getLogger()
+
+# Counters and gauges in the Prometheus text format, served on a local HTTP endpoint so the monitoring stack can
+# scrape the bot instead of parsing info.log. Updating a metric is a dictionary increment under a lock; the values
+# are only formatted when /metrics is requested.
+#
+#   cryptorade_messages_total{exchange, stream, symbol}           websocket messages (rate() gives messages/s)
+#   cryptorade_trade_lag_ms{exchange, symbol}                    now - trade time of the last aggTrade
+#   cryptorade_candles_total{exchange, symbol, timeframe}        candles built by the strategies
+#   cryptorade_signals_total{strategy, symbol, timeframe, side}  entry signals
+#   cryptorade_orders_total{exchange, symbol, kind, result}      orders sent / failed
+#   cryptorade_rest_request_seconds{exchange, method, endpoint}  REST latency (summary: _sum and _count)
+#   cryptorade_rest_errors_total{exchange, method, endpoint}     failed REST requests
+#   cryptorade_reconnects_total{connection}                      websocket reconnections
+#   cryptorade_balance_staleness_seconds{account}                seconds since the last balance update
+#   cryptorade_trade_batch_pending{exchange}                     trades waiting in the batcher
+#   cryptorade_pnl{account, kind}                                unrealized / realized PnL from the position book
+#   cryptorade_clock_offset_ms                                   exchange clock - local clock (connectors/time_sync.py)
+#   cryptorade_clock_rtt_ms                                      round trip of the last server time sample
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: typing.Dict[str, typing.Tuple[str, str]] = dict()  # name -> (type, help)
+        self._values: typing.Dict[str, typing.Dict[Labels, float]] = dict()
+        self._callbacks: typing.Dict[str, typing.Callable[[], typing.Dict[Labels, float]]] = dict()
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        self._help[name] = (metric_type, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, dict())[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        # summary without quantiles: the scraper computes averages from _sum and _count
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            sums = self._values.setdefault(name + "_sum", dict())
+            sums[key] = sums.get(key, 0) + value
+            counts = self._values.setdefault(name + "_count", dict())
+            counts[key] = counts.get(key, 0) + 1
+
+    def drain(self) -> typing.Dict[str, typing.Dict[Labels, float]]:
+        # values since the last call, used by worker processes to send their counters to the main one
+        with self._lock:
+            values = self._values
+            self._values = dict()
+            return values
+
+    def merge(self, values: typing.Dict[str, typing.Dict[Labels, float]]):
+        # values are added, so only counters and summaries can be merged
+        with self._lock:
+            for name, series in values.items():
+                own = self._values.setdefault(name, dict())
+                for key, value in series.items():
+                    own[key] = own.get(key, 0) + value
+
+    def add_callback(self, name: str, callback: typing.Callable[[], typing.Dict[Labels, float]]):
+        # gauges read from the bot's state when scraped (balance staleness, queue depths)
+        self._callbacks[name] = callback
+
+    def render(self) -> str:
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+
+        for name, callback in self._callbacks.items():
+            try:
+                values[name] = callback()
+            except Exception as e:
+                logger.error("Error while computing metric %s: %s", name, e)
+
+        # summaries are stored as two series, both listed under the summary's HELP and TYPE
+        grouped: typing.Dict[str, typing.List[str]] = dict()
+        for name in sorted(values):
+            base = name[:-4] if name.endswith("_sum") else name[:-6] if name.endswith("_count") else name
+            grouped.setdefault(base, []).append(name)
+
+        lines = []
+        for base, names in grouped.items():
+            if base in self._help:
+                metric_type, help_text = self._help[base]
+                lines.append(f"# HELP {base} {help_text}")
+                lines.append(f"# TYPE {base} {metric_type}")
+            for name in names:
+                for labels, value in values[name].items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("cryptorade_messages_total", "counter", "Websocket messages received")
+metrics.describe("cryptorade_trade_lag_ms", "gauge", "Current time minus the trade time of the last aggTrade")
+metrics.describe("cryptorade_candles_total", "counter", "Candles built by the strategies")
+metrics.describe("cryptorade_signals_total", "counter", "Entry signals fired by the strategies")
+metrics.describe("cryptorade_orders_total", "counter", "Orders sent to the exchange, by result")
+metrics.describe("cryptorade_rest_request_seconds", "summary", "Duration of the REST requests")
+metrics.describe("cryptorade_rest_errors_total", "counter", "REST requests that failed")
+metrics.describe("cryptorade_reconnects_total", "counter", "Websocket reconnections")
+metrics.describe("cryptorade_balance_staleness_seconds", "gauge", "Seconds since the balances were last updated")
+metrics.describe("cryptorade_trade_batch_pending", "gauge", "aggTrades waiting to be dispatched to the strategies")
+metrics.describe("cryptorade_pnl", "gauge", "Unrealized and realized PnL per account, from the position book")
+metrics.describe("cryptorade_clock_offset_ms", "gauge", "Exchange clock minus the local clock")
+metrics.describe("cryptorade_clock_rtt_ms", "gauge", "Round trip of the last server time sample")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per scrape would flood info.log
+
+
+def register_client_gauges(exchanges: typing.Dict, balance_websocket):
+    def staleness():
+        now = time.time()
+        return {(("account", account),): round(now - updated, 3)
+                for account, updated in balance_websocket.last_balance_update.items() if updated is not None}
+
+    def pending():
+        return {(("exchange", name),): client.trade_batcher.pending() for name, client in exchanges.items()}
+
+    def pnl():
+        values = dict()
+        for account in positions.accounts():
+            unrealized, realized = positions.account_pnl(account)
+            values[(("account", account), ("kind", "unrealized"))] = round(unrealized, 8)
+            values[(("account", account), ("kind", "realized"))] = round(realized, 8)
+        return values
+
+    metrics.add_callback("cryptorade_balance_staleness_seconds", staleness)
+    metrics.add_callback("cryptorade_trade_batch_pending", pending)
+    metrics.add_callback("cryptorade_pnl", pnl)
+
+
+def start_metrics_server(port: int, host: str = DEFAULT_METRICS_HOST) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+
+    logger.info("Metrics served on http://%s:%s/metrics", host, port)
+    return server
@@ -1,24 +1,39 @@
 import math
+import typing
+
+# the models use __slots__: no per-instance __dict__, which matters for the thousands of candles kept per strategy
+
 
 class SpotBalance:
+    __slots__ = ("asset", "free", "locked")
+
     def __init__(self, data):
         self.asset = data['asset']
         self.free = data['free']
         self.locked = data['locked']
 
 class MarginBalance:
+    __slots__ = ("asset", "free", "locked")
+
     def __init__(self, data):
         self.asset = data['asset']
         self.free = data['free']
         self.locked = data['locked']
 
 class Contract:
+    __slots__ = ("symbol", "base_asset", "quote_asset", "tick_size", "base_asset_decimals", "price_tick", "exchange")
+
     def __init__(self, contract_data, exchange):
         self.symbol = contract_data['symbol']
         self.base_asset = contract_data['baseAsset']
         self.quote_asset = contract_data['quoteAsset']
         self.tick_size = float(contract_data['filters'][2]['stepSize'])
         self.base_asset_decimals = int(-math.log10(self.tick_size))
+        # price step, for the limit and stop prices of the exit orders
+        self.price_tick = None
+        for f in contract_data['filters']:
+            if f.get('filterType') == "PRICE_FILTER":
+                self.price_tick = float(f['tickSize'])
         self.exchange = exchange
         # self.quote_asset_decimals = contract_data['quotePrecision']
         # self.lot_size = 1.0 / pow(10, self.quantity_decimals)
@@ -33,7 +48,10 @@ class Contract:
 
 
 class Candle:
+    __slots__ = ("timestamp", "open", "high", "low", "close", "volume")
+
     def __init__(self, candle_data, timeframe, exchange):
+        # kept for older callers, new code uses from_kline / from_values which don't need a row or dict per candle
 
         if exchange == "Spot" or exchange == "Margin":       #check for spellings
             self.timestamp = candle_data[0]
@@ -51,6 +69,30 @@ class Candle:
             self.close = float(candle_data['close'])
             self.volume = float(candle_data['volume'])
 
+    @classmethod
+    def from_values(cls, timestamp: int, open_: float, high: float, low: float, close: float,
+                    volume: float) -> "Candle":
+        candle = cls.__new__(cls)
+        candle.timestamp = timestamp
+        candle.open = open_
+        candle.high = high
+        candle.low = low
+        candle.close = close
+        candle.volume = volume
+        return candle
+
+    @classmethod
+    def from_kline(cls, kline) -> "Candle":
+        # a row of the REST klines response: [open time, "open", "high", "low", "close", "volume", ...]
+        candle = cls.__new__(cls)
+        candle.timestamp = kline[0]
+        candle.open = float(kline[1])
+        candle.high = float(kline[2])
+        candle.low = float(kline[3])
+        candle.close = float(kline[4])
+        candle.volume = float(kline[5])
+        return candle
+
 # class Contract:
 #     def __init__(self, contract_data):
 #         self.symbol = contract_data['symbol']
@@ -63,13 +105,80 @@ class Candle:
 
 
 class OrderStatus:
+    __slots__ = ("order_id", "status", "avg_price", "executed_qty", "commission")
+
     def __init__(self, order_info):
         self.order_id = order_info['orderId']
         self.status = order_info['status'].lower()
         self.avg_price = float(order_info['price'])
+        self.executed_qty = float(order_info.get('executedQty', 0))
+        # fills of a market order response (FULL), empty for the order status queries
+        self.commission: typing.Dict[str, float] = dict()  # asset -> amount
+        for fill in order_info.get('fills', []):
+            self.commission[fill['commissionAsset']] = self.commission.get(fill['commissionAsset'], 0.0) + \
+                float(fill['commission'])
+
+
+class Order:
+    __slots__ = ("order_id", "symbol", "side", "status", "quantity", "filled_quantity", "quote_quantity",
+                 "commission", "update_time", "_executions")
+
+    def __init__(self, order_id: int, symbol: str):
+        self.order_id = order_id
+        self.symbol = symbol
+        self.side = None
+        self.status = "NEW"
+        self.quantity = 0.0
+        self.filled_quantity = 0.0
+        self.quote_quantity = 0.0
+        self.commission: typing.Dict[str, float] = dict()  # asset -> amount
+        self.update_time = 0
+        self._executions: typing.Set[typing.Tuple[str, int]] = set()  # (execution type, trade id) already applied
+
+    def update(self, report) -> bool:
+        # executionReport of the user data stream: cumulative quantities, commission of this execution only
+        # returns False for a report already applied (both streams deliver it during a listen key rollover)
+        execution = (report['x'], report.get('t', -1))
+        if execution in self._executions:
+            return False
+        self._executions.add(execution)
+
+        self.side = report['S']
+        self.status = report['X']
+        self.quantity = float(report['q'])
+        self.filled_quantity = float(report['z'])
+        self.quote_quantity = float(report['Z'])
+        if report.get('N') is not None:
+            self.commission[report['N']] = self.commission.get(report['N'], 0.0) + float(report['n'])
+        self.update_time = report['T']
+        return True
+
+    @property
+    def avg_price(self) -> typing.Optional[float]:
+        if self.filled_quantity == 0:
+            return None
+        return self.quote_quantity / self.filled_quantity
+
+
+class OcoOrderStatus:
+    __slots__ = ("list_id", "take_profit_id", "stop_loss_id")
+
+    def __init__(self, order_list):
+        # response of an OCO order: the limit leg is the take profit, the stop leg the stop loss
+        self.list_id = order_list['orderListId']
+        self.take_profit_id = None
+        self.stop_loss_id = None
+        for report in order_list['orderReports']:
+            if report['type'].startswith("STOP_LOSS"):
+                self.stop_loss_id = report['orderId']
+            else:
+                self.take_profit_id = report['orderId']
 
 
 class Trade:
+    __slots__ = ("time", "contract", "strategy", "side", "entry_price", "status", "pnl", "quantity", "entry_id",
+                 "stop_loss_line", "profit_line", "exit_orders", "commission")
+
     def __init__(self, trade_info):
         self.time: int = trade_info['time']
         self.contract: Contract = trade_info['contract']
@@ -82,5 +191,9 @@ class Trade:
         self.entry_id = trade_info['entry_id']
         self.stop_loss_line = None
         self.profit_line = None
+        # exchange-side OCO protecting the trade: (order list id, take profit order id, stop loss order id)
+        self.exit_orders: typing.Optional[typing.Tuple[int, int, int]] = None
+        # commission paid per asset, from the fills of the entry and exit orders
+        self.commission: typing.Optional[typing.Dict[str, float]] = None
 
 
@@ -0,0 +1,165 @@
+import collections
+import logging
+import threading
+import typing
+
+from models import Order, Trade
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+# Orders of the strategies, updated from the executionReport events of the user data streams
+# (connectors/balance_websocket.py) as they arrive, instead of polling the order status over REST.
+#
+# - entry and exit orders: the trade gets the actual average fill price, filled quantity and commission
+# - exchange-side exit orders (OCO take profit / stop loss legs): a leg FILLED closes the trade at the fill's average
+#   price; both legs ended without a fill (cancelled by hand, rejected, expired) and the strategy watches the
+#   trade's exit lines itself again (exit_triggers.py)
+#
+# The events of an order often arrive before the REST response that gives its id, so events of unknown orders are
+# kept for a while and applied when the order is tracked.
+
+OrderKey = typing.Tuple[str, int]  # exchange, order id
+
+TERMINAL_STATUSES = {"CANCELED", "EXPIRED", "REJECTED", "EXPIRED_IN_MATCH"}
+UNMATCHED_ORDERS = 1000  # events kept for orders not tracked (yet)
+
+
+class _ProtectedTrade:
+    __slots__ = ("strategy", "trade", "ended_legs")
+
+    def __init__(self, strategy: "Strategy", trade: Trade):
+        self.strategy = strategy
+        self.trade = trade
+        self.ended_legs = 0
+
+
+class OrderManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # order sent by a strategy: "entry" or "exit"
+        self._tracked: typing.Dict[OrderKey, typing.Tuple["Strategy", Trade, str, Order]] = dict()
+        self._exit_legs: typing.Dict[OrderKey, typing.Tuple[_ProtectedTrade, bool, Order]] = dict()
+        self._unmatched: "collections.OrderedDict[OrderKey, Order]" = collections.OrderedDict()
+
+    ##### TRACKING (strategy threads) #####
+
+    def track_order(self, strategy: "Strategy", trade: Trade, order_id: int, purpose: str):
+        key = (strategy.exchange, order_id)
+        with self._lock:
+            order = self._unmatched.pop(key, None) or Order(order_id, strategy.contract.symbol)
+            if order.status not in TERMINAL_STATUSES and order.status != "FILLED":
+                self._tracked[key] = (strategy, trade, purpose, order)
+                return
+
+        # already done: the events arrived before the order response
+        self._order_done(strategy, trade, purpose, order)
+
+    def track_exit(self, strategy: "Strategy", trade: Trade):
+        # trade.exit_orders must be set: (order list id, take profit order id, stop loss order id)
+        protected = _ProtectedTrade(strategy, trade)
+        _, take_profit_id, stop_loss_id = trade.exit_orders
+        legs = []
+        with self._lock:
+            for order_id, stop_loss in ((take_profit_id, False), (stop_loss_id, True)):
+                key = (strategy.exchange, order_id)
+                order = self._unmatched.pop(key, None) or Order(order_id, strategy.contract.symbol)
+                self._exit_legs[key] = (protected, stop_loss, order)
+                legs.append(order)
+
+        for order in legs:
+            if order.status == "FILLED":
+                self.leg_filled(strategy.exchange, order.order_id, order.avg_price)
+            elif order.status in TERMINAL_STATUSES:
+                self.leg_ended(strategy.exchange, order.order_id)
+
+    def remove_strategy(self, strategy: "Strategy"):
+        # a stopped strategy doesn't follow its orders anymore: their events are kept as unmatched, so the legs of a
+        # trade restored when the strategy restarts still get them
+        with self._lock:
+            for key in [key for key, tracked in self._tracked.items() if tracked[0] is strategy]:
+                del self._tracked[key]
+            for key in [key for key, leg in self._exit_legs.items() if leg[0].strategy is strategy]:
+                self._unmatched[key] = self._exit_legs.pop(key)[2]
+
+    ##### USER DATA STREAM #####
+
+    def on_execution_report(self, exchange: str, data: typing.Dict):
+        # executionReport event of the spot or margin user data stream
+        key = (exchange, data['i'])
+
+        with self._lock:
+            if key in self._tracked:
+                strategy, trade, purpose, order = self._tracked[key]
+                if not order.update(data):
+                    return  # duplicate
+                if order.status != "FILLED" and order.status not in TERMINAL_STATUSES:
+                    return  # NEW, PARTIALLY_FILLED
+                del self._tracked[key]
+
+            elif key in self._exit_legs:
+                order = self._exit_legs[key][2]
+                if not order.update(data):
+                    return
+                strategy = None
+
+            else:
+                order = self._unmatched.pop(key, None) or Order(data['i'], data['s'])
+                order.update(data)  # a duplicate changes nothing
+                self._unmatched[key] = order
+                if len(self._unmatched) > UNMATCHED_ORDERS:
+                    self._unmatched.popitem(last=False)
+                return
+
+        if strategy is not None:
+            self._order_done(strategy, trade, purpose, order)
+        elif order.status == "FILLED":
+            self.leg_filled(exchange, order.order_id, order.avg_price or float(data['L']))
+        elif order.status in TERMINAL_STATUSES:
+            self.leg_ended(exchange, order.order_id)
+
+    @staticmethod
+    def _order_done(strategy: "Strategy", trade: Trade, purpose: str, order: Order):
+        if order.filled_quantity > 0:
+            strategy.on_order_filled(trade, order, purpose)
+        else:
+            logger.warning("%s order %s on %s ended %s without a fill", purpose.capitalize(), order.order_id,
+                           order.symbol, order.status)
+
+    ##### EXIT ORDERS #####
+
+    def leg_filled(self, exchange: str, order_id: int, price: float):
+        with self._lock:
+            leg = self._exit_legs.get((exchange, order_id))
+            if leg is None:
+                return
+            protected, stop_loss, order = leg
+            self._remove(exchange, protected.trade)
+
+        protected.strategy.on_exit_filled(protected.trade, stop_loss, price, order.commission)
+
+    def leg_ended(self, exchange: str, order_id: int):
+        with self._lock:
+            leg = self._exit_legs.pop((exchange, order_id), None)
+            if leg is None:
+                return
+            protected = leg[0]
+            protected.ended_legs += 1
+            if protected.ended_legs < 2:
+                return  # the other leg may still fill (an OCO expires one leg when the other fills)
+            self._remove(exchange, protected.trade)
+
+        protected.strategy.on_exit_cancelled(protected.trade)
+
+    def _remove(self, exchange: str, trade: Trade):
+        # must be called with the lock held
+        for order_id in trade.exit_orders[1:]:
+            self._exit_legs.pop((exchange, order_id), None)
+
+    def __len__(self) -> int:
+        return len(self._tracked) + len({id(leg[0]) for leg in self._exit_legs.values()})
+
+
+orders = OrderManager()
@@ -0,0 +1,211 @@
+import logging
+import threading
+import typing
+
+from models import Trade
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+# Open quantity and cost basis aggregated per symbol, per strategy and per account (exchange), updated when a trade
+# opens or closes and when a bookTicker quote arrives. PnL queries are then a few multiplications, instead of a loop
+# over every trade of every strategy on each quote.
+#
+#   long unrealized  = bid * long quantity - long cost       (cost = sum of entry price * quantity)
+#   short unrealized = short cost - ask * short quantity
+#
+# Each account's unrealized total is kept up to date with the change of its symbols' unrealized PnL on every quote;
+# revalue_all() recomputes every symbol at once with numpy (and removes the float drift of the running totals).
+
+SymbolKey = typing.Tuple[str, str]  # exchange, symbol
+
+
+class PositionAggregate:
+    __slots__ = ("long_qty", "long_cost", "short_qty", "short_cost", "realized", "open_trades")
+
+    def __init__(self):
+        self.long_qty = 0.0
+        self.long_cost = 0.0
+        self.short_qty = 0.0
+        self.short_cost = 0.0
+        self.realized = 0.0
+        self.open_trades = 0
+
+    def add(self, side: str, price: float, quantity: float, sign: int):
+        # sign is 1 when the trade opens, -1 when it closes
+        if side == "long":
+            self.long_qty += sign * quantity
+            self.long_cost += sign * price * quantity
+        else:
+            self.short_qty += sign * quantity
+            self.short_cost += sign * price * quantity
+        self.open_trades += sign
+
+    def unrealized(self, bid: float, ask: float) -> float:
+        if self.open_trades == 0:
+            return 0.0
+        return bid * self.long_qty - self.long_cost + self.short_cost - ask * self.short_qty
+
+
+class PositionBook:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quotes: typing.Dict[SymbolKey, typing.Tuple[float, float]] = dict()
+
+        self._symbols: typing.Dict[SymbolKey, PositionAggregate] = dict()
+        self._strategies: typing.Dict[str, PositionAggregate] = dict()
+        self._strategy_symbols: typing.Dict[str, SymbolKey] = dict()
+        self._accounts: typing.Dict[str, PositionAggregate] = dict()
+
+        self._symbol_unrealized: typing.Dict[SymbolKey, float] = dict()
+        self._account_unrealized: typing.Dict[str, float] = dict()
+
+    ##### UPDATES #####
+
+    def open(self, strategy: "Strategy", trade: Trade):
+        self._apply(strategy, trade, 1, 0.0)
+
+    def close(self, strategy: "Strategy", trade: Trade, exit_price: float) -> float:
+        # realized PnL of the trade, also stored in trade.pnl
+        if trade.side == "long":
+            pnl = (exit_price - trade.entry_price) * trade.quantity
+        else:
+            pnl = (trade.entry_price - exit_price) * trade.quantity
+        trade.pnl = pnl
+        self._apply(strategy, trade, -1, pnl)
+        return pnl
+
+    def update_entry(self, strategy: "Strategy", trade: Trade, entry_price: float, quantity: float):
+        # actual fill of the entry order, known after the trade was opened at the estimated price
+        if trade.status == "open":
+            self._apply(strategy, trade, -1, 0.0)
+            trade.entry_price = entry_price
+            trade.quantity = quantity
+            self._apply(strategy, trade, 1, 0.0)
+        else:
+            trade.entry_price = entry_price
+            trade.quantity = quantity
+
+    def reprice_close(self, strategy: "Strategy", trade: Trade, exit_price: float) -> float:
+        # actual fill of the exit order, the realized PnL is corrected by the difference with the estimate
+        if trade.side == "long":
+            pnl = (exit_price - trade.entry_price) * trade.quantity
+        else:
+            pnl = (trade.entry_price - exit_price) * trade.quantity
+        difference = pnl - trade.pnl
+        trade.pnl = pnl
+
+        with self._lock:
+            for aggregate in (self._symbols.get((strategy.exchange, strategy.contract.symbol)),
+                              self._strategies.get(strategy.strategy_key), self._accounts.get(strategy.exchange)):
+                if aggregate is not None:
+                    aggregate.realized += difference
+        return pnl
+
+    def remove_strategy(self, strategy: "Strategy"):
+        # a stopped strategy's open trades stay open in the journal, they are counted again when it is restarted
+        for trade in list(strategy.trades):
+            if trade.status == "open":
+                self._apply(strategy, trade, -1, 0.0)
+
+    def _apply(self, strategy: "Strategy", trade: Trade, sign: int, realized: float):
+        if trade.entry_price is None:
+            return
+        symbol_key = (strategy.exchange, strategy.contract.symbol)
+
+        with self._lock:
+            self._strategy_symbols[strategy.strategy_key] = symbol_key
+            for aggregate in (self._symbols.setdefault(symbol_key, PositionAggregate()),
+                              self._strategies.setdefault(strategy.strategy_key, PositionAggregate()),
+                              self._accounts.setdefault(strategy.exchange, PositionAggregate())):
+                aggregate.add(trade.side, trade.entry_price, trade.quantity, sign)
+                aggregate.realized += realized
+            self._revalue(symbol_key)
+
+    def on_quote(self, exchange: str, symbol: str, bid: float, ask: float):
+        symbol_key = (exchange, symbol)
+        with self._lock:
+            self._quotes[symbol_key] = (bid, ask)
+            if symbol_key in self._symbols:
+                self._revalue(symbol_key)
+
+    def _revalue(self, symbol_key: SymbolKey):
+        # O(1): only the change of this symbol's unrealized PnL is applied to its account
+        quote = self._quotes.get(symbol_key)
+        if quote is None:
+            return
+        value = self._symbols[symbol_key].unrealized(*quote)
+        previous = self._symbol_unrealized.get(symbol_key, 0.0)
+        self._symbol_unrealized[symbol_key] = value
+        self._account_unrealized[symbol_key[0]] = self._account_unrealized.get(symbol_key[0], 0.0) + value - previous
+
+    def revalue_all(self) -> typing.Dict[str, float]:
+        # every symbol at once, returns the unrealized PnL per account
+        import numpy as np
+
+        with self._lock:
+            keys = [key for key in self._symbols if key in self._quotes]
+            if len(keys) == 0:
+                return {}
+
+            rows = [(self._symbols[key].long_qty, self._symbols[key].long_cost, self._symbols[key].short_qty,
+                     self._symbols[key].short_cost) + self._quotes[key] for key in keys]
+            values = np.array(rows, dtype=np.float64)
+            long_qty, long_cost, short_qty, short_cost, bids, asks = values.T
+            unrealized = bids * long_qty - long_cost + short_cost - asks * short_qty
+
+            self._symbol_unrealized = dict(zip(keys, unrealized.tolist()))
+            self._account_unrealized = dict()
+            for (exchange, symbol), value in self._symbol_unrealized.items():
+                self._account_unrealized[exchange] = self._account_unrealized.get(exchange, 0.0) + value
+
+            return dict(self._account_unrealized)
+
+    ##### QUERIES #####
+
+    def trade_pnl(self, trade: Trade) -> float:
+        # open trades are valued at the last quote, closed ones keep their realized PnL
+        if trade.status != "open" or trade.entry_price is None:
+            return trade.pnl
+        quote = self._quotes.get((trade.contract.exchange, trade.contract.symbol))
+        if quote is None:
+            return trade.pnl
+        if trade.side == "long":
+            return (quote[0] - trade.entry_price) * trade.quantity
+        return (trade.entry_price - quote[1]) * trade.quantity
+
+    def symbol_pnl(self, exchange: str, symbol: str) -> typing.Tuple[float, float]:
+        # (unrealized, realized)
+        aggregate = self._symbols.get((exchange, symbol))
+        if aggregate is None:
+            return 0.0, 0.0
+        return self._symbol_unrealized.get((exchange, symbol), 0.0), aggregate.realized
+
+    def strategy_pnl(self, strategy_key: str) -> typing.Tuple[float, float]:
+        aggregate = self._strategies.get(strategy_key)
+        if aggregate is None:
+            return 0.0, 0.0
+        quote = self._quotes.get(self._strategy_symbols[strategy_key])
+        unrealized = aggregate.unrealized(*quote) if quote is not None else 0.0
+        return unrealized, aggregate.realized
+
+    def account_pnl(self, exchange: str) -> typing.Tuple[float, float]:
+        aggregate = self._accounts.get(exchange)
+        if aggregate is None:
+            return 0.0, 0.0
+        return self._account_unrealized.get(exchange, 0.0), aggregate.realized
+
+    def accounts(self) -> typing.List[str]:
+        return list(self._accounts)
+
+    def log_report(self):
+        self.revalue_all()
+        for exchange in self.accounts():
+            unrealized, realized = self.account_pnl(exchange)
+            logger.info("%s PnL: unrealized %.4f, realized %.4f, %s open trade(s)", exchange, unrealized, realized,
+                        self._accounts[exchange].open_trades)
+
+
+positions = PositionBook()
@@ -0,0 +1,216 @@
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+# Opt-in profiling, to find out what makes the bot lag.
+#
+# - a sampler thread looks at the stack of every thread a few hundred times per second and counts where each one
+#   is: inside a strategy (attributed to that strategy instance, with the strategy method and whether the time is
+#   spent in pandas/numpy/ta indicator code), or in one of our own functions (websocket callbacks, UI update...)
+# - the entry points (websocket callbacks, strategy evaluation, Root._update_ui) are also timed on every call, and
+#   a call longer than the budget is logged as a warning
+#
+# Reports are logged and appended to profile_report.jsonl every report_interval seconds.
+
+PROFILE_REPORT_FILE = "profile_report.jsonl"
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds
+DEFAULT_BUDGET_MS = 100
+DEFAULT_REPORT_INTERVAL = 300  # seconds
+
+_THIS_FILE = os.path.abspath(__file__)
+_REPO_DIR = os.path.dirname(_THIS_FILE)
+_INDICATOR_PACKAGES = (os.sep + "pandas" + os.sep, os.sep + "numpy" + os.sep, os.sep + "ta" + os.sep)
+
+
+def _owner_label(obj) -> str:
+    # strategies are told apart by their latency key ("Spot BTCUSDT 15m Technical"), everything else by class
+    return getattr(obj, "latency_key", None) or obj.__class__.__name__
+
+
+class SamplingProfiler:
+    def __init__(self, sample_interval: float = DEFAULT_SAMPLE_INTERVAL, budget_ms: float = DEFAULT_BUDGET_MS,
+                 report_interval: float = DEFAULT_REPORT_INTERVAL, report_file: str = PROFILE_REPORT_FILE):
+        self.sample_interval = sample_interval
+        self.budget_ms = budget_ms
+        self.report_interval = report_interval
+        self.report_file = report_file
+
+        self._lock = threading.Lock()
+        self._samples: typing.Dict[typing.Tuple[str, str, str], int] = dict()  # (owner, function, kind) -> samples
+        self._total_samples = 0
+        self._timings: typing.Dict[typing.Tuple[str, str], typing.List[float]] = dict()  # calls, total ms, max, over
+
+        self.running = False
+        self._thread: typing.Optional[threading.Thread] = None
+
+    ##### TIMED HOOKS #####
+
+    def instrument(self, cls, method_name: str):
+        # replaces the method on the class, so it must run before the objects bind it (websocket callbacks)
+        original = getattr(cls, method_name)
+        if getattr(original, "_profiled", False):
+            return
+
+        label = f"{cls.__name__}.{method_name}"
+        profiler = self
+
+        @functools.wraps(original)
+        def wrapper(obj, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(obj, *args, **kwargs)
+            finally:
+                profiler._record_call(_owner_label(obj), label, (time.perf_counter() - start) * 1000)
+
+        wrapper._profiled = True
+        setattr(cls, method_name, wrapper)
+
+    def _record_call(self, owner: str, label: str, ms: float):
+        with self._lock:
+            timing = self._timings.get((owner, label))
+            if timing is None:
+                timing = [0, 0.0, 0.0, 0]
+                self._timings[(owner, label)] = timing
+            timing[0] += 1
+            timing[1] += ms
+            if ms > timing[2]:
+                timing[2] = ms
+            if ms > self.budget_ms:
+                timing[3] += 1
+
+        if ms > self.budget_ms:
+            logger.warning("%s took %.1f ms for %s (budget %s ms)", label, ms, owner, self.budget_ms)
+
+    ##### SAMPLING #####
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("Profiler started: sampling every %s ms, budget %s ms", self.sample_interval * 1000,
+                    self.budget_ms)
+
+    def stop(self):
+        self.running = False
+
+    def _run(self):
+        last_report = time.monotonic()
+        while self.running:
+            time.sleep(self.sample_interval)
+            self._sample()
+
+            if time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                self.report()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        found = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            location = self._attribute(frame)
+            if location is not None:
+                found.append(location)
+
+        with self._lock:
+            self._total_samples += 1
+            for location in found:
+                self._samples[location] = self._samples.get(location, 0) + 1
+
+    @staticmethod
+    def _attribute(frame) -> typing.Optional[typing.Tuple[str, str, str]]:
+        # innermost strategy frame wins, otherwise the innermost function of this repository
+        leaf_file = frame.f_code.co_filename
+        kind = "indicators" if any(p in leaf_file for p in _INDICATOR_PACKAGES) else "python"
+
+        own_frame = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename.startswith(_REPO_DIR) and "site-packages" not in code.co_filename \
+                    and code.co_filename != _THIS_FILE:
+                obj = frame.f_locals.get("self")
+                if obj is not None and hasattr(obj, "latency_key"):
+                    return obj.latency_key, code.co_name, kind
+                if own_frame is None:
+                    own_frame = frame
+            frame = frame.f_back
+
+        if own_frame is None:
+            return None  # idle thread or library code only (websocket waiting for data, Tk event loop...)
+
+        obj = own_frame.f_locals.get("self")
+        owner = obj.__class__.__name__ if obj is not None else os.path.basename(own_frame.f_code.co_filename)
+        return owner, own_frame.f_code.co_name, kind
+
+    ##### REPORTS #####
+
+    def report(self, top: int = 20) -> typing.Dict:
+        with self._lock:
+            total = self._total_samples
+            samples = sorted(self._samples.items(), key=lambda item: item[1], reverse=True)
+            timings = sorted(self._timings.items(), key=lambda item: item[1][1], reverse=True)
+
+        if total == 0:
+            return dict()
+
+        result = {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "sample_interval_ms": self.sample_interval * 1000,
+            "samples": total,
+            "budget_ms": self.budget_ms,
+            # share of the samples in which a thread was found there, ~ share of wall time that thread spent there
+            "hotspots": [{"owner": owner, "function": function, "kind": kind, "share": round(n / total, 4)}
+                         for (owner, function, kind), n in samples],
+            "calls": [{"owner": owner, "function": label, "calls": int(t[0]), "total_ms": round(t[1], 1),
+                       "mean_ms": round(t[1] / t[0], 3), "max_ms": round(t[2], 1), "over_budget": int(t[3])}
+                      for (owner, label), t in timings],
+        }
+
+        for h in result['hotspots'][:top]:
+            logger.info("Profile: %5.1f%% %s %s (%s)", h['share'] * 100, h['owner'], h['function'], h['kind'])
+        for c in result['calls'][:top]:
+            logger.info("Profile: %s for %s: %s calls, mean %s ms, max %s ms, %s over budget", c['function'],
+                        c['owner'], c['calls'], c['mean_ms'], c['max_ms'], c['over_budget'])
+
+        with open(self.report_file, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+        return result
+
+
+def enable_profiling(sample_interval: float = DEFAULT_SAMPLE_INTERVAL, budget_ms: float = DEFAULT_BUDGET_MS,
+                     report_interval: float = DEFAULT_REPORT_INTERVAL, ui: bool = False) -> SamplingProfiler:
+    # must be called before the clients are created, their websockets bind the callbacks at creation
+    from connectors.binance_spot import BinanceSpotClient
+    from connectors.binance_margin import BinanceMarginClient
+    from connectors.balance_websocket import BalanceWebsocket
+    from strategies import Strategy, STRATEGY_TYPES
+
+    profiler = SamplingProfiler(sample_interval, budget_ms, report_interval)
+
+    for client in [BinanceSpotClient, BinanceMarginClient]:
+        profiler.instrument(client, "_on_message")
+        profiler.instrument(client, "_dispatch_trades")
+    profiler.instrument(BalanceWebsocket, "_on_spot_message")
+    profiler.instrument(BalanceWebsocket, "_on_margin_message")
+
+    profiler.instrument(Strategy, "process_trades")
+    profiler.instrument(Strategy, "process_kline")
+    for strategy_class in STRATEGY_TYPES.values():
+        profiler.instrument(strategy_class, "check_trade")
+
+    if ui:
+        from interface.root_component import Root
+        profiler.instrument(Root, "_update_ui")
+
+    profiler.start()
+    return profiler
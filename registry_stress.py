@@ -0,0 +1,121 @@
+import argparse
+import sys
+import threading
+import time
+import typing
+
+from connectors.strategy_registry import StrategyRegistry
+
+# Stress test of the copy-on-write strategy registry: strategies are activated and deactivated in a loop while
+# another thread dispatches a synthetic firehose of trades through for_symbol(), like the websocket thread does.
+#
+#   python registry_stress.py --seconds 10    -> exits with 1 if a tick was dropped or a reader raised
+#
+# A few strategies stay registered for the whole run, every tick dispatched must reach each of them exactly once.
+
+SYMBOLS = ["BTCUSDT", "ETHUSDT", "ADAUSDT"]
+PERMANENT_PER_SYMBOL = 2
+FIRST_CHURN_INDEX = 1000  # b_index of the strategies activated and deactivated by the writers
+
+
+class _Contract:
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+
+
+class _CountingStrategy:
+    def __init__(self, symbol: str):
+        self.contract = _Contract(symbol)
+        self.candle_source = "trades"
+        self.ticks = 0
+
+    def process_trades(self, trades: typing.List[typing.Tuple[float, float, int]],
+                       received: typing.Optional[float] = None):
+        self.ticks += len(trades)
+
+
+def stress(seconds: float, writers: int, batch: int) -> typing.Dict:
+    registry = StrategyRegistry()
+    notifications = [0]
+    registry.add_listener(lambda: notifications.__setitem__(0, notifications[0] + 1))
+
+    permanent = []
+    for symbol in SYMBOLS:
+        for _ in range(PERMANENT_PER_SYMBOL):
+            strategy = _CountingStrategy(symbol)
+            registry[len(permanent)] = strategy
+            permanent.append(strategy)
+
+    errors: typing.List[str] = []
+    dispatched = {symbol: 0 for symbol in SYMBOLS}
+    changes = [0] * writers
+    stop = threading.Event()
+
+    def firehose():
+        trades = [(1.0, 1.0, i) for i in range(batch)]
+        i = 0
+        try:
+            while not stop.is_set():
+                symbol = SYMBOLS[i % len(SYMBOLS)]
+                for strategy in registry.for_symbol(symbol):
+                    strategy.process_trades(trades)
+                for strategy in registry.values():  # the UI and the reports iterate the whole registry
+                    strategy.candle_source
+                dispatched[symbol] += batch
+                i += 1
+        except Exception as e:
+            errors.append(f"reader: {type(e).__name__}: {e}")
+
+    def churn(writer: int):
+        b_index = FIRST_CHURN_INDEX + writer * 1000000
+        try:
+            while not stop.is_set():
+                registry[b_index] = _CountingStrategy(SYMBOLS[b_index % len(SYMBOLS)])
+                if registry.pop(b_index) is None:
+                    errors.append(f"writer {writer}: strategy {b_index} missing before its deactivation")
+                changes[writer] += 2
+                b_index += 1
+        except Exception as e:
+            errors.append(f"writer {writer}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=firehose)] + [threading.Thread(target=churn, args=(w,)) for w in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    for strategy in permanent:
+        if strategy.ticks != dispatched[strategy.contract.symbol]:
+            errors.append(f"{strategy.contract.symbol} strategy got {strategy.ticks} ticks out of "
+                          f"{dispatched[strategy.contract.symbol]}")
+    if len(registry) != len(permanent):
+        errors.append(f"{len(registry)} strategies left registered instead of {len(permanent)}")
+    if notifications[0] != len(permanent) + sum(changes):
+        errors.append(f"{notifications[0]} listener calls for {len(permanent) + sum(changes)} changes")
+
+    return {
+        "ticks": sum(dispatched.values()),
+        "changes": sum(changes),
+        "version": registry.version,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Strategy registry under concurrent activation and dispatch")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--batch", type=int, default=20, help="trades per dispatched batch")
+    args = parser.parse_args()
+
+    r = stress(args.seconds, args.writers, args.batch)
+    print(f"{r['ticks']} ticks dispatched during {r['changes']} activations/deactivations (version {r['version']})")
+    for error in r['errors']:
+        print(error)
+    sys.exit(1 if len(r['errors']) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import atexit
+import logging
+import struct
+import threading
+import time
+import typing
+from multiprocessing import resource_tracker, shared_memory
+
+from models import Candle
+
+logger = logging.getLogger()
+
+# Candle series of a running strategy, published in shared memory so other processes (notebooks, backtester,
+# monitoring) can read the live candles without going through the csv dump.
+#
+# Layout: a 64 bytes header followed by a ring buffer of fixed size records.
+#   header: magic, version, symbol, timeframe, capacity, count, head (slot of the latest candle), sequence
+#   record: open time (ms), open, high, low, close, volume
+#
+# The writer makes the sequence odd while it writes and even again when done (a seqlock): readers retry until they
+# copied the data between two reads of the same even sequence, so they never block the writer.
+
+HEADER = struct.Struct("<4sI16s8sQQQQ")
+RECORD = struct.Struct("<qddddd")
+MAGIC = b"CRCB"
+VERSION = 1
+DEFAULT_CAPACITY = 2000
+
+_SEQ_OFFSET = HEADER.size - 8
+_COUNT_HEAD = struct.Struct("<QQ")
+_COUNT_HEAD_OFFSET = HEADER.size - 24
+_SEQ = struct.Struct("<Q")
+
+_written_here: typing.Set[str] = set()  # names of the buffers created by this process
+
+
+def buffer_name(exchange: str, symbol: str, timeframe: str, strat_name: str) -> str:
+    return f"cryptorade_{exchange}_{symbol}_{timeframe}_{strat_name}".lower()
+
+
+class CandleBufferWriter:
+    def __init__(self, name: str, symbol: str, timeframe: str, capacity: int = DEFAULT_CAPACITY):
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER.size + capacity * RECORD.size)
+        self.name = name
+        self.capacity = capacity
+        _written_here.add(name)
+
+        self._count = 0
+        self._head = capacity - 1  # the first candle goes in slot 0
+        self._seq = 0
+        self._last_ts: typing.Optional[int] = None
+        self._lock = threading.Lock()  # close() can come from another thread than the writes
+
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, symbol.encode()[:16], timeframe.encode()[:8], capacity,
+                         self._count, self._head, self._seq)
+        atexit.register(self.close)
+
+    @classmethod
+    def create(cls, exchange: str, symbol: str, timeframe: str, strat_name: str,
+               capacity: int = DEFAULT_CAPACITY) -> "CandleBufferWriter":
+        # two strategies with the same settings get a numbered name
+        name = buffer_name(exchange, symbol, timeframe, strat_name)
+        suffix = 1
+        while True:
+            try:
+                writer = cls(name if suffix == 1 else f"{name}_{suffix}", symbol, timeframe, capacity)
+                logger.info("Candles of %s %s published in shared memory as %s", symbol, timeframe, writer.name)
+                return writer
+            except FileExistsError:
+                suffix += 1
+
+    def _begin(self):
+        self._seq += 1  # odd: write in progress
+        _SEQ.pack_into(self.shm.buf, _SEQ_OFFSET, self._seq)
+
+    def _end(self):
+        _COUNT_HEAD.pack_into(self.shm.buf, _COUNT_HEAD_OFFSET, self._count, self._head)
+        self._seq += 1
+        _SEQ.pack_into(self.shm.buf, _SEQ_OFFSET, self._seq)
+
+    def _put(self, candle: Candle):
+        if candle.timestamp != self._last_ts:
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._last_ts = candle.timestamp
+
+        RECORD.pack_into(self.shm.buf, HEADER.size + self._head * RECORD.size, candle.timestamp, candle.open,
+                         candle.high, candle.low, candle.close, candle.volume)
+
+    def sync(self, candles: typing.List[Candle]):
+        # writes the candles added since the last call, and the forming one again
+        if self._last_ts is None:
+            self.write_all(candles)
+            return
+
+        start = len(candles) - 1
+        while start > 0 and candles[start - 1].timestamp >= self._last_ts:
+            start -= 1
+
+        with self._lock:
+            if self.shm is None:
+                return
+            self._begin()
+            for candle in candles[start:]:
+                self._put(candle)
+            self._end()
+
+    def write_all(self, candles: typing.List[Candle]):
+        # full rewrite, after older candles were changed (backfill)
+        with self._lock:
+            if self.shm is None:
+                return
+            self._begin()
+            self._count = 0
+            self._head = self.capacity - 1
+            self._last_ts = None
+            for candle in candles[-self.capacity:]:
+                self._put(candle)
+            self._end()
+
+    def close(self):
+        # when the strategy is stopped, or at exit for the ones still running
+        with self._lock:
+            if self.shm is None:
+                return
+            self.shm.close()
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = None
+            _written_here.discard(self.name)
+        atexit.unregister(self.close)
+
+
+class CandleBufferReader:
+    def __init__(self, name: str):
+        self.shm = shared_memory.SharedMemory(name=name)
+        if name not in _written_here:
+            # attaching registers the block with this process' resource tracker, which would unlink it on exit
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        magic, version, symbol, timeframe, capacity, _, _, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{name} is not a candle buffer")
+
+        self.name = name
+        self.symbol = symbol.rstrip(b"\0").decode()
+        self.timeframe = timeframe.rstrip(b"\0").decode()
+        self.capacity = capacity
+
+    def snapshot(self, max_retries: int = 1000) -> typing.List[typing.Tuple[int, float, float, float, float, float]]:
+        # (open time, open, high, low, close, volume) tuples, oldest first
+        buf = self.shm.buf
+        for _ in range(max_retries):
+            seq = _SEQ.unpack_from(buf, _SEQ_OFFSET)[0]
+            if seq % 2 == 1:
+                time.sleep(0)
+                continue
+
+            count, head = _COUNT_HEAD.unpack_from(buf, _COUNT_HEAD_OFFSET)
+            data = bytes(buf[HEADER.size:HEADER.size + self.capacity * RECORD.size])
+
+            if _SEQ.unpack_from(buf, _SEQ_OFFSET)[0] != seq:
+                continue
+
+            records = list(RECORD.iter_unpack(data))
+            start = (head - count + 1) % self.capacity
+            ordered = records[start:] + records[:start]
+            return ordered[:count]
+
+        raise TimeoutError(f"Could not read a consistent snapshot of {self.name}")
+
+    def close(self):
+        self.shm.close()
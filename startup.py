@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+import typing
+
+from connectors.binance_margin import BinanceMarginClient
+from connectors.binance_spot import BinanceSpotClient
+from connectors.balance_websocket import BalanceWebsocket
+from connectors.time_sync import server_time
+
+logger = logging.getLogger()
+
+WS_READY_TIMEOUT = 15  # seconds to wait for a websocket before moving on without it
+
+
+class StartupSequence:
+    """
+    Runs startup steps as a dependency graph: every step starts in its own thread as soon as the steps it depends
+    on are finished, so independent REST calls and websocket handshakes overlap instead of running one by one.
+    """
+
+    def __init__(self):
+        self._steps: typing.Dict[str, typing.Tuple[typing.Callable, typing.Tuple[str, ...]]] = dict()
+        self.results = dict()
+        self.durations: typing.Dict[str, float] = dict()
+        self._errors: typing.Dict[str, Exception] = dict()
+
+    def add(self, name: str, func: typing.Callable, depends_on: typing.Tuple[str, ...] = ()):
+        # func receives the results dictionary, so it can use the objects created by its dependencies
+        for dep in depends_on:
+            if dep not in self._steps:
+                raise ValueError(f"Startup step {name} depends on unknown step {dep}")
+        self._steps[name] = (func, tuple(depends_on))
+
+    def _run_step(self, name: str, done: typing.Dict[str, threading.Event]):
+        func, depends_on = self._steps[name]
+        try:
+            for dep in depends_on:
+                done[dep].wait()
+                if dep in self._errors:
+                    raise RuntimeError(f"dependency {dep} failed")
+
+            start = time.perf_counter()
+            self.results[name] = func(self.results)
+            self.durations[name] = time.perf_counter() - start
+        except Exception as e:
+            logger.error("Startup step %s failed: %s", name, e)
+            self._errors[name] = e
+        finally:
+            done[name].set()
+
+    def run(self) -> typing.Dict:
+        start = time.perf_counter()
+        done = {name: threading.Event() for name in self._steps}
+
+        threads = []
+        for name in self._steps:
+            t = threading.Thread(target=self._run_step, args=(name, done), name=f"startup-{name}")
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+        total = time.perf_counter() - start
+        for name, duration in self.durations.items():
+            logger.info("Startup step %s took %.0f ms", name, duration * 1000)
+        logger.info("Startup finished in %.0f ms", total * 1000)
+
+        if len(self._errors) > 0:
+            raise RuntimeError(f"Startup failed in {', '.join(self._errors)}")
+
+        return self.results
+
+
+def _wait_for(event: threading.Event, what: str) -> bool:
+    if not event.wait(WS_READY_TIMEOUT):
+        logger.warning("%s not ready after %s seconds, continuing", what, WS_READY_TIMEOUT)
+        return False
+    return True
+
+
+def start_connectors(public_key: str, secret_key: str, testnet: bool, recv_window: typing.Optional[int] = None) \
+        -> typing.Tuple[BinanceSpotClient, BinanceMarginClient, BalanceWebsocket]:
+    sequence = StartupSequence()
+
+    # signed requests use the exchange's time, measured before the first one
+    sequence.add("time_sync", lambda r: server_time.start(testnet=testnet, recv_window=recv_window))
+
+    sequence.add("spot_client", lambda r: BinanceSpotClient(public_key=public_key, secret_key=secret_key,
+                                                            testnet=testnet))
+    sequence.add("balance_websocket", lambda r: BalanceWebsocket(public_key=public_key, secret_key=secret_key,
+                                                                 testnet=testnet))
+    sequence.add("margin_client", lambda r: BinanceMarginClient(public_key=public_key, spot=r['spot_client'],
+                                                                secret_key=secret_key, testnet=testnet),
+                 depends_on=("spot_client",))
+
+    def balance_streams_open(r):
+        r['balance_websocket'].attach(r['spot_client'], r['margin_client'])
+        _wait_for(r['balance_websocket'].spot_ws_open, "Spot balance websocket")
+        _wait_for(r['balance_websocket'].margin_ws_open, "Margin balance websocket")
+
+    sequence.add("balance_streams_open", balance_streams_open,
+                 depends_on=("spot_client", "margin_client", "balance_websocket"))
+
+    # the snapshots must be taken while the balance websockets are listening, or the changes after them are lost
+    sequence.add("balance_snapshot", lambda r: r['balance_websocket'].seed_balances(),
+                 depends_on=("balance_streams_open", "time_sync"))
+
+    def market_streams_subscribed(r):
+        _wait_for(r['spot_client'].ws_subscribed, "Spot market websocket")
+        _wait_for(r['margin_client'].ws_subscribed, "Margin market websocket")
+
+    sequence.add("market_streams_subscribed", market_streams_subscribed, depends_on=("spot_client", "margin_client"))
+
+    results = sequence.run()
+
+    return results['spot_client'], results['margin_client'], results['balance_websocket']
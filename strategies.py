@@ -1,16 +1,25 @@
 import datetime
+import hashlib
+import json
 import logging
 import time
 import typing
 
-import numpy as np
-import pandas as pd
-from threading import Timer
-
-from ta import momentum
+from threading import Thread
 
+from connectors.kline_parser import KLINE_INTERVALS, timeframe_ms
+from connectors.time_sync import server_time
+from latency import latency
+from metrics import metrics
+from exit_triggers import triggers
+from order_manager import orders, TERMINAL_STATUSES
+from position_book import positions
+from trade_journal import journal
 from models import *
 
+# pandas, numpy and ta are imported inside the methods that compute indicators, so that importing this module
+# (and the connectors, which import it) doesn't pay for them until a strategy actually needs one
+
 # we needed to import clients to facilitate the coding process by telling which 'client' it is
 # but this would lead to circular importing
 # to avoid this
@@ -30,7 +39,20 @@ TF_EQUIV = {
 }
 
 
+CANDLE_SOURCES = ["trades", "klines", "resampled"]
+# parameters deciding how a strategy runs rather than what it trades on, left out of its journal key
+RUN_OPTIONS = ("candle_source", "evaluation_ms", "shared_candles", "exchange_exits")
+
+
 class Strategy:
+    # strategies whose signals need every trade (not just the candle values) can't use the kline stream
+    intra_candle_signals = False
+    # attributes holding indicator state computed from the candles, saved with the checkpoints
+    checkpoint_attrs: typing.Tuple[str, ...] = ()
+    # when check_trade runs: "tick" (every batch of trades), "candle_close" (only when a new candle starts),
+    # or a number of milliseconds between two evaluations
+    default_cadence: typing.Union[str, int] = "candle_close"
+
     def __init__(self, client: typing.Union["BinanceSpotClient", "BinanceMarginClient"], contract: Contract,
                  exchange: str, timeframe: str, usdt_input: float, risk_to_reward: float, strat_name):
 
@@ -46,7 +68,7 @@ class Strategy:
         self.stop_loss_line = None
         self.risk_to_reward = risk_to_reward
 
-        self.tf_equiv = TF_EQUIV[timeframe] * 1000
+        self.tf_equiv = timeframe_ms(timeframe)  # TF_EQUIV keys or custom timeframes ("10m", "45m")
         self.strat_name = strat_name
 
         self.ongoing_position = False
@@ -55,19 +77,88 @@ class Strategy:
         self.trades: typing.List[Trade] = []
         self.logs = []
 
+        # "trades": candles are built from every aggTrade by parse_trades
+        # "klines": candles are taken from the exchange's kline stream by parse_kline, far fewer messages
+        # "resampled": candles are the symbol's one-minute series rolled up to the timeframe, shared with the other
+        # strategies of the symbol (connectors/candle_series.py)
+        self.candle_source = "trades"
+
+        self.evaluation_cadence = self.default_cadence
+        self._last_evaluation = 0.0
+        self.ticks_received = 0
+        self.evaluations = 0
+
+        # gap backfill: set by the client when its websocket reconnects, results are applied by parse_trades
+        self.reconnected = False
+        self._backfill_running = False
+        self._backfill_results: typing.List[typing.List[Candle]] = []
+
+        # latency instrumentation (latency.py): stream arrival of the batch being processed and end of its parsing
+        self.latency_key = f"{exchange} {contract.symbol} {timeframe} {strat_name}"
+        # key of the strategy's trades in the journal, the position book and the trigger index, set by assign_key
+        self.strategy_key = self.latency_key
+        self._received_at: typing.Optional[float] = None
+        self._parsed_at: typing.Optional[float] = None
+        self._signal_at: typing.Optional[float] = None
+
+        # open trades whose exit lines are computed on the next price, before they are protected
+        self._pending_exits: typing.List[Trade] = []
+        # exits as OCO orders on the exchange (order_manager.py), instead of checked here on every price
+        self.exchange_exits = True
+
+        # optional copy of the candles in shared memory, for other processes (see shared_candles.py)
+        self.shared_candles = False
+        self._shared_buffer = None
+
+    def assign_key(self, active: typing.Iterable["Strategy"]):
+        # unique among the active strategies, and the same after a restart, from the GUI or headless: the signal
+        # parameters are hashed (not the run options, nor the empty parameters of the other types the GUI keeps),
+        # and a strategy identical to one already running gets a #n suffix in activation order
+        signal_params = dict()
+        for code_name, value in getattr(self, "other_params", dict()).items():
+            if code_name in RUN_OPTIONS or value is None:
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = float(value)  # 14 from a config file, 14.0 from the GUI
+            signal_params[code_name] = value
+        params = json.dumps(signal_params, sort_keys=True, default=str)
+        key = f"{self.latency_key} {hashlib.sha1(params.encode()).hexdigest()[:8]}"
+        taken = {strategy.strategy_key for strategy in active if strategy is not self}
+        n = 1
+        self.strategy_key = key
+        while self.strategy_key in taken:
+            n += 1
+            self.strategy_key = f"{key} #{n}"
+
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
 
+    def load_candles(self):
+        # history at activation
+        if self.candle_source == "resampled":
+            self.candles = self.client.resampled.view(self.contract, self.tf)
+        else:
+            self.candles = self.client.get_historical_candles(self.contract, self.tf)
+
+    def _check_stream(self):
+        # runs before candles are updated: backfilled candles and reconnect gaps
+        if len(self._backfill_results) > 0:
+            self._apply_backfill(self._backfill_results.pop(0))
+
+        if self.reconnected:
+            # the candle that was forming when the socket dropped is missing trades; resampled candles are views of
+            # the symbol's series, which backfills its one-minute candles and rollups itself
+            self.reconnected = False
+            if self.candle_source != "resampled":
+                self._request_backfill(self.candles[-1].timestamp)
+
     def parse_trades(self, price: float, size: float, timestamp: int):
         # 1. update the same current candle
         # 2. new candle
         # 3. new candle + missing candles
 
-        timestamp_diff = int(time.time() * 1000) - timestamp
-        if timestamp_diff >= 2000:
-            logger.warning("%s %s: %s milliseconds of difference bw the current time and trade time",
-                           self.exchange, self.contract.symbol, timestamp_diff)
+        self._check_stream()
         last_candle = self.candles[-1]
 
         # SAME CANDLE
@@ -83,41 +174,25 @@ class Strategy:
             self.candles[-1] = last_candle
 
             # Check take profit/ stop loss
-            for trade in self.trades:
-                if trade.status == "open" and trade.entry_price is not None:
-                    self._check_exit(trade)
+            self._check_exits()
 
             return "same_candle"
 
         # MISSING CANDLES
         elif timestamp >= last_candle.timestamp + 2 * self.tf_equiv:
+            # placeholders keep the series continuous for now, the real klines replace them once fetched
+            self._request_backfill(last_candle.timestamp)
+
             missing_candles = int((timestamp - last_candle.timestamp) / self.tf_equiv) - 1
             for missing in range(missing_candles):
                 new_ts = last_candle.timestamp + self.tf_equiv
-                candle_info = {
-                    'ts': new_ts,
-                    'open': last_candle.open,
-                    'high': last_candle.high,
-                    'low': last_candle.low,
-                    'close': last_candle.close,
-                    'volume': 0
-                }
-
-                new_candle = Candle(candle_info, self.tf, "parse_trade")
+                new_candle = Candle.from_values(new_ts, last_candle.open, last_candle.high, last_candle.low,
+                                                last_candle.close, 0.0)
                 self.candles.append(new_candle)
                 last_candle = new_candle
 
             new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {
-                'ts': new_ts,
-                'open': price,
-                'high': price,
-                'low': price,
-                'close': price,
-                'volume': size
-            }
-
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+            new_candle = Candle.from_values(new_ts, price, price, price, price, size)
             self.candles.append(new_candle)
 
             logger.info("Added missing %s candles for %s %s (%s %s)", missing_candles, self.contract.symbol, self.tf,
@@ -127,38 +202,292 @@ class Strategy:
         # NEW CANDLE
         elif timestamp >= last_candle.timestamp + self.tf_equiv:
             new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {
-                'ts': new_ts,
-                'open': price,
-                'high': price,
-                'low': price,
-                'close': price,
-                'volume': size
-            }
-
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+            new_candle = Candle.from_values(new_ts, price, price, price, price, size)
             self.candles.append(new_candle)
 
             logger.info("Added new candle for %s %s", self.contract.symbol, self.tf)
             return "new_candle"
 
-    # def _check_order_status(self, order_id):
-    #     order_status = self.client.get_order_status(self.contract, order_id)
-    #     if order_status is not None:
-    #         logger.info("%s order status: %s", self.exchange, order_status.status)
-    #
-    #         if order_status.status == "filled" and order_status.avg_price != 0:
-    #             for trade in self.trades:
-    #                 if trade.entry_id == order_id:
-    #                     trade.entry_price = order_status.avg_price
-    #                     break
-    #             return
-    #
-    #     t = Timer(2.0, lambda: self._check_order_status(order_id))
-    #     t.start()
+    def _set_stream_options(self, other_params: typing.Dict):
+        self.other_params = dict(other_params)  # kept for the checkpoints
+
+        candle_source = other_params.get('candle_source') or "trades"
+        if candle_source not in CANDLE_SOURCES:
+            logger.error("Unknown candle source %s for %s %s, using trades", candle_source, self.contract.symbol, self.tf)
+            candle_source = "trades"
+        elif candle_source == "klines" and self.intra_candle_signals:
+            logger.error("%s strategy checks signals on every trade, it can't use klines for %s %s", self.strat_name,
+                         self.contract.symbol, self.tf)
+            candle_source = "trades"
+        if self.tf not in KLINE_INTERVALS and candle_source != "resampled":
+            # the exchange has no klines for custom timeframes, neither for the history nor the kline stream
+            logger.warning("%s %s is a custom timeframe, its candles are resampled", self.contract.symbol, self.tf)
+            candle_source = "resampled"
+        self.candle_source = candle_source
+
+        if other_params.get('evaluation_ms') is not None:
+            self.evaluation_cadence = int(other_params['evaluation_ms'])
+
+        self.shared_candles = bool(other_params.get('shared_candles', False))
+        self.exchange_exits = bool(other_params.get('exchange_exits', True))
+
+    def evaluate(self, tick_type: str, ticks: int = 1):
+        # enforces the evaluation cadence, check_trade only runs when it is due
+        self.ticks_received += ticks
+
+        if self.evaluation_cadence == "tick":
+            due = True
+        elif self.evaluation_cadence == "candle_close":
+            due = tick_type == "new_candle"
+        else:
+            now = time.monotonic() * 1000
+            due = tick_type == "new_candle" or now - self._last_evaluation >= self.evaluation_cadence
+            if due:
+                self._last_evaluation = now
+
+        if due:
+            self.evaluations += 1
+            self.check_trade(tick_type)
+
+    def process_trades(self, trades: typing.List[typing.Tuple[float, float, int]],
+                       received: typing.Optional[float] = None):
+        self._received_at = received
+        last_ts = self.candles[-1].timestamp
+        tick_type = self.parse_trade_batch(trades)
+        self._record_parsed(last_ts)
+        # slow samples are counted by the latency report, instead of the former warning for every trade over 2 s
+        latency.record(self.latency_key, "exchange_to_parse", server_time.now_ms() - trades[-1][2])
+        self._publish_candles()
+        self.evaluate(tick_type, len(trades))
+
+    def process_resampled(self, new_candles: int, trades: typing.List[typing.Tuple[float, float, int]],
+                          received: typing.Optional[float] = None):
+        # the candles were already updated with the batch by the symbol's series, new_candles is how many it started
+        self._check_stream()
+        self._received_at = received
+        self._record_parsed(self.candles[-1].timestamp - new_candles * self.tf_equiv)
+        latency.record(self.latency_key, "exchange_to_parse", server_time.now_ms() - trades[-1][2])
+        # Check take profit/ stop loss against every price of the batch
+        prices = [trade[0] for trade in trades]
+        self._check_exits(max(prices), min(prices))
+        self._publish_candles()
+        self.evaluate("new_candle" if new_candles > 0 else "same_candle", len(trades))
+
+    def process_kline(self, kline: typing.Dict, received: typing.Optional[float] = None):
+        self._received_at = received
+        last_ts = self.candles[-1].timestamp
+        tick_type = self.parse_kline(kline)
+        self._record_parsed(last_ts)
+        self._publish_candles()
+        self.evaluate(tick_type)
+
+    def _record_parsed(self, previous_last_ts: int):
+        self._parsed_at = time.monotonic()
+        if self._received_at is not None:
+            latency.record(self.latency_key, "receive_to_parse", (self._parsed_at - self._received_at) * 1000)
+
+        new_candles = int((self.candles[-1].timestamp - previous_last_ts) / self.tf_equiv)
+        if new_candles > 0:
+            metrics.inc("cryptorade_candles_total", new_candles, exchange=self.exchange, symbol=self.contract.symbol,
+                        timeframe=self.tf)
+
+    def _publish_candles(self):
+        # one shared memory write per batch, the buffer is created on the first one so it starts with the history
+        if not self.shared_candles:
+            return
+
+        buffer = self._shared_buffer
+        if buffer is None:
+            from shared_candles import CandleBufferWriter
+
+            try:
+                buffer = CandleBufferWriter.create(self.exchange, self.contract.symbol, self.tf, self.strat_name)
+            except Exception as e:
+                logger.error("Could not publish %s %s candles in shared memory: %s", self.contract.symbol, self.tf, e)
+                self.shared_candles = False
+                return
+            self._shared_buffer = buffer
+
+        buffer.sync(self.candles)
+
+    def release(self):
+        # deactivation: the shared memory block is unlinked now instead of when the process exits
+        self.shared_candles = False
+        buffer = self._shared_buffer
+        self._shared_buffer = None
+        if buffer is not None:
+            buffer.close()
+
+    def parse_trade_batch(self, trades: typing.List[typing.Tuple[float, float, int]]) -> str:
+        # same candles as calling parse_trades for every trade, but each run of trades within one candle updates it
+        # once, and the exits are checked once per batch
+        self._check_stream()
+
+        result = "same_candle"
+        if len(trades) == 0:
+            return result
+        batch_high = batch_low = trades[0][0]
+        start = 0
+
+        while start < len(trades):
+            price, size, timestamp = trades[start]
+
+            if timestamp >= self.candles[-1].timestamp + self.tf_equiv:
+                batch_high = max(batch_high, price)
+                batch_low = min(batch_low, price)
+                # opens the new candle (and adds the missing ones)
+                if self.parse_trades(price, size, timestamp) == "new_candle":
+                    result = "new_candle"
+                start += 1
+                continue
+
+            candle_end = self.candles[-1].timestamp + self.tf_equiv
+            high = price
+            low = price
+            volume = 0.0
+            end = start
+            while end < len(trades) and trades[end][2] < candle_end:
+                if trades[end][0] > high:
+                    high = trades[end][0]
+                if trades[end][0] < low:
+                    low = trades[end][0]
+                volume += trades[end][1]
+                end += 1
+
+            last_candle = self.candles[-1]
+            last_candle.close = trades[end - 1][0]
+            last_candle.volume += volume
+            if high > last_candle.high:
+                last_candle.high = high
+            if low < last_candle.low:
+                last_candle.low = low
+
+            batch_high = max(batch_high, high)
+            batch_low = min(batch_low, low)
+            start = end
+
+        # Check take profit/ stop loss against every price of the batch, not only the last one, also when its trades
+        # only opened new candles
+        self._check_exits(batch_high, batch_low)
+
+        return result
+
+    def parse_kline(self, kline: typing.Dict) -> str:
+        # every kline message carries the whole current candle, so it replaces the values instead of aggregating
+        self._check_stream()
+        last_candle = self.candles[-1]
+
+        timestamp = kline['t']
+
+        # SAME CANDLE
+        if timestamp <= last_candle.timestamp:
+            if timestamp == last_candle.timestamp:
+                last_candle.open = float(kline['o'])
+                last_candle.high = float(kline['h'])
+                last_candle.low = float(kline['l'])
+                last_candle.close = float(kline['c'])
+                last_candle.volume = float(kline['v'])
+
+                # Check take profit/ stop loss
+                self._check_exits()
+
+            return "same_candle"
+
+        # MISSING CANDLES
+        if timestamp >= last_candle.timestamp + 2 * self.tf_equiv:
+            self._request_backfill(last_candle.timestamp)
+
+            while last_candle.timestamp + self.tf_equiv < timestamp:
+                last_candle = Candle.from_values(last_candle.timestamp + self.tf_equiv, last_candle.open,
+                                                 last_candle.high, last_candle.low, last_candle.close, 0.0)
+                self.candles.append(last_candle)
+
+        # NEW CANDLE
+        self.candles.append(Candle.from_values(timestamp, float(kline['o']), float(kline['h']), float(kline['l']),
+                                               float(kline['c']), float(kline['v'])))
+
+        logger.info("Added new candle for %s %s from kline stream", self.contract.symbol, self.tf)
+        return "new_candle"
+
+    def _request_backfill(self, start_ts: int):
+        # the REST call runs on its own thread so the websocket thread keeps processing trades meanwhile
+        if self._backfill_running:
+            return
+        self._backfill_running = True
+
+        t = Thread(target=self._fetch_backfill, args=(start_ts,))
+        t.start()
+
+    def _fetch_backfill(self, start_ts: int):
+        try:
+            candles = self.client.get_candles_since(self.contract, self.tf, start_ts)
+            if len(candles) > 0:
+                # handed over to the websocket thread, which owns self.candles
+                self._backfill_results.append(candles)
+        except Exception as e:
+            logger.error("Error while backfilling candles for %s %s: %s", self.contract.symbol, self.tf, e)
+        finally:
+            self._backfill_running = False
+
+    def _apply_backfill(self, fetched: typing.List[Candle]):
+        last_ts = self.candles[-1].timestamp
+        patched = 0
+
+        for candle in fetched:
+            index = len(self.candles) - 1 - int((last_ts - candle.timestamp) / self.tf_equiv)
+            if index < 0 or index >= len(self.candles) or self.candles[index].timestamp != candle.timestamp:
+                continue
+
+            existing = self.candles[index]
+            if index == len(self.candles) - 1:
+                # still forming: trades processed after the REST response are only in our own candle
+                existing.open = candle.open
+                existing.high = max(existing.high, candle.high)
+                existing.low = min(existing.low, candle.low)
+                existing.volume = max(existing.volume, candle.volume)
+            else:
+                existing.open = candle.open
+                existing.high = candle.high
+                existing.low = candle.low
+                existing.close = candle.close
+                existing.volume = candle.volume
+            patched += 1
+
+        buffer = self._shared_buffer
+        if buffer is not None:
+            buffer.write_all(self.candles)
+
+        logger.info("Backfilled %s candles for %s %s from REST", patched, self.contract.symbol, self.tf)
+
+    def on_order_filled(self, trade: Trade, order: Order, purpose: str):
+        # actual fill of an entry or exit order, pushed by the user data stream (order_manager.py): the trade was
+        # opened or closed at the last candle's close, the fill replaces that estimate
+        self._add_commission(trade, order.commission)
+
+        if purpose == "entry":
+            positions.update_entry(self, trade, order.avg_price, order.filled_quantity)
+            self._add_log(f"Entry on {self.contract.symbol} {self.tf} filled: {order.filled_quantity} at "
+                          f"{round(order.avg_price, 8)}")
+            journal.record("entry_filled", self, trade)
+        else:
+            positions.reprice_close(self, trade, order.avg_price)
+            self._add_log(f"Exit on {self.contract.symbol} {self.tf} filled at {round(order.avg_price, 8)}")
+            journal.record("exit_filled", self, trade)
+
+    @staticmethod
+    def _add_commission(trade: Trade, commission: typing.Dict[str, float]):
+        if len(commission) == 0:
+            return
+        if trade.commission is None:
+            trade.commission = dict()
+        for asset, amount in commission.items():
+            trade.commission[asset] = trade.commission.get(asset, 0.0) + amount
 
     def _open_position(self, signal_result: int):
         # market order
+        self._signal_at = time.monotonic()
+        if self._parsed_at is not None:
+            latency.record(self.latency_key, "parse_to_signal", (self._signal_at - self._parsed_at) * 1000)
 
         trade_size = self.client.get_trade_size(self.contract, self.candles[-1].close, self.usdt_input)
         # number of units to buy
@@ -176,8 +505,16 @@ class Strategy:
         position_side = "long" if signal_result == 1 else "short"
 
         self._add_log(f"{position_side.capitalize()} signal on {self.contract.symbol} {self.tf}")
+        metrics.inc("cryptorade_signals_total", strategy=self.strat_name, symbol=self.contract.symbol,
+                    timeframe=self.tf, side=position_side)
 
+        sent_at = time.monotonic()
+        latency.record(self.latency_key, "signal_to_send", (sent_at - self._signal_at) * 1000)
         order_status = self.client.place_order(self.contract, "MARKET", trade_size, order_side, self.usdt_input, "ENTRY")
+        ack_at = time.monotonic()
+        latency.record(self.latency_key, "send_to_ack", (ack_at - sent_at) * 1000)
+        if self._received_at is not None:
+            latency.record(self.latency_key, "receive_to_ack", (ack_at - self._received_at) * 1000)
         avg_fill_price = self.candles[-1].close
 
         if order_status is not None:
@@ -185,13 +522,95 @@ class Strategy:
 
             self.ongoing_position = True
 
+            # the response of a market order has its fills: the exits are sized from what was actually bought
+            if order_status.executed_qty > 0:
+                trade_size = order_status.executed_qty
+            exit_size = trade_size - order_status.commission.get(self.contract.base_asset, 0.0)
+
             new_trade = Trade({"time": int(time.time() * 1000), "entry_price": avg_fill_price,
                                "contract": self.contract, "strategy": self.strat_name, "side": position_side,
                                "status": "open", "pnl": 0, "quantity": trade_size, "entry_id": order_status.order_id})
             self.trades.append(new_trade)
+            positions.open(self, new_trade)
             self._set_exit_points(new_trade)
+            # journaled before the exit orders exist, so a crash while they are placed leaves a trade to restore
+            journal.record("open", self, new_trade)
+            orders.track_order(self, new_trade, order_status.order_id, "entry")
+            self._protect_later(new_trade, exit_size)
         # make sure spot doesn't short
 
+    def restore_trades(self, rows: typing.List[typing.Dict]):
+        # open trades of a previous run, read from the trade journal when the strategy starts
+        restored = []
+        for row in rows:
+            trade = Trade({"time": row['trade_time'], "entry_price": row['entry_price'], "contract": self.contract,
+                           "strategy": self.strat_name, "side": row['side'], "status": "open", "pnl": 0,
+                           "quantity": row['quantity'], "entry_id": row['entry_id']})
+            trade.stop_loss_line = row['stop_loss_line']
+            trade.profit_line = row['profit_line']
+            trade.exit_orders = row.get('exit_orders')
+            self.trades.append(trade)
+            restored.append(trade)
+            positions.open(self, trade)
+            if trade.exit_orders is not None:
+                self._reconcile_exit(trade)
+            elif trade.stop_loss_line is None or trade.profit_line is None:
+                self._pending_exits.append(trade)
+            else:
+                self._protect(trade)
+
+        # reconciling the exit orders may have closed some of them already
+        still_open = [trade for trade in restored if trade.status == "open"]
+        if len(still_open) > 0:
+            self.ongoing_position = True
+            self.stop_loss_line = still_open[-1].stop_loss_line
+            self.profit_line = still_open[-1].profit_line
+
+        if len(rows) > 0:
+            self._add_log(f"Restored {len(rows)} open trade(s) on {self.contract.symbol} {self.tf} from the journal")
+
+    def checkpoint_state(self, max_candles: int) -> typing.Dict:
+        # everything needed to rebuild the strategy without refetching its history (see checkpoint.py)
+        open_trades = [{"trade_time": t.time, "entry_price": t.entry_price, "side": t.side, "quantity": t.quantity,
+                        "entry_id": t.entry_id, "stop_loss_line": t.stop_loss_line, "profit_line": t.profit_line,
+                        "exit_orders": t.exit_orders} for t in list(self.trades) if t.status == "open"]
+
+        return {
+            "strategy_key": self.strategy_key,
+            "exchange": self.exchange,
+            "symbol": self.contract.symbol,
+            "timeframe": self.tf,
+            "usdt_input": self.usdt_input,
+            "risk_to_reward": self.risk_to_reward,
+            "parameters": self.other_params,
+            "candles": [(c.timestamp, c.open, c.high, c.low, c.close, c.volume) for c in self.candles[-max_candles:]],
+            "ongoing_position": self.ongoing_position,
+            "stop_loss_line": self.stop_loss_line,
+            "profit_line": self.profit_line,
+            "open_trades": open_trades,
+            "extra": {attr: getattr(self, attr) for attr in self.checkpoint_attrs},
+        }
+
+    def restore_state(self, state: typing.Dict, restore_trades: bool = True):
+        self.candles = [Candle.from_values(*c) for c in state['candles']]
+        if 'strategy_key' in state:  # older checkpoints don't have it, the caller assigns one
+            self.strategy_key = state['strategy_key']
+        for attr, value in state['extra'].items():
+            setattr(self, attr, value)
+
+        if restore_trades:
+            # without a trade journal, the checkpoint is the only record of the open trades; the position and its
+            # lines follow the trades that are still open, not the checkpointed values
+            self.restore_trades(state['open_trades'])
+
+    def top_up_candles(self, fetched: typing.List[Candle]):
+        # klines since the last checkpointed candle: it is replaced (it was still forming), the newer ones added
+        for candle in fetched:
+            if candle.timestamp == self.candles[-1].timestamp:
+                self.candles[-1] = candle
+            elif candle.timestamp > self.candles[-1].timestamp:
+                self.candles.append(candle)
+
     def _atr(self) -> float:
         atr = 0.0
         for i in self.candles[-15:-1]:
@@ -199,6 +618,7 @@ class Strategy:
         return atr / 14
 
     def _get_pivots(self, closes: typing.List[float], highs_or_lows: str):
+        import numpy as np
 
         if highs_or_lows == "highs":
             # resistance
@@ -309,44 +729,142 @@ class Strategy:
         else:
             logger.error("Invalid trade side for %s %s", self.contract.symbol, self.tf)
 
-    def _check_exit(self, trade: Trade):
-        tp_triggered = False
-        sl_triggered = False
-
-        if self.profit_line is None or self.stop_loss_line is None:
-            self._set_exit_points(trade)
+    def _check_exits(self, high: typing.Optional[float] = None, low: typing.Optional[float] = None):
+        # the trigger index only returns the trades (of any strategy on this symbol) whose exit line was crossed,
+        # high / low are the extremes of the batch of trades just parsed
+        while len(self._pending_exits) > 0:
+            trade = self._pending_exits.pop(0)
+            if trade.status == "open":
+                self._set_exit_points(trade)
+                journal.record("exit_points", self, trade)
+                self._protect_later(trade)
 
         price = self.candles[-1].close
-        if trade.side.upper() == "LONG":
-            if price >= self.profit_line:
-                tp_triggered = True
-            if price <= self.stop_loss_line:
-                sl_triggered = True
+        for strategy, trade, sl_triggered in triggers.crossed(self.exchange, self.contract.symbol, price, high, low):
+            strategy._exit_position(trade, sl_triggered, price)
+
+    def _protect_later(self, trade: Trade, quantity: typing.Optional[float] = None):
+        # from the dispatch thread: the OCO is a REST request, it must not hold up the market data
+        if self.exchange_exits:
+            Thread(target=self._protect, args=(trade, quantity)).start()
+        else:
+            self._protect(trade, quantity)
+
+    def _protect(self, trade: Trade, quantity: typing.Optional[float] = None):
+        # OCO on the exchange when possible, so the exit doesn't depend on this process; otherwise checked here
+        # quantity: what the entry left on the account, by default the trade's minus the commission paid in the base
+        # asset (taken from the bought asset, it can't be sold back)
+        if self.exchange_exits:
+            if quantity is None:
+                quantity = trade.quantity - (trade.commission or dict()).get(self.contract.base_asset, 0.0)
+            order_list = self.client.place_oco_order(self.contract, trade.side, quantity, trade.profit_line,
+                                                     trade.stop_loss_line, self.usdt_input)
+            if order_list is not None:
+                trade.exit_orders = (order_list.list_id, order_list.take_profit_id, order_list.stop_loss_id)
+                journal.record("exit_points", self, trade)
+                orders.track_exit(self, trade)
+                self._add_log(f"Exit orders placed on {self.exchange} for {self.contract.symbol} {self.tf}")
+                return
+            self._add_log(f"Exit orders could not be placed for {self.contract.symbol} {self.tf}, "
+                          f"stop loss and take profit checked by the bot")
+        triggers.add(self, trade)
+
+    def _reconcile_exit(self, trade: Trade):
+        # restored trade with exit orders: they may have filled or been cancelled while the bot was stopped
+        if not self.exchange_exits:
+            self._take_back_exit(trade)
+            return
 
-        if trade.side.upper() == "SHORT":
-            if price <= self.profit_line:
-                tp_triggered = True
-            if price >= self.stop_loss_line:
-                sl_triggered = True
+        orders.track_exit(self, trade)
+        for order_id, line in ((trade.exit_orders[1], trade.profit_line), (trade.exit_orders[2], trade.stop_loss_line)):
+            order_status = self.client.get_order_status(self.contract, order_id)
+            if order_status is None:
+                continue  # unknown for now, the user data stream will tell
+            if order_status.status == "filled":
+                # a stop market leg reports no price, its line is the closest estimate
+                orders.leg_filled(self.exchange, order_id, order_status.avg_price or line)
+            elif order_status.status.upper() in TERMINAL_STATUSES:
+                orders.leg_ended(self.exchange, order_id)
+
+    def _take_back_exit(self, trade: Trade):
+        # exchange_exits off (always in worker processes, which have no user data stream): nothing follows the legs,
+        # so a filled leg closes the trade now, otherwise the OCO is cancelled and the exit lines are checked here
+        legs = ((trade.exit_orders[1], trade.profit_line, False), (trade.exit_orders[2], trade.stop_loss_line, True))
+        for attempt in range(2):
+            ended = 0
+            for order_id, line, sl_triggered in legs:
+                order_status = self.client.get_order_status(self.contract, order_id)
+                if order_status is None:
+                    continue
+                if order_status.status == "filled":
+                    self.on_exit_filled(trade, sl_triggered, order_status.avg_price or line)
+                    return
+                if order_status.status.upper() in TERMINAL_STATUSES:
+                    ended += 1
+            if ended == len(legs):
+                break
+            if attempt == 0:
+                self.client.cancel_order(self.contract, trade.exit_orders[1])  # cancels the whole order list
+        else:
+            self._add_log(f"Exit orders of {self.contract.symbol} {self.tf} trade could not be cancelled, "
+                          f"manage them on {self.exchange}")
+            return
 
-        if tp_triggered or sl_triggered:
-            self._add_log((f"{'Stop loss' if sl_triggered else 'Take profit'} for {self.contract.symbol} {self.tf}"))
+        trade.exit_orders = None
+        journal.record("exit_points", self, trade)
+        triggers.add(self, trade)
+        self._add_log(f"Exit orders of {self.contract.symbol} {self.tf} trade cancelled, stop loss and take profit "
+                      f"checked by the bot")
+
+    def on_exit_filled(self, trade: Trade, sl_triggered: bool, price: float,
+                       commission: typing.Optional[typing.Dict[str, float]] = None):
+        # called by the order manager (user data stream thread) when an exit order filled on the exchange
+        self._add_commission(trade, commission or dict())
+        self._add_log(f"{'Stop loss' if sl_triggered else 'Take profit'} filled on {self.exchange} for "
+                      f"{self.contract.symbol} {self.tf} at {price}")
+        trade.status = "closed"
+        positions.close(self, trade, price)
+        journal.record("closed", self, trade)
+        self.stop_loss_line = None
+        self.profit_line = None
+        self.ongoing_position = False
+        Thread(target=self.client.settle_exit, args=(self.contract, trade.side, self.usdt_input)).start()
 
-            order_side = "SELL" if trade.side == "long" else "BUY"
-            order_status = self.client.place_order(self.contract, "MARKET", trade.quantity, order_side, self.usdt_input, "EXIT")
+    def on_exit_cancelled(self, trade: Trade):
+        # the exit orders ended without a fill: the exit lines are checked here from now on
+        self._add_log(f"Exit orders of {self.contract.symbol} {self.tf} trade ended without a fill, "
+                      f"stop loss and take profit checked by the bot")
+        trade.exit_orders = None
+        journal.record("exit_points", self, trade)
+        triggers.add(self, trade)
 
-            if order_status is not None:
-                self._add_log(f"Exit order on {self.contract.symbol} {self.tf} placed successfully")
-                trade.status = "closed"
-                self.stop_loss_line = None
-                self.profit_line = None
-                self.ongoing_position = False
+    def _exit_position(self, trade: Trade, sl_triggered: bool, price: float):
+        self._add_log((f"{'Stop loss' if sl_triggered else 'Take profit'} for {self.contract.symbol} {self.tf}"))
+
+        order_side = "SELL" if trade.side == "long" else "BUY"
+        sent_at = time.monotonic()
+        order_status = self.client.place_order(self.contract, "MARKET", trade.quantity, order_side, self.usdt_input, "EXIT")
+        latency.record(self.latency_key, "exit_send_to_ack", (time.monotonic() - sent_at) * 1000)
+
+        if order_status is not None:
+            self._add_log(f"Exit order on {self.contract.symbol} {self.tf} placed successfully")
+            trade.status = "closed"
+            positions.close(self, trade, price)
+            journal.record("closed", self, trade)
+            self.stop_loss_line = None
+            self.profit_line = None
+            self.ongoing_position = False
+            orders.track_order(self, trade, order_status.order_id, "exit")
+        else:
+            # checked again on the next price
+            triggers.add(self, trade)
 
 
 class TechnicalStrategy(Strategy):
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, usdt_input: float,
                  risk_to_reward: float, other_params: typing.Dict):
         super().__init__(client, contract, exchange, timeframe, usdt_input, risk_to_reward, "Technical")
+        self._set_stream_options(other_params)
 
         self._ema_fast = other_params['ema_fast']
         self._ema_slow = other_params['ema_slow']
@@ -357,6 +875,8 @@ class TechnicalStrategy(Strategy):
         # (go to self._extra_params)
 
     def _rsi(self):
+        import pandas as pd
+
         close_list = []
         for candle in self.candles:
             close_list.append(candle.close)
@@ -378,6 +898,8 @@ class TechnicalStrategy(Strategy):
         return rsi.iloc[-2]
 
     def _macd(self) -> typing.Tuple[float, float]:
+        import pandas as pd
+
         # provide list of close prices
         close_list = []
         for candle in self.candles:
@@ -413,9 +935,13 @@ class TechnicalStrategy(Strategy):
 
 
 class BreakoutStrategy(Strategy):
+    intra_candle_signals = True
+    default_cadence = "tick"
+
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, usdt_input: float,
                  risk_to_reward: float, other_params: typing.Dict):
         super().__init__(client, contract, exchange, timeframe, usdt_input, risk_to_reward, "Breakout")
+        self._set_stream_options(other_params)
 
         self._min_volume = other_params['min_volume']
 
@@ -438,6 +964,7 @@ class MacdEmaStrategy(Strategy):
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, usdt_input: float,
                  risk_to_reward: float, other_params: typing.Dict):
         super().__init__(client, contract, exchange, timeframe, usdt_input, risk_to_reward, "MACD_EMA")
+        self._set_stream_options(other_params)
 
         self._macd_ema_fast = other_params['macd_ema_fast']
         self._macd_ema_slow = other_params['macd_ema_slow']
@@ -448,6 +975,8 @@ class MacdEmaStrategy(Strategy):
         # (go to self._extra_params)
 
     def _ema(self) -> float:
+        import pandas as pd
+
         close_list = []
         for candle in self.candles:
             close_list.append(candle.close)
@@ -457,6 +986,8 @@ class MacdEmaStrategy(Strategy):
         return ema_value.iloc[-2]
 
     def _macd_last_two(self) -> typing.Tuple[float, float, float, float, float]:
+        import pandas as pd
+
         # provide list of close prices
         close_list = []
         for candle in self.candles:
@@ -501,14 +1032,20 @@ class MacdEmaStrategy(Strategy):
 
 
 class EmaRsiStochStrategy(Strategy):
+    checkpoint_attrs = ("rsis", "candle_at_rsi_pivot")
+
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, usdt_input: float,
                  risk_to_reward: float, other_params: typing.Dict):
         super().__init__(client, contract, exchange, timeframe, usdt_input, risk_to_reward, "EMA_RSI_Scalp")
+        self._set_stream_options(other_params)
 
         self.rsis = None    # once this list has been made, the current RSI will be given by self.rsis[-2]
-        self.candle_at_rsi_pivot: Candle = Candle([1, 2, 3, 4, 5, 6], 'dummy_timeframe', "Spot")  # dummy candle
+        self.candle_at_rsi_pivot: Candle = Candle.from_values(1, 2.0, 3.0, 4.0, 5.0, 6.0)  # dummy candle
 
     def _getPrevRsiPivot(self, closes: typing.List[float], highs_or_lows: str):
+        import pandas as pd
+        from ta import momentum
+
         rsiSeries = momentum.RSIIndicator(pd.Series(closes)).rsi()
         rsiList = [i for i in rsiSeries]    # list of all RSIs, from which we'll find the last pivot point in the desired direction
         self.rsis = rsiList
@@ -521,11 +1058,16 @@ class EmaRsiStochStrategy(Strategy):
         return rsi_pivot
 
     def _ema(self, close_list: typing.List[float], period: int) -> float:
+        import pandas as pd
+
         closes = pd.Series(close_list)
         ema_value = closes.ewm(span=period).mean()
         return ema_value.iloc[-2]
 
     def _stochasic_crossover(self, close_list: typing.List[float], long_or_short: str):
+        import pandas as pd
+        from ta import momentum
+
         stoch_rsi_indicator_object = momentum.StochRSIIndicator(pd.Series(close_list))
         # %k is fast line and %d is slow line
         k_series = stoch_rsi_indicator_object.stochrsi_k()
@@ -585,4 +1127,12 @@ class EmaRsiStochStrategy(Strategy):
             signal_result = self._check_signal()
 
             if signal_result in [-1, 1]:
-                self._open_position(signal_result)
\ No newline at end of file
+                self._open_position(signal_result)
+
+# names used by the strategy editor and by headless config files
+STRATEGY_TYPES = {
+    "Technical": TechnicalStrategy,
+    "Breakout": BreakoutStrategy,
+    "MACD_EMA": MacdEmaStrategy,
+    "EmaRsiStoch": EmaRsiStochStrategy,
+}
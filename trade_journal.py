@@ -0,0 +1,190 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import typing
+
+from models import Trade
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+# Trade journal in SQLite (WAL mode), so open positions survive a crash or a restart.
+#
+# - events: append-only log of every trade lifecycle event (open, exit_points, closed)
+# - trades: current state of each trade, indexed by strategy, symbol, status and time, read at startup to give the
+#   strategies back their open trades
+#
+# The strategies only put the events in a queue; a writer thread stores them, several per transaction.
+
+DEFAULT_JOURNAL_PATH = "trade_journal.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    time INTEGER NOT NULL,
+    strategy_key TEXT NOT NULL,
+    trade_time INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_strategy_time ON events (strategy_key, time);
+CREATE INDEX IF NOT EXISTS events_trade ON events (trade_time);
+
+CREATE TABLE IF NOT EXISTS trades (
+    strategy_key TEXT NOT NULL,
+    trade_time INTEGER NOT NULL,
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    timeframe TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    side TEXT NOT NULL,
+    status TEXT NOT NULL,
+    entry_price REAL,
+    quantity REAL,
+    entry_id INTEGER,
+    stop_loss_line REAL,
+    profit_line REAL,
+    updated INTEGER NOT NULL,
+    exit_orders TEXT,
+    PRIMARY KEY (strategy_key, trade_time)
+);
+CREATE INDEX IF NOT EXISTS trades_status ON trades (status, strategy_key);
+CREATE INDEX IF NOT EXISTS trades_symbol ON trades (symbol, trade_time);
+CREATE INDEX IF NOT EXISTS trades_time ON trades (trade_time);
+"""
+
+_UPSERT = """
+INSERT INTO trades (strategy_key, trade_time, exchange, symbol, timeframe, strategy, side, status, entry_price,
+                    quantity, entry_id, stop_loss_line, profit_line, updated, exit_orders)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (strategy_key, trade_time) DO UPDATE SET
+    status = excluded.status, entry_price = excluded.entry_price, quantity = excluded.quantity,
+    entry_id = excluded.entry_id, stop_loss_line = excluded.stop_loss_line, profit_line = excluded.profit_line,
+    updated = excluded.updated, exit_orders = excluded.exit_orders
+"""
+
+
+class TradeJournal:
+    def __init__(self):
+        self.path: typing.Optional[str] = None
+        self._queue: "queue.Queue[typing.Optional[typing.Tuple]]" = queue.Queue()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def open(self, path: str = DEFAULT_JOURNAL_PATH):
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_SCHEMA)
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(trades)")]
+        if "exit_orders" not in columns:  # journal created before the exchange-side exit orders
+            connection.execute("ALTER TABLE trades ADD COLUMN exit_orders TEXT")
+        connection.close()
+
+        self.path = path
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("Trade journal opened: %s", path)
+
+    def close(self):
+        # waits for the queued events to be written
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.path = None
+
+    ##### WRITES (strategy threads) #####
+
+    def record(self, event: str, strategy: "Strategy", trade: Trade):
+        if self.path is None:
+            return
+
+        now = int(time.time() * 1000)
+        row = (strategy.strategy_key, trade.time, strategy.exchange, strategy.contract.symbol, strategy.tf,
+               strategy.strat_name, trade.side, trade.status, trade.entry_price, trade.quantity, trade.entry_id,
+               trade.stop_loss_line, trade.profit_line, now,
+               json.dumps(trade.exit_orders) if trade.exit_orders is not None else None)
+        self._queue.put((event, row))
+
+    def _run(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, a power loss can only lose the last commits
+
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+
+            try:
+                with connection:
+                    for event, row in batch:
+                        data = {"side": row[6], "status": row[7], "entry_price": row[8], "quantity": row[9],
+                                "entry_id": row[10], "stop_loss_line": row[11], "profit_line": row[12],
+                                "exit_orders": json.loads(row[14]) if row[14] is not None else None}
+                        connection.execute("INSERT INTO events (time, strategy_key, trade_time, event, data) "
+                                           "VALUES (?, ?, ?, ?, ?)", (row[13], row[0], row[1], event, json.dumps(data)))
+                        connection.execute(_UPSERT, row)
+            except sqlite3.Error as e:
+                logger.error("Error while writing %s events to the trade journal: %s", len(batch), e)
+
+        connection.close()
+
+    ##### READS #####
+
+    def open_trades(self, strategy_key: str) -> typing.List[typing.Dict]:
+        if self.path is None:
+            return []
+
+        connection = sqlite3.connect(self.path)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = connection.execute("SELECT * FROM trades WHERE status = 'open' AND strategy_key = ? "
+                                      "ORDER BY trade_time", (strategy_key,)).fetchall()
+        finally:
+            connection.close()
+        trades = [dict(row) for row in rows]
+        for trade in trades:
+            if trade['exit_orders'] is not None:
+                trade['exit_orders'] = tuple(json.loads(trade['exit_orders']))
+        return trades
+
+    def log_unclaimed(self, claimed: typing.Set[str], path: typing.Optional[str] = None):
+        # open trades whose strategy isn't running: nothing manages their exits (nor repays their loans) until a
+        # strategy with the same key is started. path: the journal of the worker processes, when not open here
+        path = path or self.path
+        if path is None:
+            return
+
+        connection = sqlite3.connect(path)
+        try:
+            rows = connection.execute("SELECT strategy_key, COUNT(*) FROM trades WHERE status = 'open' "
+                                      "GROUP BY strategy_key").fetchall()
+        except sqlite3.Error as e:
+            logger.error("Error while reading the trade journal: %s", e)
+            return
+        finally:
+            connection.close()
+        for strategy_key, count in rows:
+            if strategy_key not in claimed:
+                logger.warning("%s open trade(s) of %s in the trade journal are not managed by a running strategy",
+                               count, strategy_key)
+
+
+journal = TradeJournal()